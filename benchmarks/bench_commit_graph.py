@@ -0,0 +1,97 @@
+"""Benchmark gitrisky's history queries with and without a commit-graph.
+
+Usage: python benchmarks/bench_commit_graph.py <repo> [--fixes N]
+
+The repository can be created with benchmarks/make_repo.py. Any existing
+commit-graph is removed first, and one is written (as 'gitrisky train
+--commit-graph' would) half way through.
+"""
+
+import argparse
+import glob
+import os
+import shutil
+import time
+
+from gitrisky.gitcmds import count_commits, get_bugfix_commits, \
+    get_git_dir, get_git_log, link_fixes_to_bugs, write_commit_graph
+
+
+def _time(func, repeat=3):
+    """Get the best wall clock time of several calls to a function."""
+
+    best = float('inf')
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def _commit_graph_paths():
+    """Get the commit-graph file, or chain of split commit-graph files."""
+
+    info_dir = os.path.join(get_git_dir(), 'objects', 'info')
+
+    return glob.glob(os.path.join(info_dir, 'commit-graph*'))
+
+
+def _remove_commit_graph():
+
+    for path in _commit_graph_paths():
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+
+def run(n_fixes):
+
+    fixes = get_bugfix_commits()[:n_fixes]
+
+    queries = [
+        ('rev-list --count', lambda: count_commits()),
+        ('log --numstat', lambda: sum(1 for _ in get_git_log())),
+        ('log --all --grep', get_bugfix_commits),
+        ('blame {n} fixes'.format(n=len(fixes)),
+         lambda: link_fixes_to_bugs(fixes)),
+    ]
+
+    _remove_commit_graph()
+    assert not _commit_graph_paths()
+
+    without = [_time(query) for _, query in queries]
+
+    write_time = _time(write_commit_graph, repeat=1)
+    assert _commit_graph_paths()
+
+    with_graph = [_time(query) for _, query in queries]
+
+    print('{n} commits, commit-graph written in {t:.2f}s\n'
+          .format(n=count_commits(), t=write_time))
+    print('{:<20} {:>10} {:>10} {:>8}'
+          .format('query', 'without', 'with', 'speedup'))
+
+    for (name, _), before, after in zip(queries, without, with_graph):
+        print('{:<20} {:>9.2f}s {:>9.2f}s {:>7.1f}x'
+              .format(name, before, after, before / after))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('repo', help='the repository to benchmark')
+    parser.add_argument('--fixes', type=int, default=200,
+                        help='number of bugfix commits to blame '
+                             '(default: %(default)s)')
+    args = parser.parse_args()
+
+    os.chdir(args.repo)
+
+    run(args.fixes)
+
+
+if __name__ == '__main__':
+    main()
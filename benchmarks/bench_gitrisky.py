@@ -0,0 +1,192 @@
+"""Benchmark gitrisky end to end on a synthetic repository.
+
+Usage: python benchmarks/bench_gitrisky.py [--repo PATH] [--commits N]
+       [--files N] [--hunk-size N] [--fix-ratio R] [--json FILE]
+       [--compare FILE]
+
+Unless --repo is given a repository is generated with make_repo.py in a
+temporary directory. Each step is timed from scratch, without gitrisky's
+caches, and the best of several runs is reported. 'train' and 'predict' are
+timed as separate processes, so they include gitrisky's start up time as a
+user would see it.
+
+Save the results with --json and pass them to --compare on a later run to
+check a change for performance regressions: the script exits with an error if
+any step got slower by more than --tolerance.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from gitrisky.gitcmds import get_bugfix_commits, get_repo_dir, \
+    link_fixes_to_bugs
+from gitrisky.parsing import get_features, get_labels
+
+from make_repo import make_repo
+
+
+def _time(func, repeat):
+    """Get the best wall clock time of several calls to a function."""
+
+    best = float('inf')
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def _gitrisky(*args):
+    """Run a gitrisky command in a new process."""
+
+    subprocess.run([sys.executable, '-c',
+                    'from gitrisky.cli import cli; cli()'] + list(args),
+                   check=True, stdout=subprocess.DEVNULL)
+
+
+def run(repeat):
+    """Time each step of gitrisky in the current repository.
+
+    Returns
+    -------
+    results : dict{str: float}
+        The best time in seconds of each step.
+    """
+
+    fixes = get_bugfix_commits()
+
+    steps = [
+        ('get_features', lambda: get_features(use_cache=False)),
+        ('link_fixes_to_bugs', lambda: link_fixes_to_bugs(fixes)),
+        ('get_labels', lambda: get_labels(use_cache=False)),
+        ('train', lambda: _gitrisky('train', '--no-cache')),
+        ('predict', lambda: _gitrisky('predict')),
+        ('predict 100 commits', lambda: _gitrisky('predict', '-r',
+                                                  'HEAD~100..HEAD')),
+    ]
+
+    results = {}
+
+    for name, step in steps:
+        results[name] = _time(step, repeat)
+        print('{:<22} {:>9.3f}s'.format(name, results[name]), flush=True)
+
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Compare results against a baseline.
+
+    Returns
+    -------
+    regressed : list(str)
+        The steps which are more than tolerance slower than the baseline.
+    """
+
+    print('\n{:<22} {:>10} {:>10} {:>8}'
+          .format('step', 'baseline', 'now', 'ratio'))
+
+    regressed = []
+
+    for name, seconds in results.items():
+
+        if name not in baseline:
+            continue
+
+        ratio = seconds / baseline[name]
+        print('{:<22} {:>9.3f}s {:>9.3f}s {:>7.2f}x'
+              .format(name, baseline[name], seconds, ratio))
+
+        if ratio > 1 + tolerance:
+            regressed.append(name)
+
+    return regressed
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--repo',
+                        help='benchmark this repository rather than a '
+                             'generated one. gitrisky writes its model and '
+                             'caches to it')
+    parser.add_argument('--commits', type=int, default=5000,
+                        help='number of commits to generate '
+                             '(default: %(default)s)')
+    parser.add_argument('--files', type=int, default=1000,
+                        help='number of files to generate, in directories '
+                             'of 20 (default: %(default)s)')
+    parser.add_argument('--hunk-size', type=int, default=6,
+                        help='most lines changed in each file by each '
+                             'generated commit (default: %(default)s)')
+    parser.add_argument('--fix-ratio', type=float, default=0.25,
+                        help='fraction of generated commits which fix a bug '
+                             '(default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of times to run each step '
+                             '(default: %(default)s)')
+    parser.add_argument('--json', dest='json_path',
+                        help='write the results to this file')
+    parser.add_argument('--compare', dest='baseline_path',
+                        help='compare against results written by --json')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='fraction slower than the baseline a step may '
+                             'be before it counts as a regression '
+                             '(default: %(default)s)')
+    args = parser.parse_args()
+
+    settings = {'commits': args.commits, 'files': args.files,
+                'hunk_size': args.hunk_size, 'fix_ratio': args.fix_ratio}
+
+    cwd = os.getcwd()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+
+        if args.repo is None:
+            args.repo = os.path.join(tmpdir, 'repo')
+            make_repo(args.repo, n_commits=args.commits,
+                      n_dirs=-(-args.files // 20),
+                      files_per_dir=min(args.files, 20),
+                      hunk_size=args.hunk_size, fix_ratio=args.fix_ratio)
+        else:
+            settings = {'repo': os.path.abspath(args.repo)}
+
+        os.chdir(args.repo)
+        get_repo_dir.cache_clear()
+
+        try:
+            results = run(args.repeat)
+        finally:
+            # leave the temporary directory before it's removed
+            os.chdir(cwd)
+
+    if args.json_path is not None:
+        with open(args.json_path, 'w') as outfile:
+            json.dump({'settings': settings, 'results': results}, outfile,
+                      indent=2)
+
+    if args.baseline_path is not None:
+
+        with open(args.baseline_path) as infile:
+            baseline = json.load(infile)
+
+        if baseline['settings'] != settings:
+            print('warning: the baseline was run with {baseline}'
+                  .format(baseline=baseline['settings']))
+
+        regressed = compare(results, baseline['results'], args.tolerance)
+
+        if regressed:
+            sys.exit('slower than the baseline: {steps}'
+                     .format(steps=', '.join(regressed)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+"""Generate a synthetic git repository for benchmarking gitrisky.
+
+The history is streamed straight into 'git fast-import', so even repositories
+with hundreds of thousands of commits only take a minute or so to create.
+
+Usage: python benchmarks/make_repo.py <path> [--commits N] [--files N]
+       [--hunk-size N] [--fix-ratio R] [--seed S]
+"""
+
+import argparse
+import os
+import random
+import sys
+
+from subprocess import PIPE, Popen, check_call
+
+
+# commit messages which mention a bug or fix, and so are linked to the
+# commits they fix, and ones which don't
+FIX_MESSAGES = ['Fix bug in {module}',
+                'BUG: crash when {module} is empty']
+
+OTHER_MESSAGES = ['Add {module} option',
+                  'Refactor {module}',
+                  'Update docs for {module}',
+                  'Speed up {module}',
+                  'Tidy up {module}',
+                  'Add tests for {module}']
+
+AUTHORS = ['Ada <ada@example.com>',
+           'Grace <grace@example.com>',
+           'Linus <linus@example.com>',
+           'Barbara <barbara@example.com>']
+
+# the UTC offsets the authors commit from
+TZ_OFFSETS = ['-0600', '-0500', '+0000', '+0100', '+0530', '+0900']
+
+
+def _make_files(n_dirs, files_per_dir, n_lines):
+    """Create the initial contents of every file in the repository."""
+
+    return {'src/pkg{d}/mod{f}.py'.format(d=d, f=f):
+            ['line {i}'.format(i=i) for i in range(n_lines)]
+            for d in range(n_dirs) for f in range(files_per_dir)}
+
+
+def _write_commit(out, mark, parents, timestamp, message, changes):
+    """Write a single commit to the fast-import stream."""
+
+    author = random.choice(AUTHORS)
+    date = '{ts} {tz}'.format(ts=timestamp, tz=random.choice(TZ_OFFSETS))
+    message = message.encode('utf-8')
+
+    out.write('commit refs/heads/main\n'
+              'mark :{mark}\n'
+              'author {author} {date}\n'
+              'committer {author} {date}\n'
+              .format(mark=mark, author=author, date=date).encode('utf-8'))
+    out.write('data {n}\n'.format(n=len(message)).encode('utf-8') +
+              message + b'\n')
+
+    if parents:
+        out.write('from :{mark}\n'.format(mark=parents[0]).encode('utf-8'))
+    for parent in parents[1:]:
+        out.write('merge :{mark}\n'.format(mark=parent).encode('utf-8'))
+
+    for fname, lines in changes.items():
+        data = ('\n'.join(lines) + '\n').encode('utf-8')
+        out.write('M 100644 inline {fname}\ndata {n}\n'
+                  .format(fname=fname, n=len(data)).encode('utf-8') +
+                  data + b'\n')
+
+    out.write(b'\n')
+
+
+def make_repo(path, n_commits=100000, n_dirs=50, files_per_dir=20,
+              n_lines=50, files_per_commit=4, hunk_size=6, fix_ratio=0.25,
+              merge_every=100, seed=0):
+    """Create a git repository with a synthetic history.
+
+    Each commit modifies a hunk of lines in each of a few files. Every
+    merge_every commits a short side branch is merged back in, so the history
+    isn't linear. The merges combine the lines changed on each branch, with
+    the side branch's changes winning where both changed the same line.
+
+    Parameters
+    ----------
+    path : str
+        The directory to create the repository in.
+    n_commits : int, optional
+        The number of commits to create, including merge commits.
+    n_dirs : int, optional
+        The number of directories in the repository.
+    files_per_dir : int, optional
+        The number of files in each directory.
+    n_lines : int, optional
+        The number of lines in each file.
+    files_per_commit : int, optional
+        The most files each commit modifies.
+    hunk_size : int, optional
+        The most consecutive lines each commit modifies in a file.
+    fix_ratio : float, optional
+        The fraction of commits whose message marks them as a bugfix, which
+        roughly a quarter of commits in a real project do.
+    merge_every : int, optional
+        How often to merge in a side branch.
+    seed : int, optional
+        The random seed, so the same repository can be created again.
+    """
+
+    random.seed(seed)
+
+    check_call(['git', 'init', '-q', '-b', 'main', path])
+
+    files = _make_files(n_dirs, files_per_dir, n_lines)
+    fnames = sorted(files)
+
+    proc = Popen(['git', '-C', path, 'fast-import', '--quiet'], stdin=PIPE)
+    out = proc.stdin
+
+    timestamp = 1500000000
+    _write_commit(out, 1, [], timestamp, 'Initial commit', files)
+
+    head = 1
+    side = None
+
+    # the side branch's versions of the files it changed, and the versions
+    # at the branch point of the files changed on main since
+    side_files = {}
+    base_files = {}
+
+    for mark in range(2, n_commits + 1):
+
+        timestamp += random.randint(60, 6 * 3600)
+
+        # merge the side branch back in. fast-import takes the tree of the
+        # first parent, so the merge has to write the side branch's changes
+        if side is not None and mark % merge_every == 0:
+            changes = {}
+            for fname, theirs in side_files.items():
+                base = base_files.get(fname, files[fname])
+                files[fname] = [line if line != orig else ours for
+                                ours, orig, line in zip(files[fname], base,
+                                                        theirs)]
+                changes[fname] = files[fname]
+
+            _write_commit(out, mark, [head, side], timestamp,
+                          'Merge branch feature-{m}'.format(m=mark), changes)
+            head, side = mark, None
+            side_files, base_files = {}, {}
+            continue
+
+        # start a side branch every so often, otherwise commit to main
+        start_side = side is None and mark % merge_every == merge_every // 2
+        on_side = start_side or (side is not None and random.random() < 0.3)
+
+        changes = {}
+        for fname in random.sample(fnames,
+                                   random.randint(1, files_per_commit)):
+            if on_side:
+                lines = side_files.setdefault(
+                    fname, list(base_files.get(fname, files[fname])))
+            else:
+                if side is not None:
+                    base_files.setdefault(fname, list(files[fname]))
+                lines = files[fname]
+
+            size = random.randint(1, min(hunk_size, n_lines))
+            start = random.randrange(n_lines - size + 1)
+            for i in range(start, start + size):
+                lines[i] = 'changed in {mark} {r}'.format(mark=mark,
+                                                          r=random.random())
+            changes[fname] = lines
+
+        if random.random() < fix_ratio:
+            message = random.choice(FIX_MESSAGES)
+        else:
+            message = random.choice(OTHER_MESSAGES)
+        message = message.format(module=random.choice(fnames))
+
+        if on_side:
+            _write_commit(out, mark, [head if start_side else side],
+                          timestamp, message, changes)
+            side = mark
+            out.write('reset refs/heads/main\nfrom :{head}\n\n'
+                      .format(head=head).encode('utf-8'))
+        else:
+            _write_commit(out, mark, [head], timestamp, message, changes)
+            head = mark
+
+    out.close()
+
+    if proc.wait():
+        sys.exit('git fast-import failed')
+
+    check_call(['git', '-C', path, 'reset', '-q', '--hard', 'main'])
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('path', help='directory to create the repository in')
+    parser.add_argument('--commits', type=int, default=100000,
+                        help='number of commits (default: %(default)s)')
+    parser.add_argument('--files', type=int, default=1000,
+                        help='number of files, in directories of 20 '
+                             '(default: %(default)s)')
+    parser.add_argument('--files-per-commit', type=int, default=4,
+                        help='most files changed by each commit '
+                             '(default: %(default)s)')
+    parser.add_argument('--hunk-size', type=int, default=6,
+                        help='most lines changed in each file by each '
+                             'commit (default: %(default)s)')
+    parser.add_argument('--fix-ratio', type=float, default=0.25,
+                        help='fraction of commits which fix a bug '
+                             '(default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random seed (default: %(default)s)')
+    args = parser.parse_args()
+
+    if os.path.exists(args.path):
+        sys.exit('{path} already exists'.format(path=args.path))
+
+    make_repo(args.path, n_commits=args.commits,
+              n_dirs=-(-args.files // 20), files_per_dir=min(args.files, 20),
+              files_per_commit=args.files_per_commit,
+              hunk_size=args.hunk_size, fix_ratio=args.fix_ratio,
+              seed=args.seed)
+
+
+if __name__ == '__main__':
+    main()
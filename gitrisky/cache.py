@@ -0,0 +1,232 @@
+"""This module contains code to load and save cached features and labels"""
+
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from .gitcmds import get_git_dir, get_repo_dir
+
+
+# bump this whenever the features extracted from a commit change, so that
+# caches written by older versions get rebuilt rather than reused
+FEATURE_CACHE_VERSION = 4
+
+# likewise, bump this whenever the way bugfix commits are linked to the
+# commits which introduced the bug changes
+LABEL_CACHE_VERSION = 2
+
+
+def _get_feature_cache_path():
+    """Get the full path of the gitrisky feature cache.
+
+    This lives next to the model, at '<repo toplevel>/gitrisky.features'.
+
+    Returns
+    -------
+    path : str
+        The full path to the gitrisky feature cache
+    """
+
+    return os.path.join(get_repo_dir(), 'gitrisky.features')
+
+
+def load_feature_cache():
+    """Load cached commit features.
+
+    Returns
+    -------
+    features : pd.DataFrame or None
+        The cached features, indexed by commit hash, or None if there is no
+        usable cache.
+    head : str or None
+        The hash of the HEAD commit the cached features were extracted from,
+        or None if there is no usable cache.
+    """
+
+    cache_path = _get_feature_cache_path()
+
+    try:
+        with np.load(cache_path) as cache:
+
+            if int(cache['version']) != FEATURE_CACHE_VERSION:
+                return None, None
+
+            columns = [str(col) for col in cache['columns']]
+
+            features = pd.DataFrame(
+                {col: cache['col_' + col] for col in columns},
+                index=pd.Index(cache['hash'].astype(object), name='hash'),
+                columns=columns)
+
+            head = str(cache['head'])
+
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+    return features, head
+
+
+def save_feature_cache(features, head):
+    """Save commit features to the cache.
+
+    Each column is stored as its own array, so the cache loads without any
+    parsing.
+
+    Parameters
+    ----------
+    features : pd.DataFrame
+        The features to cache, indexed by commit hash.
+    head : str
+        The hash of the HEAD commit the features were extracted from.
+    """
+
+    cache_path = _get_feature_cache_path()
+
+    arrays = {'col_' + col: features[col].values for col in features.columns}
+
+    # write to a temporary file first so an interrupted write can't leave a
+    # corrupt cache behind
+    tmp_path = cache_path + '.tmp'
+
+    with open(tmp_path, 'wb') as outfile:
+        np.savez(outfile,
+                 version=FEATURE_CACHE_VERSION,
+                 head=head,
+                 columns=np.array(features.columns, dtype=str),
+                 hash=np.array(features.index, dtype=str),
+                 **arrays)
+
+    os.replace(tmp_path, cache_path)
+
+
+def _get_label_cache_path():
+    """Get the full path of the gitrisky label cache.
+
+    This is kept out of the working tree, at '<git dir>/gitrisky.sqlite'.
+
+    Returns
+    -------
+    path : str
+        The full path to the gitrisky label cache
+    """
+
+    return os.path.join(get_git_dir(), 'gitrisky.sqlite')
+
+
+def _get_label_cache_key(bug_tags, since=None):
+    """Get the key identifying the bug links a label cache is valid for.
+
+    The key holds the blame bound as it was given rather than the date it
+    resolves to, since a relative date like '2 years ago' resolves to a
+    later date on every run and would empty the cache each time. So bugfix
+    commits which are already cached keep the bound they were linked with.
+    """
+
+    return '{version}:{tags}:{since}'.format(version=LABEL_CACHE_VERSION,
+                                             tags=','.join(sorted(bug_tags)),
+                                             since=since or '')
+
+
+def _connect_label_cache(bug_tags, since=None):
+    """Open the label cache, emptying it if it was built differently.
+
+    Parameters
+    ----------
+    bug_tags : iterable(str)
+        The patterns used to find bugfix commits.
+    since : str, optional
+        The date blame was bounded by when linking them to bugs.
+
+    Returns
+    -------
+    conn : sqlite3.Connection
+        A connection to the label cache database.
+    """
+
+    conn = sqlite3.connect(_get_label_cache_path())
+
+    with conn:
+        conn.execute('CREATE TABLE IF NOT EXISTS meta '
+                     '(key TEXT PRIMARY KEY, value TEXT)')
+        conn.execute('CREATE TABLE IF NOT EXISTS fixes '
+                     '(fix TEXT PRIMARY KEY)')
+        conn.execute('CREATE TABLE IF NOT EXISTS links (fix TEXT, bug TEXT)')
+        conn.execute('CREATE INDEX IF NOT EXISTS links_fix ON links (fix)')
+
+        row = conn.execute("SELECT value FROM meta WHERE key = 'key'") \
+            .fetchone()
+        cache_key = _get_label_cache_key(bug_tags, since)
+
+        # the bug tags or linking method changed so the cache is invalid
+        if row is None or row[0] != cache_key:
+            conn.execute('DELETE FROM fixes')
+            conn.execute('DELETE FROM links')
+            conn.execute("INSERT OR REPLACE INTO meta VALUES ('key', ?)",
+                         (cache_key,))
+
+    return conn
+
+
+def load_bug_origins(fix_commits, bug_tags, since=None):
+    """Load the cached bug origins of some bugfix commits.
+
+    Parameters
+    ----------
+    fix_commits : list(str)
+        A list of hashes for commits which fix bugs.
+    bug_tags : iterable(str)
+        The patterns used to find the bugfix commits.
+    since : str, optional
+        The date blame was bounded by, see map_fixes_to_bugs.
+
+    Returns
+    -------
+    bug_origins : dict{str: set}
+        A dictionary keyed on bugfix commit hash and valued with the set of
+        hashes of the commits which introduced the bug. Bugfix commits which
+        haven't been cached yet are left out.
+    """
+
+    conn = _connect_label_cache(bug_tags, since)
+
+    try:
+        cached = set(fix for fix, in conn.execute('SELECT fix FROM fixes'))
+        bug_origins = {fix: set() for fix in fix_commits if fix in cached}
+
+        for fix, bug in conn.execute('SELECT fix, bug FROM links'):
+            if fix in bug_origins:
+                bug_origins[fix].add(bug)
+    finally:
+        conn.close()
+
+    return bug_origins
+
+
+def save_bug_origins(bug_origins, bug_tags, since=None):
+    """Save the bug origins of some bugfix commits to the cache.
+
+    Parameters
+    ----------
+    bug_origins : dict{str: set}
+        A dictionary keyed on bugfix commit hash and valued with the set of
+        hashes of the commits which introduced the bug.
+    bug_tags : iterable(str)
+        The patterns used to find the bugfix commits.
+    since : str, optional
+        The date blame was bounded by, see map_fixes_to_bugs.
+    """
+
+    conn = _connect_label_cache(bug_tags, since)
+
+    try:
+        with conn:
+            conn.executemany('INSERT OR REPLACE INTO fixes VALUES (?)',
+                             ((fix,) for fix in bug_origins))
+            conn.executemany('INSERT INTO links VALUES (?, ?)',
+                             ((fix, bug)
+                              for fix, bugs in bug_origins.items()
+                              for bug in bugs))
+    finally:
+        conn.close()
@@ -1,60 +1,338 @@
-"""This module contains cli commands to train and score gitrisky models"""
+"""This module contains cli commands to train and score gitrisky models
 
+The modeling code pulls in pandas and scikit-learn, which take much longer to
+import than the commands take to parse their arguments, so it is only
+imported by the commands which need it. This keeps e.g. 'gitrisky --help' and
+git hooks which fail early fast.
+"""
+
+import json
+import os
 import sys
 import click
 
-from .model import create_model, save_model, load_model
-from .gitcmds import get_latest_commit
-from .parsing import get_features, get_labels
+from . import __version__
+from .config import CONFIG_FILENAME, DEFAULT_TIMEZONE, load_model_config
+from .gitcmds import BACKENDS, BUG_TAGS, get_latest_commit, set_backend
+from .timings import format_report, get_report, reset as reset_timings, \
+    stage
+
+
+def _memoize_features():
+    """Read the git history at most once for the rest of the command."""
+
+    from .parsing import enable_feature_memo, clear_feature_memo
+
+    enable_feature_memo()
+    click.get_current_context().call_on_close(clear_feature_memo)
 
 
 @click.group()
-def cli():
-    pass
+@click.version_option(version=__version__, prog_name='gitrisky')
+@click.option('--backend', type=click.Choice(BACKENDS),
+              envvar='GITRISKY_BACKEND', default='subprocess',
+              help='How to read the repository: by running git commands, or '
+                   'in-process with pygit2 (which must be installed).')
+@click.option('--timings', is_flag=True,
+              help='Report the time taken by each stage of the command, the '
+                   'git processes started, the bytes read from git and the '
+                   'peak memory use on stderr.')
+@click.option('--timings-json', type=click.Path(dir_okay=False),
+              help='Write the same report as --timings to this file as '
+                   'JSON.')
+def cli(backend, timings, timings_json):
+    set_backend(backend)
+
+    ctx = click.get_current_context()
+
+    # report once the command has finished
+    reset_timings()
+    if timings or timings_json:
+        ctx.call_on_close(lambda: _report_timings(ctx.invoked_subcommand,
+                                                  timings, timings_json))
+
+
+def _report_timings(command, timings, timings_json):
+    """Report where the command spent its time, see cli."""
+
+    report = get_report()
+    report['command'] = command
+
+    if timings:
+        click.echo(format_report(report), err=True)
+
+    if timings_json:
+        with open(timings_json, 'w') as outfile:
+            json.dump(report, outfile, indent=2)
 
 
 @cli.command()
-def train():
+@click.option('-j', '--jobs', type=int, default=1,
+              help='Number of processes to parse the history with, and of '
+                   'git blames to run at once. -1 means use all CPUs.')
+@click.option('-t', '--bug-tag', 'bug_tags', multiple=True, default=BUG_TAGS,
+              help='Pattern marking a commit message as a bugfix. '
+                   'Can be given multiple times.')
+@click.option('--cache/--no-cache', default=True,
+              help='Reuse the features and labels cached by previous runs.')
+@click.option('--blame-since', metavar='DATE',
+              help='Only look this far back, e.g. "2 years ago", for the '
+                   'commits which introduced the bugs fixed by bugfix '
+                   'commits. Bounds the time taken on long histories.')
+@click.option('--timezone', default=DEFAULT_TIMEZONE,
+              help='Timezone for the time of day features, or "author" for '
+                   'each author\'s local time.')
+@click.option('--commit-graph', is_flag=True,
+              help='Write or update the repository\'s commit-graph, with '
+                   'changed-path Bloom filters, to speed up reading the '
+                   'history in this and later runs.')
+@click.option('--out-of-core', is_flag=True,
+              help='Write the features to a memory-mapped file as the '
+                   'history is parsed and train from that, rather than '
+                   'holding them in memory. Implies --no-cache for the '
+                   'features.')
+@click.option('--estimator',
+              type=click.Choice(['random_forest', 'extra_trees',
+                                 'gradient_boosting', 'sgd']),
+              help='The kind of model to train. Defaults to random_forest.')
+@click.option('--n-estimators', type=int,
+              help='Number of trees in the model.')
+@click.option('--max-depth', type=int,
+              help='Maximum depth of each tree in the model.')
+@click.option('--search', type=click.Choice(['randomized', 'halving']),
+              help='Tune the model settings which aren\'t given with a '
+                   'cross-validated hyperparameter search.')
+def train(jobs, bug_tags, cache, blame_since, timezone, commit_graph,
+          out_of_core, estimator, n_estimators, max_depth, search):
     """Train a git commit bug risk model.
 
-    This will save a pickled sklearn model to a file in the toplevel directory
-    for this repository.
+    This will save a sklearn model to a file in the toplevel directory for
+    this repository, and random forests also as NumPy arrays for predict to
+    score with.
+
+    Parameters
+    ----------
+    jobs: int
+        The number of processes to parse the commit history with, and of
+        bugfix commits to link to their bug commits in parallel.
+    bug_tags: tuple(str)
+        The (case insensitive) patterns which mark a commit message as fixing
+        a bug.
+    cache: bool
+        Whether to only parse and link the commits added since the last run.
+    blame_since: str
+        A date to stop blaming at when linking bugfix commits to bugs.
+    timezone: str
+        The timezone to compute the time of day features in.
+    commit_graph: bool
+        Whether to write the repository's commit-graph before reading the
+        history.
+    out_of_core: bool
+        Whether to train from a memory-mapped feature matrix rather than an
+        in-memory dataframe.
+    estimator: str
+        The kind of model to train.
+    n_estimators: int
+        The number of trees in the model.
+    max_depth: int
+        The maximum depth of each tree in the model.
+    search: str
+        The kind of hyperparameter search to tune the model with, if any.
+
+    The model settings which aren't given default to those in the [model]
+    table of a gitrisky.toml file at the top of the repository.
     """
 
+    from .gitcmds import get_head_commit, get_repo_dir, write_commit_graph
+    from .model import create_model, save_model
+
+    options = {'estimator': estimator, 'n_estimators': n_estimators,
+               'max_depth': max_depth, 'search': search}
+
+    # create the model before parsing anything, so a bad setting fails fast
+    try:
+        settings = load_model_config(os.path.join(get_repo_dir(),
+                                                  CONFIG_FILENAME))
+        settings.update((key, value) for key, value in options.items()
+                        if value is not None)
+
+        # train with as many CPUs as the rest of the command by default
+        if settings['n_jobs'] is None:
+            settings['n_jobs'] = jobs
+
+        with stage('create model'):
+            model = create_model(**settings)
+    except ValueError as err:
+        raise click.UsageError(str(err))
+
+    if commit_graph:
+        write_commit_graph()
+
+    # note where the model was trained before spending time training it
+    head = get_head_commit()
+
+    if out_of_core:
+        model, n_commits, n_bugs = _train_out_of_core(model, jobs, bug_tags,
+                                                      cache, blame_since,
+                                                      timezone)
+    else:
+        model, n_commits, n_bugs = _train_in_memory(model, jobs, bug_tags,
+                                                    cache, blame_since,
+                                                    timezone)
+
+    print('Model trained on {n} training examples with {n_bug} positive cases'
+          .format(n=n_commits, n_bug=n_bugs))
+
+    # only the best model found by the search is kept
+    if settings['search'] is not None:
+        print('Best cross-validated ROC AUC of {score:.3f} with {params}'
+              .format(score=model.best_score_, params=model.best_params_))
+        model = model.best_estimator_
+
+    # save the model to a file in the top level repo directory
+    with stage('save model'):
+        save_model(model, head=head, timezone=timezone)
+
+
+def _exit_no_bugs(bug_tags):
+    """Fail with an informative error message when there are no bugfixes."""
+
+    print('Failed to find any bug commits by parsing commit logs.\n'
+          'gitrisky looks for commit messages containing {tags} '
+          'and this repo appears not to have any.'
+          .format(tags=' or '.join('"{}"'.format(tag.lower())
+                                   for tag in bug_tags)))
+    sys.exit(1)
+
+
+def _train_in_memory(model, jobs, bug_tags, cache, blame_since, timezone):
+    """Train a model on features held in a dataframe, see train."""
+
+    from .gitcmds import start_bugfix_commits
+    from .parsing import get_features, get_labels
+
+    _memoize_features()
+
+    # let git look for the bugfix commits while the features are parsed
+    get_fix_commits = start_bugfix_commits(bug_tags)
+
     # get the features and labels by parsing the git logs
-    features = get_features()
+    features = get_features(use_cache=cache, tz=timezone, n_jobs=jobs)
 
     # we can't train a model without positive training examples so we fail with
     # an informative error message
     try:
-        labels = get_labels()
+        labels = get_labels(features.index, n_jobs=jobs, bug_tags=bug_tags,
+                            use_cache=cache, blame_since=blame_since,
+                            fix_commits=get_fix_commits())
     except ValueError:
-        # TODO: update this message once we support more / custom bug tags
-        print('Failed to find any bug commits by parsing commit logs.\n'
-              'gitrisky looks for commit messages containing "bug" or "fix" '
-              'and this repo appears not to have any.')
-        sys.exit(1)
+        _exit_no_bugs(bug_tags)
 
-    # instantiate and train a model
-    model = create_model()
-    model.fit(features, labels)
+    with stage('fit model'):
+        model.fit(features, labels)
 
-    print('Model trained on {n} training examples with {n_bug} positive cases'
-          .format(n=len(features), n_bug=sum(labels)))
+    return model, len(features), sum(labels)
+
+
+def _train_out_of_core(model, jobs, bug_tags, cache, blame_since,
+                       timezone):
+    """Train a model on features in a memory-mapped file, see train."""
+
+    from .gitcmds import get_git_dir, start_bugfix_commits
+    from .model import fit_model
+    from .parsing import get_label_array, write_feature_matrix
+
+    # the matrix is only needed while training, so it's kept out of the
+    # working tree and removed afterwards
+    matrix_path = os.path.join(get_git_dir(), 'gitrisky.matrix.npy')
+
+    get_fix_commits = start_bugfix_commits(bug_tags)
+
+    try:
+        features, hashes, columns = write_feature_matrix(matrix_path,
+                                                         tz=timezone)
 
-    # pickle the model to a file in the top level repo directory
-    save_model(model)
+        try:
+            labels = get_label_array(hashes, n_jobs=jobs, bug_tags=bug_tags,
+                                     use_cache=cache,
+                                     blame_since=blame_since,
+                                     fix_commits=get_fix_commits())
+        except ValueError:
+            _exit_no_bugs(bug_tags)
+
+        with stage('fit model'):
+            model = fit_model(model, features, labels, columns=columns)
+        n_commits = len(features)
+
+        # unmap the file before removing it
+        del features
+    finally:
+        if os.path.exists(matrix_path):
+            os.remove(matrix_path)
+
+    return model, n_commits, int(labels.sum())
+
+
+def _print_scores(commits, scores, output_format):
+    """Print the bug scores of some commits.
+
+    Parameters
+    ----------
+    commits: list(str)
+        The hashes of the scored commits.
+    scores: list(float)
+        The bug score of each commit.
+    output_format: str
+        One of 'text', 'csv' or 'json' (one JSON object per line).
+    """
+
+    if output_format == 'csv':
+        print('commit,score')
+
+    for commit, score in zip(commits, scores):
+
+        if output_format == 'csv':
+            print('{commit},{score}'.format(commit=commit, score=score))
+        elif output_format == 'json':
+            print(json.dumps({'commit': commit, 'score': float(score)}))
+        else:
+            print('Commit {commit} has a bug score of {score} / 1.0'
+                  .format(commit=commit, score=score))
 
 
 @cli.command()
-@click.option('-c', '--commit', type=str)
-def predict(commit):
+@click.option('-c', '--commit', 'commits', type=str, multiple=True,
+              help='Commit to score. Can be given multiple times.')
+@click.option('-r', '--range', 'rev_range', type=str,
+              help='Score every commit in a revision range, e.g. A..B.')
+@click.option('--stdin', 'from_stdin', is_flag=True,
+              help='Also score the commits read from stdin, one per line.')
+@click.option('-f', '--format', 'output_format', default='text',
+              type=click.Choice(['text', 'csv', 'json']),
+              help='Output format. json prints one object per line.')
+@click.option('--timezone',
+              help='Timezone for the time of day features. Defaults to the '
+                   'one the model was trained with.')
+def predict(commits, rev_range, from_stdin, output_format, timezone):
     """Score a git commit bug risk model.
 
+    All the requested commits are scored together, with a single git command
+    to get their features and a single call to the model.
+
     Parameters
     ----------
-    commit: str
-        The hash of the commit to score.
+    commits: tuple(str)
+        The hashes of the commits to score. If no commits are given (in any
+        way) the most recent commit is scored.
+    rev_range: str
+        A revision range to score the commits of.
+    from_stdin: bool
+        Whether to read more commits to score from stdin.
+    output_format: str
+        How to print the scores: 'text', 'csv' or 'json'.
+    timezone: str
+        The timezone to compute the time of day features in. If not given
+        this is the timezone the model was trained with.
 
     Raises
     ------
@@ -62,20 +340,110 @@ def predict(commit):
         If a gitrisky model has not yet been trained on the currrent repo.
     """
 
+    commits = list(commits)
+
+    if from_stdin:
+        commits += [line.strip() for line in sys.stdin if line.strip()]
+
+    if commits and rev_range is not None:
+        raise click.UsageError('--range can\'t be combined with commits.')
+
+    from .model import IncompatibleModelError, check_features, \
+        get_model_timezone, load_scoring_model
+
     try:
-        model = load_model()
+        with stage('load model'):
+            model = load_scoring_model()
     except FileNotFoundError:
         print('could not find trained model. '
               'have you run "gitrisky train" yet?')
         sys.exit(1)
+    except IncompatibleModelError as err:
+        print('could not use trained model: {err}'.format(err=err))
+        sys.exit(1)
 
-    if commit is None:
-        commit = get_latest_commit()
+    # the features have to be computed the way the model was trained on them
+    if timezone is None:
+        timezone = get_model_timezone(model)
 
-    features = get_features(commit)
+    from .parsing import get_features
+
+    _memoize_features()
+
+    try:
+        if rev_range is not None:
+            features = get_features(rev_range=rev_range, tz=timezone)
+        else:
+            features = get_features(commits or get_latest_commit(),
+                                    tz=timezone)
+    except ValueError as err:
+        raise click.UsageError(str(err))
+
+    # an empty revision range has nothing to score
+    if features is None or not len(features):
+        _print_scores([], [], output_format)
+        return
+
+    try:
+        check_features(model, features.columns)
+    except IncompatibleModelError as err:
+        print('could not use trained model: {err}'.format(err=err))
+        sys.exit(1)
 
     # pull out just the postive class probability
-    [(_, score)] = model.predict_proba(features)
+    with stage('score commits'):
+        scores = [score for _, score in model.predict_proba(features)]
+
+    _print_scores(features.index, scores, output_format)
+
+
+@cli.command()
+@click.option('-p', '--port', type=int, default=8765,
+              help='Local port to listen on for HTTP requests.')
+@click.option('-s', '--socket', 'socket_path', type=str,
+              help='Listen on this unix socket instead of a port.')
+@click.option('--timezone',
+              help='Timezone for the time of day features. Defaults to the '
+                   'one the model was trained with.')
+def serve(port, socket_path, timezone):
+    """Serve bug scores for commits from a long-lived process.
+
+    The model stays loaded between requests, and is reloaded whenever it is
+    retrained. Score commits with e.g.
+    'curl localhost:8765/score?commit=<hash>&commit=<hash>' or
+    'curl localhost:8765/score?range=<A..B>'.
+
+    Parameters
+    ----------
+    port: int
+        The local port to listen on.
+    socket_path: str
+        The path of a unix socket to listen on instead of a port.
+    timezone: str
+        The timezone to compute the time of day features in. If not given
+        this is the timezone the model was trained with.
+    """
 
-    print('Commit {commit} has a bug score of {score} / 1.0'
-          .format(commit=commit, score=score))
+    from .server import ModelHolder, make_server
+
+    holder = ModelHolder(tz=timezone)
+
+    # load the model up front so the first request is fast too
+    try:
+        holder.get_model()
+    except FileNotFoundError:
+        print('could not find trained model. '
+              'have you run "gitrisky train" yet?')
+        sys.exit(1)
+
+    server = make_server(holder, port=port, socket_path=socket_path)
+
+    print('Serving bug scores on {address}'
+          .format(address=socket_path or 'http://127.0.0.1:{}'.format(port)))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
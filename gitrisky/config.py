@@ -0,0 +1,77 @@
+"""This module contains gitrisky's default settings.
+
+It has no dependencies so that it can be imported by the cli without slowing
+down its startup.
+"""
+
+# the timezone the time features are computed in, unless another is given
+DEFAULT_TIMEZONE = 'US/Central'
+
+# pass this as the timezone to use each commit author's own local time
+AUTHOR_TIMEZONE = 'author'
+
+# the file, at the top level of a repository, which configures the model
+CONFIG_FILENAME = 'gitrisky.toml'
+
+# the model settings used unless they're set in the [model] table of
+# gitrisky.toml or with cli options, see model.create_model
+MODEL_DEFAULTS = {
+    'estimator': 'random_forest',
+    'n_jobs': None,
+    'n_estimators': None,
+    'max_depth': None,
+    'search': None,
+    'n_iter': 10,
+    'cv': 3,
+}
+
+
+def load_model_config(path):
+    """Load the model settings from a gitrisky.toml file.
+
+    Parameters
+    ----------
+    path : str
+        The path of the config file.
+
+    Returns
+    -------
+    settings : dict
+        The model settings, with defaults for any which the file doesn't set,
+        see MODEL_DEFAULTS.
+
+    Raises
+    ------
+    ValueError
+        If the file sets a model setting which doesn't exist.
+    """
+
+    settings = dict(MODEL_DEFAULTS)
+
+    try:
+        with open(path, 'rb') as infile:
+            config = _parse_toml(infile)
+    except FileNotFoundError:
+        return settings
+
+    model_config = config.get('model', {})
+
+    unknown = set(model_config) - set(MODEL_DEFAULTS)
+    if unknown:
+        raise ValueError('Unknown model settings in {path}: {keys}'
+                         .format(path=path, keys=', '.join(sorted(unknown))))
+
+    settings.update(model_config)
+
+    return settings
+
+
+def _parse_toml(infile):
+    """Parse a TOML file with tomllib, or tomli before Python 3.11."""
+
+    try:
+        import tomllib
+    except ImportError:
+        import tomli as tomllib
+
+    return tomllib.load(infile)
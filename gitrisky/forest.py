@@ -0,0 +1,235 @@
+"""This module contains a NumPy only copy of a trained random forest.
+
+Importing scikit-learn and unpickling a forest takes far longer than scoring
+the handful of commits 'gitrisky predict' is usually asked about. So forests
+are also exported as flat arrays of their tree nodes, which can be loaded and
+evaluated for a whole batch of commits with only NumPy imported.
+"""
+
+import numpy as np
+
+
+# bump this whenever the exported arrays change
+FOREST_FORMAT_VERSION = 2
+
+
+class Forest(object):
+    """A forest of decision trees stored as flat arrays of their nodes.
+
+    The nodes of every tree are concatenated, so the children of a node are
+    indexes into the same arrays. Leaves have no children, which is marked
+    with -1.
+
+    Parameters
+    ----------
+    feature : np.array(int)
+        The index of the feature each node splits on.
+    threshold : np.array(float)
+        The value each node splits at. Samples with a feature value no
+        greater than this go to the left child.
+    left, right : np.array(int)
+        The index of the children of each node.
+    missing_left : np.array(bool)
+        Whether samples with a missing feature value go to the left child.
+    value : np.array(float)
+        The class probabilities at each node, one column per class.
+    roots : np.array(int)
+        The index of the root node of each tree.
+    classes : np.array
+        The class labels, in the order of the columns of value.
+    columns : np.array(str)
+        The names of the features the forest was trained on.
+    timezone : str, optional
+        The timezone the time of day features were computed in.
+    """
+
+    def __init__(self, feature, threshold, left, right, missing_left, value,
+                 roots, classes, columns, timezone=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.missing_left = missing_left
+        self.value = value
+        self.roots = roots
+        self.classes_ = classes
+        self.feature_names_in_ = columns
+        self.timezone_ = timezone
+
+    def predict_proba(self, X):
+        """Get the class probabilities of some samples.
+
+        This gives the same probabilities as the scikit-learn forest's
+        predict_proba, the mean over the trees of the class probabilities at
+        the leaf each sample ends up in.
+
+        Parameters
+        ----------
+        X : array-like, shape (n_samples, n_features)
+            The samples to score.
+
+        Returns
+        -------
+        proba : np.array, shape (n_samples, n_classes)
+            The probability of each class for each sample.
+        """
+
+        # scikit-learn compares float32 features against the thresholds
+        X = np.asarray(X, dtype=np.float32)
+        n_samples, n_features = X.shape
+        n_trees = len(self.roots)
+
+        values = X.ravel()
+        has_missing = np.isnan(values).any()
+
+        # walk every sample down every tree at once, a level at a time, only
+        # moving the (sample, tree) pairs which haven't reached a leaf yet
+        nodes = np.tile(self.roots, n_samples)
+        offsets = np.repeat(np.arange(n_samples) * n_features, n_trees)
+        active = np.flatnonzero(self.left[nodes] != -1)
+
+        while len(active):
+            node = nodes[active]
+
+            value = values[offsets[active] + self.feature[node]]
+            go_left = value <= self.threshold[node]
+            if has_missing:
+                go_left |= np.isnan(value) & self.missing_left[node]
+
+            node = np.where(go_left, self.left[node], self.right[node])
+            nodes[active] = node
+
+            active = active[self.left[node] != -1]
+
+        return self.value[nodes].reshape(n_samples, n_trees, -1).mean(axis=1)
+
+
+def export_forest(model, timezone=None):
+    """Copy a trained scikit-learn forest into a Forest.
+
+    Parameters
+    ----------
+    model : scikit-learn forest classifier
+        A trained random forest or extra trees classifier.
+    timezone : str, optional
+        The timezone the time of day features were computed in.
+
+    Returns
+    -------
+    forest : Forest or None
+        The copy of the forest, or None if the model isn't a forest of
+        classification trees.
+    """
+
+    trees = [getattr(estimator, 'tree_', None)
+             for estimator in getattr(model, 'estimators_', [])]
+
+    # e.g. gradient boosting keeps a 2d array of regression trees
+    if not trees or any(tree is None or tree.value.ndim != 3
+                        for tree in trees):
+        return None
+
+    offsets = np.cumsum([0] + [tree.node_count for tree in trees])
+
+    def concat(attr, dtype):
+        return np.concatenate([getattr(tree, attr) for tree in trees]) \
+            .astype(dtype)
+
+    # point the children at the concatenated nodes, leaving leaves as -1
+    left, right = [
+        np.concatenate([np.where(getattr(tree, attr) == -1, -1,
+                                 getattr(tree, attr) + offset)
+                        for tree, offset in zip(trees, offsets)])
+        .astype(np.int32)
+        for attr in ['children_left', 'children_right']]
+
+    # leaves use feature -2, which would index from the end of a row
+    feature = np.maximum(concat('feature', np.int32), 0)
+
+    if hasattr(trees[0], 'missing_go_to_left'):
+        missing_left = concat('missing_go_to_left', bool)
+    else:
+        missing_left = np.zeros(len(feature), dtype=bool)
+
+    # depending on the scikit-learn version the node values are either class
+    # counts or class fractions, so normalise them
+    value = concat('value', np.float64)[:, 0, :]
+    value /= np.maximum(value.sum(axis=1, keepdims=True), 1e-300)
+
+    columns = getattr(model, 'feature_names_in_', None)
+    if columns is None:
+        columns = np.arange(model.n_features_in_).astype(str)
+
+    return Forest(feature=feature,
+                  threshold=concat('threshold', np.float64),
+                  left=left,
+                  right=right,
+                  missing_left=missing_left,
+                  value=value,
+                  roots=offsets[:-1].astype(np.int32),
+                  classes=np.asarray(model.classes_),
+                  columns=np.asarray(columns, dtype=str),
+                  timezone=timezone)
+
+
+def save_forest(forest, path):
+    """Save a Forest to an uncompressed .npz file.
+
+    Parameters
+    ----------
+    forest : Forest
+        The forest to save.
+    path : str
+        The file to save the forest to.
+    """
+
+    with open(path, 'wb') as outfile:
+        np.savez(outfile,
+                 format_version=FOREST_FORMAT_VERSION,
+                 feature=forest.feature,
+                 threshold=forest.threshold,
+                 left=forest.left,
+                 right=forest.right,
+                 missing_left=forest.missing_left,
+                 value=forest.value,
+                 roots=forest.roots,
+                 classes=forest.classes_,
+                 columns=forest.feature_names_in_,
+                 # npz files only hold arrays, so no timezone is saved as ''
+                 timezone=forest.timezone_ or '')
+
+
+def load_forest(path):
+    """Load a Forest saved by save_forest.
+
+    Parameters
+    ----------
+    path : str
+        The file the forest was saved to.
+
+    Returns
+    -------
+    forest : Forest or None
+        The forest, or None if it was saved in another format version.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the file doesn't exist.
+    """
+
+    with np.load(path, allow_pickle=False) as arrays:
+
+        if int(arrays['format_version']) != FOREST_FORMAT_VERSION:
+            return None
+
+        return Forest(feature=arrays['feature'],
+                      threshold=arrays['threshold'],
+                      left=arrays['left'],
+                      right=arrays['right'],
+                      missing_left=arrays['missing_left'],
+                      value=arrays['value'],
+                      roots=arrays['roots'],
+                      classes=arrays['classes'],
+                      columns=arrays['columns'],
+                      timezone=str(arrays['timezone']) or None)
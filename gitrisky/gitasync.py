@@ -0,0 +1,212 @@
+"""This module runs git commands concurrently with asyncio.
+
+Linking bugfix commits to bugs takes a git blame for every file each fix
+changed, and gitrisky spends nearly all of that time waiting on git. Here the
+commands are run as asyncio subprocesses, as many at once as a limit allows,
+each with a timeout so one pathological blame can't hold up the rest. If a
+command fails, or the caller is cancelled, the commands still running are
+killed rather than left to finish.
+"""
+
+import asyncio
+
+from subprocess import CalledProcessError, PIPE, TimeoutExpired
+
+from .timings import record_git_bytes, record_git_process
+
+
+# how much output to read from a streamed command at a time
+_CHUNK_SIZE = 1 << 16
+
+
+async def _kill(proc):
+    """Kill a process, if it's still running, and reap it."""
+
+    if proc.returncode is None:
+        try:
+            proc.kill()
+        except ProcessLookupError:
+            pass
+
+    await proc.wait()
+
+
+async def _start(args, **kwargs):
+    """Start a command as an asyncio subprocess.
+
+    The start is shielded from cancellation, so if we're cancelled while git
+    is starting up it's killed, rather than left running with nothing to stop
+    it.
+    """
+
+    record_git_process()
+    start = asyncio.ensure_future(
+        asyncio.create_subprocess_exec(*args, **kwargs))
+
+    try:
+        return await asyncio.shield(start)
+    except asyncio.CancelledError:
+        await asyncio.wait([start])
+        if not start.cancelled() and start.exception() is None:
+            await _kill(start.result())
+        raise
+
+
+async def run_command(args, limit, timeout=None):
+    """Run a command once the limit allows, and capture its stdout.
+
+    Parameters
+    ----------
+    args : list(str)
+        The command to run.
+    limit : asyncio.Semaphore
+        Held while the command runs, which bounds how many commands sharing
+        it run at once.
+    timeout : float, optional
+        The number of seconds to let the command run for, not counting the
+        time spent waiting for the limit. By default there is no timeout.
+
+    Returns
+    -------
+    stdout : bytes
+        The command's stdout output.
+
+    Raises
+    ------
+    CalledProcessError
+        If the command exits with a non-zero status.
+    TimeoutExpired
+        If the command runs for longer than the timeout, in which case it's
+        killed.
+    """
+
+    async with limit:
+
+        proc = await _start(args, stdout=PIPE)
+
+        try:
+            stdout, _ = await asyncio.wait_for(proc.communicate(), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutExpired(args, timeout)
+        finally:
+            # stop the command on a timeout or if we're cancelled
+            await _kill(proc)
+
+    record_git_bytes(len(stdout))
+
+    if proc.returncode:
+        raise CalledProcessError(proc.returncode, args)
+
+    return stdout
+
+
+async def stream_command(args, stdin_lines=None):
+    """Run a command and stream its stdout line by line.
+
+    Like gitcmds._stream_bash_command, the output is never held in memory all
+    at once. Close the generator (with aclose) to stop the command early.
+
+    Parameters
+    ----------
+    args : list(str)
+        The command to run.
+    stdin_lines : list(str), optional
+        Lines to write to the command's stdin, e.g. the revisions for a
+        command run with '--stdin'.
+
+    Yields
+    ------
+    line : str
+        Each line of stdout output, including the trailing newline.
+
+    Raises
+    ------
+    CalledProcessError
+        If the command exits with a non-zero status.
+    """
+
+    stdin = PIPE if stdin_lines is not None else None
+
+    proc = await _start(args, stdin=stdin, stdout=PIPE)
+
+    async def write():
+        proc.stdin.write(''.join(line + '\n' for line in stdin_lines)
+                         .encode('utf-8'))
+        try:
+            await proc.stdin.drain()
+        except ConnectionError:
+            # git exited without reading all its input, e.g. on a bad
+            # revision, which its exit status reports
+            pass
+        finally:
+            proc.stdin.close()
+
+    # write the input while the output is read, so neither pipe fills up
+    writer = asyncio.ensure_future(write()) if stdin_lines is not None \
+        else None
+
+    n_bytes = 0
+    partial = b''
+
+    try:
+        # read in chunks rather than lines, since a diff line can be longer
+        # than asyncio's line length limit
+        while True:
+            chunk = await proc.stdout.read(_CHUNK_SIZE)
+            if not chunk:
+                break
+
+            n_bytes += len(chunk)
+            lines = (partial + chunk).split(b'\n')
+            partial = lines.pop()
+
+            for line in lines:
+                yield line.decode('utf-8', errors='replace') + '\n'
+
+        if partial:
+            yield partial.decode('utf-8', errors='replace')
+
+        if writer is not None:
+            await writer
+
+        await proc.wait()
+
+    finally:
+        record_git_bytes(n_bytes)
+
+        if writer is not None and not writer.done():
+            writer.cancel()
+
+        await _kill(proc)
+
+    if proc.returncode:
+        raise CalledProcessError(proc.returncode, args)
+
+
+async def gather_or_cancel(aws):
+    """Wait for some awaitables, cancelling the rest if any of them fails.
+
+    asyncio.gather leaves the others running when one raises, which would
+    leave their git processes running too.
+
+    Parameters
+    ----------
+    aws : iterable(awaitable)
+        The coroutines or tasks to wait for.
+
+    Returns
+    -------
+    results : list
+        The result of each awaitable, in order.
+    """
+
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+
+    try:
+        return await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+        # wait for the cancelled tasks to kill their processes
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -1,9 +1,59 @@
 """This module contains functions which invoke git cli commands."""
 
-import re
+import os
+import warnings
 
-from collections import defaultdict
-from subprocess import check_output
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import repeat
+from subprocess import CalledProcessError, PIPE, Popen, TimeoutExpired, \
+    check_output
+from tempfile import TemporaryFile
+
+from .timings import record_git_bytes, record_git_process, stage
+
+
+# git log --pretty format which emits a NUL separated header for each commit:
+# the commit hash, the parent hashes, the author timestamp, the author date
+# (for its UTC offset) and the raw message
+LOG_FORMAT = '%x00%H%x00%P%x00%at%x00%ai%x00%B%x00'
+
+# the number of NULs in each commit header generated by LOG_FORMAT
+_LOG_FORMAT_NULS = LOG_FORMAT.count('%x00')
+
+# git log options which give the per-file numstat of every commit, with merge
+# commits diffed against their first parent (i.e. the changes the merge
+# brought in) rather than left without a diff
+LOG_DIFF_OPTS = '--numstat --diff-merges=first-parent'
+
+# the default patterns which mark a commit message as fixing a bug
+BUG_TAGS = ('BUG', 'FIX')
+
+# the default number of seconds to let a single git blame run for when
+# linking bugfix commits to bugs
+BLAME_TIMEOUT = 300
+
+LogEntry = namedtuple('LogEntry', ['hash', 'parents', 'timestamp', 'tz_offset',
+                                   'message', 'numstat'])
+
+
+def _split_bash_command(bash_cmd):
+    """Split a bash command into arguments.
+
+    Commands whose arguments can contain spaces, e.g. user supplied patterns,
+    can be given as a list of arguments instead, which is used as is.
+
+    git commands are run against the repository's top level directory, so
+    they behave the same when gitrisky is run from a subdirectory.
+    """
+
+    args = bash_cmd.split() if isinstance(bash_cmd, str) else list(bash_cmd)
+
+    if args[0] == 'git':
+        args[1:1] = ['-C', get_repo_dir()]
+
+    return args
 
 
 def _run_bash_command(bash_cmd):
@@ -11,8 +61,8 @@ def _run_bash_command(bash_cmd):
 
     Parameters
     ----------
-    bash_cmd : str
-        The bash command to run.
+    bash_cmd : str or list(str)
+        The bash command to run, see _split_bash_command.
 
     Returns
     -------
@@ -20,9 +70,101 @@ def _run_bash_command(bash_cmd):
         The resulting stdout output.
     """
 
-    stdout = check_output(bash_cmd.split()).decode('utf-8').rstrip('\n')
+    record_git_process()
+    stdout = check_output(_split_bash_command(bash_cmd))
+    record_git_bytes(len(stdout))
+
+    return stdout.decode('utf-8').rstrip('\n')
+
+
+def _stream_bash_command(bash_cmd, stdin_lines=None):
+    """Execute a bash command and stream the resulting stdout line by line.
+
+    Unlike _run_bash_command the output is never held in memory all at once,
+    so this is suitable for commands with very large outputs.
 
-    return stdout
+    Parameters
+    ----------
+    bash_cmd : str
+        The bash command to run.
+    stdin_lines : list(str), optional
+        Lines to write to the command's stdin before reading its output, e.g.
+        the revisions for a command run with '--stdin'.
+
+    Yields
+    ------
+    line : str
+        Each line of stdout output, including the trailing newline.
+
+    Raises
+    ------
+    CalledProcessError
+        If the command exits with a non-zero status.
+    """
+
+    args = _split_bash_command(bash_cmd)
+    stdin = PIPE if stdin_lines is not None else None
+
+    record_git_process()
+    n_bytes = 0
+
+    with Popen(args, stdin=stdin, stdout=PIPE) as proc:
+
+        if stdin_lines is not None:
+            proc.stdin.write(''.join(line + '\n' for line in stdin_lines)
+                             .encode('utf-8'))
+            proc.stdin.close()
+
+        try:
+            for line in proc.stdout:
+                n_bytes += len(line)
+                yield line.decode('utf-8', errors='replace')
+        finally:
+            record_git_bytes(n_bytes)
+
+    if proc.returncode:
+        raise CalledProcessError(proc.returncode, args)
+
+
+def _start_bash_command(bash_cmd):
+    """Start a bash command in the background, to collect its stdout later.
+
+    The output goes to a temporary file rather than a pipe, so the command
+    runs to completion without anything reading from it in the meantime.
+
+    Parameters
+    ----------
+    bash_cmd : str or list(str)
+        The bash command to run, see _split_bash_command.
+
+    Returns
+    -------
+    wait : callable
+        Call it (once) to wait for the command to finish and get its stdout,
+        like _run_bash_command. It raises CalledProcessError if the command
+        exits with a non-zero status.
+    """
+
+    args = _split_bash_command(bash_cmd)
+    outfile = TemporaryFile()
+
+    record_git_process()
+    proc = Popen(args, stdout=outfile)
+
+    def wait():
+        with outfile:
+            returncode = proc.wait()
+            outfile.seek(0)
+            stdout = outfile.read()
+
+        record_git_bytes(len(stdout))
+
+        if returncode:
+            raise CalledProcessError(returncode, args)
+
+        return stdout.decode('utf-8').rstrip('\n')
+
+    return wait
 
 
 def trim_hash(commit):
@@ -50,55 +192,384 @@ def get_latest_commit():
     return trim_hash(stdout)
 
 
-def get_git_log(commit=None):
-    """Get the git log entry for one or more commits.
+def get_head_commit():
+    """Get the full hash of the commit currently checked out.
 
-    This will return log entries with the format generated by the '--stat'
-    option.
+    Returns
+    -------
+    hash : str
+        The 40 character hash of HEAD.
+    """
+
+    bash_cmd = 'git rev-parse HEAD'
+
+    return _run_bash_command(bash_cmd)
+
+
+@lru_cache(maxsize=None)
+def get_repo_dir():
+    """Get the top level directory of the current repository.
+
+    This is looked up once per process, by walking up from the working
+    directory to the first one containing a '.git' entry. git itself is only
+    asked if that fails or the repository location is overridden with
+    GIT_DIR.
+
+    Returns
+    -------
+    path : str
+        The absolute path of the repository's working tree.
+
+    Raises
+    ------
+    CalledProcessError
+        If the working directory isn't inside a git repository.
+    """
+
+    if 'GIT_DIR' not in os.environ:
+
+        path = os.getcwd()
+
+        while True:
+            # .git is a file rather than a directory in worktrees/submodules
+            if os.path.exists(os.path.join(path, '.git')):
+                return path
+
+            parent = os.path.dirname(path)
+            if parent == path:
+                break
+            path = parent
+
+    args = ['git', 'rev-parse', '--show-toplevel']
+
+    record_git_process()
+
+    return check_output(args).decode('utf-8').rstrip('\n')
+
+
+def get_git_dir():
+    """Get the git directory of the current repository.
+
+    Returns
+    -------
+    path : str
+        The absolute path of the repository's .git directory.
+    """
+
+    bash_cmd = 'git rev-parse --absolute-git-dir'
+
+    return _run_bash_command(bash_cmd)
+
+
+def write_commit_graph():
+    """Write or update the repository's commit-graph.
+
+    The commit-graph covers every reachable commit and includes changed-path
+    Bloom filters. It is written as a chain of split files, so updating it
+    after new commits only writes a small file for those commits.
+    """
+
+    bash_cmd = ('git commit-graph write --reachable --changed-paths --split')
+
+    with stage('write commit-graph'):
+        _run_bash_command(bash_cmd)
+
+
+def is_ancestor(ancestor, commit):
+    """Check whether one commit is an ancestor of another.
 
     Parameters
     ----------
-    commit : str, optional
-        The hash of the commit to get log entries for. If not given this will
-        return log entries for all commits.
+    ancestor : str
+        The hash of the possible ancestor.
+    commit : str
+        The hash of the possible descendant.
 
     Returns
     -------
-    logstr : str
-        A single string containing the output of a git log command.`
+    bool
+        True if ancestor is reachable from commit.
 
+    Raises
+    ------
+    CalledProcessError
+        If either commit doesn't exist.
     """
 
-    if commit is not None:
-        bash_cmd = \
-            'git --no-pager log --stat -1 {commit}'.format(commit=commit)
-    else:
-        bash_cmd = 'git --no-pager log --stat'
+    bash_cmd = ('git merge-base --is-ancestor {ancestor} {commit}'
+                .format(ancestor=ancestor, commit=commit))
 
-    stdout = _run_bash_command(bash_cmd)
+    try:
+        _run_bash_command(bash_cmd)
+    except CalledProcessError as err:
+        # git signals 'not an ancestor' with exit status 1
+        if err.returncode == 1:
+            return False
+        raise
 
-    return stdout
+    return True
 
 
-def get_bugfix_commits():
-    """Get the commits whose commit messages contain BUG or FIX.
+def _check_revision(rev):
+    """Check a revision given by the user can safely be passed to git.
+
+    Revisions are put on git's command line, so one which looks like an option
+    (e.g. '--output=<file>') would be run as that option instead.
+
+    Parameters
+    ----------
+    rev : str
+        A revision or revision range, e.g. 'HEAD' or 'A..B'.
+
+    Raises
+    ------
+    ValueError
+        If the revision starts with '-' or contains whitespace.
+    """
+
+    if not rev or rev.startswith('-') or any(c.isspace() for c in rev):
+        raise ValueError('Invalid revision: {rev!r}'.format(rev=rev))
+
+
+def get_rev_list(rev):
+    """Get the hashes of all the commits reachable from a revision.
+
+    Parameters
+    ----------
+    rev : str
+        The revision to list commits from.
 
     Returns
     -------
     commits : list(str)
-        A list of commit hashes.
+        A list of 8 character commit hashes.
+    """
+
+    _check_revision(rev)
+
+    bash_cmd = 'git rev-list {rev}'.format(rev=rev)
+
+    stdout = _run_bash_command(bash_cmd)
+
+    return [trim_hash(commit) for commit in stdout.split('\n') if commit]
+
+
+def parse_date(date):
+    """Convert a date to a unix timestamp, the way git does.
+
+    Parameters
+    ----------
+    date : str
+        A date in any format git understands, e.g. '2018-01-22' or
+        '2 years ago'.
+
+    Returns
+    -------
+    timestamp : int
+        The unix timestamp of the date.
+    """
+
+    # the date can contain spaces, so it can't go through _run_bash_command
+    args = _split_bash_command('git rev-parse') + ['--since=' + date]
+
+    record_git_process()
+
+    # git prints the date as a '--max-age=<timestamp>' option
+    stdout = check_output(args).decode('utf-8').strip()
+
+    return int(stdout.split('=', 1)[1])
+
+
+def count_commits(rev_range=None):
+    """Count the commits in a revision range.
+
+    Parameters
+    ----------
+    rev_range : str, optional
+        A revision range (e.g. 'A..B'). If not given this counts the commits
+        reachable from HEAD.
+
+    Returns
+    -------
+    n_commits : int
+        The number of commits git log would list for the range.
+    """
+
+    if rev_range is not None:
+        _check_revision(rev_range)
+
+    bash_cmd = 'git rev-list --count {revs}'.format(revs=rev_range or 'HEAD')
+
+    return int(_run_bash_command(bash_cmd))
+
+
+def _parse_tz_offset(date):
+    """Get the UTC offset in seconds from a date like '2018-02-04 -0600'."""
+
+    offset = date[-5:]
+    seconds = int(offset[1:3]) * 3600 + int(offset[3:5]) * 60
+
+    return -seconds if offset[0] == '-' else seconds
+
+
+def parse_log_lines(lines):
+    """Parse the lines of a git log stream into one entry per commit.
+
+    The lines are expected to come from 'git log' with the LOG_DIFF_OPTS
+    options and the LOG_FORMAT pretty format. They are consumed in a single
+    pass, so only the commit currently being parsed is ever held in memory.
+
+    Parameters
+    ----------
+    lines : iterable(str)
+        The lines of the git log output.
+
+    Yields
+    ------
+    entry : LogEntry
+        The hash, parents, author timestamp, author UTC offset (in seconds),
+        message and numstat for a commit. The numstat is a list of
+        (additions, deletions, filename) tuples, where binary files count as
+        zero additions and deletions.
+    """
+
+    header = None
+    entry = None
+
+    for line in lines:
+
+        # the header of a new commit starts with a NUL and may span several
+        # lines, since the commit message is embedded in it
+        if header is None and line.startswith('\x00'):
+            if entry is not None:
+                yield entry
+            header = line
+        elif header is not None:
+            header += line
+        elif line.strip():
+            added, deleted, fname = line.rstrip('\n').split('\t', 2)
+            entry.numstat.append((int(added) if added != '-' else 0,
+                                  int(deleted) if deleted != '-' else 0,
+                                  fname))
+            continue
+
+        if header is not None and header.count('\x00') == _LOG_FORMAT_NULS:
+            _, commit, parents, timestamp, date, message, _ = \
+                header.split('\x00')
+            entry = LogEntry(commit, parents.split(), int(timestamp),
+                             _parse_tz_offset(date), message, [])
+            header = None
+
+    if entry is not None:
+        yield entry
+
+
+def _get_git_log(commit=None, rev_range=None, skip=0, max_count=None):
+    """Get the git log entry for one or more commits from a git subprocess.
+
+    The log is streamed from git and parsed incrementally, so this never holds
+    the whole log in memory.
+
+    Parameters
+    ----------
+    commit : str or list(str), optional
+        The hash of the commit to get log entries for, or a list of hashes to
+        get log entries for all of them with a single git command. If not
+        given this will return log entries for all commits.
+    rev_range : str, optional
+        A revision range (e.g. 'A..B') to get log entries for. Ignored if
+        commit is given.
+    skip : int, optional
+        The number of commits at the start of the log to leave out. Ignored
+        if commit is given.
+    max_count : int, optional
+        The maximum number of log entries to get. Ignored if commit is given.
+
+    Yields
+    ------
+    entry : LogEntry
+        The parsed log entry for each commit, see parse_log_lines.
 
     Raises
     ------
     ValueError
-        If there are no bugfix commits (i.e. no commits which fix a bug
-        according to the commit messages).
+        If a commit or the revision range looks like a git option, see
+        _check_revision.
     """
 
-    # TODO: add option to specify custom bugfix tags
-    bash_cmd = "git log -i --all --grep BUG --grep FIX --pretty=format:%h"
+    if isinstance(commit, (list, tuple)):
+        for rev in commit:
+            _check_revision(rev)
+
+        # pass the commits on stdin so there's no limit on how many there are
+        bash_cmd = ('git --no-pager log {opts} --no-walk --stdin '
+                    '--pretty=format:{fmt}'.format(opts=LOG_DIFF_OPTS,
+                                                   fmt=LOG_FORMAT))
+
+        return parse_log_lines(_stream_bash_command(bash_cmd, commit))
+
+    if commit is not None:
+        _check_revision(commit)
+    elif rev_range is not None:
+        _check_revision(rev_range)
+
+    if commit is not None:
+        bash_cmd = ('git --no-pager log {opts} -1 --pretty=format:{fmt} '
+                    '{commit}'.format(opts=LOG_DIFF_OPTS, fmt=LOG_FORMAT,
+                                      commit=commit))
+    else:
+        bash_cmd = ('git --no-pager log {opts} --pretty=format:{fmt} '
+                    .format(opts=LOG_DIFF_OPTS, fmt=LOG_FORMAT))
+
+        if skip:
+            bash_cmd += '--skip={skip} '.format(skip=skip)
+        if max_count is not None:
+            bash_cmd += '--max-count={n} '.format(n=max_count)
+
+        bash_cmd += rev_range or ''
+
+    return parse_log_lines(_stream_bash_command(bash_cmd))
+
+
+def get_git_log(commit=None, rev_range=None, skip=0, max_count=None):
+    """Get the git log entry for one or more commits.
+
+    Parameters
+    ----------
+    commit : str or list(str), optional
+        The hash of the commit to get log entries for, or a list of hashes. If
+        not given this will return log entries for all commits.
+    rev_range : str, optional
+        A revision range (e.g. 'A..B') to get log entries for. Ignored if
+        commit is given.
+    skip : int, optional
+        The number of commits at the start of the log to leave out. Ignored
+        if commit is given.
+    max_count : int, optional
+        The maximum number of log entries to get. Ignored if commit is given.
+
+    Returns
+    -------
+    entries : iterable(LogEntry)
+        The log entry for each commit, from the current backend.
+    """
+
+    return get_backend().log(commit, rev_range, skip, max_count)
+
+
+def _get_bugfix_command(bug_tags):
+    """Get the git log command which lists the bugfix commits.
+
+    The command is a list of arguments, since the tags can contain spaces.
+    """
+
+    grep_opts = ['--grep={tag}'.format(tag=tag) for tag in bug_tags]
+
+    return ['git', 'log', '-i', '--all'] + grep_opts + ['--pretty=format:%H']
 
-    stdout = _run_bash_command(bash_cmd)
+
+def _parse_bugfix_commits(stdout):
+    """Get the bugfix commits from the output of _get_bugfix_command."""
 
     # filter out empty strings
     commits = [commit for commit in stdout.split('\n') if commit]
@@ -109,9 +580,92 @@ def get_bugfix_commits():
     return commits
 
 
+def get_bugfix_commits(bug_tags=BUG_TAGS):
+    """Get the commits whose commit messages contain BUG or FIX.
+
+    Parameters
+    ----------
+    bug_tags : iterable(str), optional
+        The (case insensitive) patterns which mark a commit message as fixing
+        a bug. Defaults to BUG and FIX.
+
+    Returns
+    -------
+    commits : list(str)
+        A list of full commit hashes.
+
+    Raises
+    ------
+    ValueError
+        If there are no bugfix commits (i.e. no commits which fix a bug
+        according to the commit messages).
+    """
+
+    with stage('find bugfix commits'):
+        stdout = _run_bash_command(_get_bugfix_command(bug_tags))
+
+    return _parse_bugfix_commits(stdout)
+
+
+def start_bugfix_commits(bug_tags=BUG_TAGS):
+    """Start looking for the bugfix commits in the background.
+
+    This lets git search the commit messages while gitrisky does something
+    else, e.g. parses the features.
+
+    Parameters
+    ----------
+    bug_tags : iterable(str), optional
+        The (case insensitive) patterns which mark a commit message as fixing
+        a bug. Defaults to BUG and FIX.
+
+    Returns
+    -------
+    get_commits : callable
+        Call it (once) to wait for the search to finish and get the bugfix
+        commits, as returned by get_bugfix_commits. Like get_bugfix_commits
+        it raises ValueError if there are none.
+    """
+
+    wait = _start_bash_command(_get_bugfix_command(bug_tags))
+
+    def get_commits():
+        with stage('find bugfix commits'):
+            stdout = wait()
+
+        return _parse_bugfix_commits(stdout)
+
+    return get_commits
+
+
+def _parse_name_status(lines):
+    """Get the modified files from 'git diff -M --name-status' output.
+
+    Files the commit added or deleted are left out, since they have no lines
+    which both existed before the commit and were changed by it. Renamed
+    files are given by their name before the commit.
+    """
+
+    filenames = []
+
+    for line in lines:
+
+        # lines look like 'M\t<path>' or 'R087\t<old path>\t<new path>'
+        fields = line.rstrip('\n').split('\t')
+
+        if fields[0] == 'M' or fields[0].startswith('R'):
+            filenames.append(fields[1])
+
+    return filenames
+
+
 def _get_commit_filenames(commit_hash):
     """Get the filename(s) of files which were modified by a specific commit.
 
+    Renames are detected, so a file which was renamed and modified is
+    included under its name before the commit. Added and deleted files are
+    left out.
+
     Parameters
     ----------
     commit_hash: str
@@ -120,31 +674,109 @@ def _get_commit_filenames(commit_hash):
     Returns
     -------
     filenames: list(str)
-        A list of the filenames which were modified by the specified commit.
+        A list of the filenames, as of the commit's first parent, which were
+        modified by the specified commit.
     """
 
     commit_hash = trim_hash(commit_hash)
 
-    bash_cmd = ('git --no-pager diff {commit_hash} {commit_hash}^ --name-only'
-                .format(commit_hash=commit_hash))
+    bash_cmd = ('git --no-pager diff -M --name-status {commit_hash}^ '
+                '{commit_hash}'.format(commit_hash=commit_hash))
 
     stdout = _run_bash_command(bash_cmd)
 
-    # note that .split() always returns a list, even if the string wasn't split
-    filenames = stdout.split('\n')
+    return _parse_name_status(stdout.split('\n'))
 
-    return filenames
+
+def _parse_hunk_header(header):
+    """Get the (start, number of lines) before a change from a hunk header.
+
+    The header looks like '@@ -198,2 +198,3 @@', or '@@ -198 +198 @@' if only
+    one line changes. The number of lines after the change is returned too.
+    """
+
+    old, new = header.split(' ', 3)[1:3]
+
+    start, _, n_lines = old[1:].partition(',')
+    n_new = new.partition(',')[2]
+
+    return start, n_lines or '1', int(n_new or 1)
+
+
+def _parse_diff_hunks(lines, filenames=None):
+    """Get the line ranges each file had changed from 'git diff -U0' output.
+
+    Parameters
+    ----------
+    lines : iterable(str)
+        The diff output lines.
+    filenames : list(str), optional
+        The files to get the changed lines of, by their name before the
+        diff. The changes to other files are skipped. By default the changes
+        to every file which was modified, rather than added or deleted, are
+        returned.
+
+    Returns
+    -------
+    fname_lines: dict{str: list}
+        A dictionary keyed on filename and valued with a list of
+        (start_line, number_of_lines) tuples.
+    """
+
+    if filenames is not None:
+        filenames = set(filenames)
+
+    fname_lines = defaultdict(lambda: [])
+
+    fname = None
+    to_skip = 0
+
+    for line in lines:
+
+        # skip the changed lines themselves, which could look like headers
+        if to_skip:
+            if not line.startswith('\\'):
+                to_skip -= 1
+            continue
+
+        if line.startswith('diff --git '):
+            fname = None
+
+        # the name before the diff, or /dev/null for added files
+        elif line.startswith('--- a/'):
+            fname = line[len('--- a/'):].rstrip('\n')
+            if filenames is not None and fname not in filenames:
+                fname = None
+
+        # deleted files have no lines left to fix
+        elif line.startswith('+++ /dev/null'):
+            fname = None
+
+        elif line.startswith('@@ '):
+            start, n_lines, n_new = _parse_hunk_header(line)
+            to_skip = int(n_lines) + n_new
+
+            # hunks which only add lines don't touch any existing lines
+            if int(n_lines) > 0 and fname is not None:
+                fname_lines[fname].append((start, n_lines))
+
+    return fname_lines
 
 
 def _get_commit_lines(commit_hash, filenames):
     """Get the line numbers which were modified in each file by a given commit.
 
+    The whole commit is diffed at once with rename detection, so the lines
+    changed in a renamed file are those which differ from the file under its
+    old name, rather than the whole file.
+
     Parameters
     ----------
     commit_hash: str
         The hash of a commit.
     filenames: list(str)
-        A list of the filenames which were modified by the specified commit.
+        A list of the filenames, as of the commit's first parent, which were
+        modified by the specified commit.
 
     Returns
     -------
@@ -154,39 +786,120 @@ def _get_commit_lines(commit_hash, filenames):
     """
 
     commit_hash = trim_hash(commit_hash)
-    fname_lines = defaultdict(lambda: [])
 
-    for fname in filenames:
+    bash_cmd = ('git --no-pager diff -M -U0 --src-prefix=a/ --dst-prefix=b/ '
+                '{commit}^ {commit}'.format(commit=commit_hash))
 
-        bash_cmd = ('git --no-pager diff {commit}^ {commit} -U0 -- {fname}'
-                    .format(commit=commit_hash, fname=fname))
+    stdout = _run_bash_command(bash_cmd)
 
-        stdout = _run_bash_command(bash_cmd)
+    return _parse_diff_hunks(stdout.split('\n'), filenames)
 
-        # pull out the header line of each diff section
-        headers = [l for l in stdout.split('\n') if '@@' in l]
 
-        # header will look like @@ -198,2 +198,2 @@
-        for header in headers:
+# git log command which diffs each of the commits given on its stdin against
+# their first parent, starting each one with a NUL and its hash
+_DIFF_COMMITS_COMMAND = ('git log -p -U0 -M --no-walk=unsorted '
+                         '--diff-merges=first-parent --src-prefix=a/ '
+                         '--dst-prefix=b/ --format=%x00%H --stdin')
 
-            # the .group(1) bit will pull out the part prefixed by '+'
-            match = re.match('@@ -(.*) +(.*) @@', header).group(1)
 
-            # header looks like @@ -198 +198 @@ if only one line changes
-            if ',' in match:
-                start, n_lines = match.split(',')
-            else:
-                start, n_lines = match, '1'
+class _CommitDiffSplitter(object):
+    """Split the output of _DIFF_COMMITS_COMMAND by commit, a line at a time.
 
-            if int(n_lines) > 0:
-                fname_lines[fname].append((start, n_lines))
+    The lines are pushed in rather than pulled from an iterator, so the same
+    splitter serves the log streamed by _iter_commit_hunks and the one read
+    with asyncio by _link_fixes_to_bugs_async.
+    """
 
-    return fname_lines
+    def __init__(self):
+        self._diff_lines = None
+
+    def feed(self, line):
+        """Add the next line of the log.
+
+        Returns
+        -------
+        diff_lines : list(str) or None
+            The diff lines of the previous commit, if this line starts the
+            next one.
+        """
+
+        # each commit starts with a NUL and its hash, which no diff line can
+        # start with
+        if line.startswith('\x00'):
+            diff_lines, self._diff_lines = self._diff_lines, []
+            return diff_lines
+
+        if self._diff_lines is not None:
+            self._diff_lines.append(line)
+
+        return None
+
+    def close(self):
+        """Get the diff lines of the last commit, or None if the log was
+        empty."""
+
+        diff_lines, self._diff_lines = self._diff_lines, None
+        return diff_lines
+
+
+def _split_commit_diffs(lines):
+    """Split the output of _iter_commit_hunks' log command by commit.
+
+    Yields
+    ------
+    diff_lines : list(str)
+        The diff lines of each commit in turn.
+    """
+
+    splitter = _CommitDiffSplitter()
+
+    for line in lines:
+        diff_lines = splitter.feed(line)
+        if diff_lines is not None:
+            yield diff_lines
+
+    diff_lines = splitter.close()
+    if diff_lines is not None:
+        yield diff_lines
+
+
+def _iter_commit_hunks(commits):
+    """Get the line numbers modified in every file by each of some commits.
+
+    All the commits are diffed against their first parent by a single 'git
+    log -p' process, whose output is parsed a commit at a time as it streams
+    in, rather than with separate git commands to list and diff the files
+    each commit modified.
+
+    Parameters
+    ----------
+    commits : list(str)
+        The hashes of some commits, with no duplicates.
+
+    Yields
+    ------
+    fname_lines: dict{str: list}
+        For each commit in turn, a dictionary keyed on the filenames (as of
+        the commit's first parent) which the commit modified, and valued
+        with a list of (start_line, number_of_lines) tuples, like
+        _get_commit_lines.
+    """
+
+    if not commits:
+        return
 
+    lines = _stream_bash_command(_DIFF_COMMITS_COMMAND, stdin_lines=commits)
 
-def _get_blame_commit(commit_hash, filenames, fname_lines):
+    for diff_lines in _split_commit_diffs(lines):
+        yield _parse_diff_hunks(diff_lines)
+
+
+def _get_blame_commit(commit_hash, filenames, fname_lines, since=None):
     """Get the commits which last touched the lines changed by a given commit.
 
+    Each file is blamed once, with one '-L' option per modified hunk, rather
+    than once per hunk.
+
     Parameters
     ----------
     commit_hash: str
@@ -196,6 +909,10 @@ def _get_blame_commit(commit_hash, filenames, fname_lines):
     fname_lines: dict{str: list}
         A dictionary keyed on filename and valued with a list of
         (start_line, number_of_lines) tuples.
+    since: int, optional
+        A unix timestamp to stop blaming at. Lines last modified before then
+        aren't linked to any commit, which bounds how much history each blame
+        walks.
 
     Returns
     -------
@@ -209,54 +926,408 @@ def _get_blame_commit(commit_hash, filenames, fname_lines):
 
     for fname in filenames:
 
-        for start, n_lines in fname_lines[fname]:
+        # files with no modified lines have nothing to blame
+        if not fname_lines[fname]:
+            continue
 
-            bash_cmd = \
-                ('git --no-pager blame -L{start},+{n} {commit}^ -- {fname}'
-                 .format(start=start,
-                         n=n_lines,
-                         commit=commit_hash,
-                         fname=fname))
+        bash_cmd = _get_blame_command(commit_hash, fname, fname_lines[fname],
+                                      since)
 
-            stdout = _run_bash_command(bash_cmd)
+        stdout = _run_bash_command(bash_cmd)
 
-            changed_lines = stdout.split('\n')
-            buggy_commits = \
-                buggy_commits.union([l.split(' ')[0] for l in changed_lines])
+        buggy_commits.update(_parse_blame(stdout, since))
 
     return buggy_commits
 
 
-def link_fixes_to_bugs(fix_commits):
-    """Link a bugfix commit to the commits which introduced the bug it fixes.
+def _get_blame_command(commit_hash, fname, line_ranges, since=None):
+    """Get the git blame command for some lines of a file before a commit.
+
+    The file is blamed once, with one '-L' option per modified hunk, rather
+    than once per hunk.
+    """
+
+    since_opt = '--since={} '.format(since) if since is not None else ''
+
+    line_opts = ' '.join('-L{start},+{n}'.format(start=start, n=n_lines)
+                         for start, n_lines in line_ranges)
+
+    return ('git --no-pager blame {since_opt}{line_opts} {commit}^ '
+            '-- {fname}'.format(since_opt=since_opt, line_opts=line_opts,
+                                commit=commit_hash, fname=fname))
+
+
+def _parse_blame(stdout, since=None):
+    """Get the hashes of the commits blamed in 'git blame' output."""
+
+    changed_lines = stdout.split('\n')
+
+    # with a time bound git blames lines which are older than it on the
+    # oldest commit it looked at, marked as a boundary with a '^'
+    if since is not None:
+        changed_lines = [line for line in changed_lines
+                         if not line.startswith('^')]
+
+    # trim the hashes since git abbreviates them to more than 8 characters
+    # in large repositories
+    return set(trim_hash(line.split(' ')[0]) for line in changed_lines)
+
+
+async def _link_fix_to_bugs_async(commit_hash, fname_lines, since, limit,
+                                  timeout):
+    """Blame the files modified by a bugfix commit concurrently, see
+    _link_fix_to_bugs.
+
+    Returns
+    -------
+    origin_commits: set or None
+        The hashes of the commits which last modified the lines modified by
+        the bugfix commit, or None if a blame timed out.
+    """
+
+    from .gitasync import gather_or_cancel, run_command
+
+    commit_hash = trim_hash(commit_hash)
+
+    # e.g. a fix which only added or deleted files
+    if not fname_lines:
+        return set()
+
+    blames = [run_command(_split_bash_command(
+                  _get_blame_command(commit_hash, fname, line_ranges, since)),
+                  limit, timeout)
+              for fname, line_ranges in fname_lines.items() if line_ranges]
+
+    try:
+        stdouts = await gather_or_cancel(blames)
+    except TimeoutExpired:
+        warnings.warn('Skipped bugfix commit {commit}: git blame ran for '
+                      'more than {timeout} seconds'
+                      .format(commit=commit_hash, timeout=timeout))
+        return None
+
+    return set().union(*(_parse_blame(stdout.decode('utf-8').rstrip('\n'),
+                                      since)
+                         for stdout in stdouts))
+
+
+async def _link_fixes_to_bugs_async(fix_commits, n_workers, since, timeout):
+    """Link bugfix commits to bugs with concurrent git commands, see
+    SubprocessBackend.link_fixes.
+
+    Each fix is blamed as soon as its diff has been read from the git log
+    stream, while the diffs of the later fixes are still being read.
+    """
+
+    import asyncio
+
+    from .gitasync import gather_or_cancel, stream_command
+
+    limit = asyncio.Semaphore(n_workers)
+
+    commits = iter(fix_commits)
+    links = []
+
+    def link(diff_lines):
+        links.append(asyncio.ensure_future(_link_fix_to_bugs_async(
+            next(commits), _parse_diff_hunks(diff_lines), since, limit,
+            timeout)))
+
+    lines = stream_command(_split_bash_command(_DIFF_COMMITS_COMMAND),
+                           stdin_lines=fix_commits)
+
+    splitter = _CommitDiffSplitter()
+
+    try:
+        async for line in lines:
+            diff_lines = splitter.feed(line)
+            if diff_lines is not None:
+                link(diff_lines)
+
+        diff_lines = splitter.close()
+        if diff_lines is not None:
+            link(diff_lines)
+
+        origin_commits = await gather_or_cancel(links)
+
+    finally:
+        await lines.aclose()
+
+        # stop blaming if the log failed part way through
+        for task in links:
+            task.cancel()
+        await asyncio.gather(*links, return_exceptions=True)
+
+    return {commit: origins
+            for commit, origins in zip(fix_commits, origin_commits)
+            if origins is not None}
+
+
+class GitBackend(object):
+    """The git operations gitrisky needs to extract features and labels.
+
+    Subclasses implement these either by running git commands (see
+    SubprocessBackend) or by reading the repository in-process.
+    """
+
+    # the name which selects this backend, see set_backend
+    name = None
+
+    def log(self, commit=None, rev_range=None, skip=0, max_count=None):
+        """Get the log entries of some commits, see _get_git_log."""
+        raise NotImplementedError
+
+    def changed_files(self, commit):
+        """Get the files modified by a commit, see _get_commit_filenames."""
+        raise NotImplementedError
+
+    def changed_lines(self, commit, filenames):
+        """Get the lines modified by a commit, see _get_commit_lines."""
+        raise NotImplementedError
+
+    def blame(self, commit, filenames, fname_lines, since=None):
+        """Get the commits which last modified some lines before a commit,
+        see _get_blame_commit."""
+        raise NotImplementedError
+
+    def changed_hunks(self, commits):
+        """Get the lines modified in every file by each of some commits, see
+        _iter_commit_hunks.
+
+        Backends which can diff many commits at once should override this,
+        by default each commit is looked up with changed_files and
+        changed_lines.
+        """
+
+        for commit in commits:
+            filenames = self.changed_files(commit)
+            yield self.changed_lines(commit, filenames) if filenames else {}
+
+    def link_fixes(self, fix_commits, n_workers, since=None, timeout=None):
+        """Find the commits which introduced the bug fixed by each bugfix
+        commit, see map_fixes_to_bugs.
+
+        By default the fixes are blamed by a pool of threads, and the timeout
+        is ignored.
+        """
+
+        # the lines each fix modified, diffed in bulk as they're needed
+        hunks = self.changed_hunks(fix_commits)
+
+        if n_workers == 1:
+            origin_commits = [_link_fix_to_bugs(commit, fname_lines, since)
+                              for commit, fname_lines
+                              in zip(fix_commits, hunks)]
+        else:
+            with ThreadPoolExecutor(max_workers=n_workers) as executor:
+                origin_commits = list(executor.map(_link_fix_to_bugs,
+                                                   fix_commits, hunks,
+                                                   repeat(since)))
+
+        return dict(zip(fix_commits, origin_commits))
+
+
+class SubprocessBackend(GitBackend):
+    """Run a git subprocess for each operation."""
+
+    name = 'subprocess'
+
+    def log(self, commit=None, rev_range=None, skip=0, max_count=None):
+        return _get_git_log(commit, rev_range, skip, max_count)
+
+    def changed_files(self, commit):
+        return _get_commit_filenames(commit)
+
+    def changed_lines(self, commit, filenames):
+        return _get_commit_lines(commit, filenames)
+
+    def blame(self, commit, filenames, fname_lines, since=None):
+        return _get_blame_commit(commit, filenames, fname_lines, since)
+
+    def changed_hunks(self, commits):
+        return _iter_commit_hunks(commits)
+
+    def link_fixes(self, fix_commits, n_workers, since=None, timeout=None):
+        """Run up to n_workers git blames at once with asyncio, see
+        _link_fixes_to_bugs_async. Fixes whose blames time out are left
+        out."""
+
+        if not fix_commits:
+            return {}
+
+        # asyncio is only imported when it's needed, since it's slow to
+        # import and would otherwise slow down every command's startup
+        import asyncio
+
+        return asyncio.run(_link_fixes_to_bugs_async(fix_commits, n_workers,
+                                                     since, timeout))
+
+
+# the names which can be passed to set_backend
+BACKENDS = ('subprocess', 'pygit2')
+
+# the backend used by the functions in this module, see set_backend
+_backend = None
+
+
+def set_backend(name):
+    """Choose how gitrisky reads the repository.
+
+    Parameters
+    ----------
+    name : str
+        Either 'subprocess', to run git commands, or 'pygit2', to read the
+        repository in-process with libgit2 (this requires pygit2).
+    """
+
+    global _backend
+
+    if name == 'subprocess':
+        _backend = SubprocessBackend()
+    elif name == 'pygit2':
+        # pygit2 is optional so only import it when it's asked for
+        from .libgit2 import Pygit2Backend
+        _backend = Pygit2Backend()
+    else:
+        raise ValueError('Unknown git backend: {}'.format(name))
+
+
+def get_backend():
+    """Get the backend the functions in this module use to read the repository.
+
+    Unless set_backend has been called this is chosen by the GITRISKY_BACKEND
+    environment variable, defaulting to 'subprocess'.
+
+    Returns
+    -------
+    backend : GitBackend
+        The current backend.
+    """
+
+    if _backend is None:
+        set_backend(os.environ.get('GITRISKY_BACKEND', 'subprocess'))
+
+    return _backend
+
+
+def _link_fix_to_bugs(commit, fname_lines, since=None):
+    """Link a single bugfix commit to the commits which introduced the bug.
+
+    Parameters
+    ----------
+    commit: str
+        The hash of a commit which fixes a bug.
+    fname_lines: dict{str: list}
+        The lines modified by the commit, as given by the backend's
+        changed_hunks.
+    since: int, optional
+        A unix timestamp to stop blaming at, see _get_blame_commit.
+
+    Returns
+    -------
+    origin_commits: set
+        A set containing the hashes of the commits which last modified the
+        lines modified by the bugfix commit.
+    """
+
+    # e.g. a fix which only added or deleted files
+    if not fname_lines:
+        return set()
+
+    # trim the hash to 8 characters
+    commit = trim_hash(commit)
+
+    # get the last commit to modify those lines
+    return get_backend().blame(commit, list(fname_lines), fname_lines, since)
+
+
+def _get_n_workers(n_jobs):
+    """Translate an n_jobs value into a number of workers.
+
+    This follows the scikit-learn convention where None means 1 and negative
+    values count back from the number of CPUs (so -1 means all CPUs).
+    """
+
+    if n_jobs is None:
+        return 1
+
+    if n_jobs < 0:
+        return max(os.cpu_count() + 1 + n_jobs, 1)
+
+    return max(n_jobs, 1)
+
+
+def map_fixes_to_bugs(fix_commits, n_jobs=1, since=None,
+                      timeout=BLAME_TIMEOUT):
+    """Find the commits which introduced the bug fixed by each bugfix commit.
 
     Parameters
     ----------
     fix_commits: list(str)
         A list of hashes for commits which fix bugs.
+    n_jobs: int, optional
+        The number of git blames to run concurrently. These spend nearly all
+        of their time waiting on git, so they're run as asyncio subprocesses
+        (or threads with the pygit2 backend) rather than in separate
+        processes. -1 means use all CPUs.
+    since: str, optional
+        A date, in any format git understands (e.g. '2 years ago'), to stop
+        blaming at. Lines last modified before then aren't linked to a bug,
+        which bounds the time taken to blame each bugfix commit on deep
+        histories.
+    timeout: float, optional
+        The number of seconds to let each git blame run for. Bugfix commits
+        whose blames take any longer are skipped, with a warning, and left
+        out of the results. None means no timeout.
 
     Returns
     -------
-    bug_commits: list(str)
-        A list of hashes for commits which introduced bugs.
+    bug_origins: dict{str: set}
+        A dictionary keyed on bugfix commit hash and valued with the set of
+        hashes of the commits which introduced the bug.
     """
 
-    bug_commits = set()
+    n_workers = _get_n_workers(n_jobs)
+
+    # git only diffs each commit once
+    fix_commits = list(dict.fromkeys(fix_commits))
 
-    for commit in fix_commits:
+    # resolve relative dates once, so every fix is blamed back to the same
+    # time
+    if since is not None:
+        since = parse_date(since)
 
-        # trim the hash to 8 characters
-        commit = trim_hash(commit)
+    with stage('link fixes to bugs'):
+        return get_backend().link_fixes(fix_commits, n_workers, since,
+                                        timeout)
 
-        # get the files modified by the commit
-        filenames = _get_commit_filenames(commit)
 
-        # get the lines in each file modified by the commit
-        fname_lines = _get_commit_lines(commit, filenames)
+def link_fixes_to_bugs(fix_commits, n_jobs=1, since=None,
+                       timeout=BLAME_TIMEOUT):
+    """Link a bugfix commit to the commits which introduced the bug it fixes.
+
+    Parameters
+    ----------
+    fix_commits: list(str)
+        A list of hashes for commits which fix bugs.
+    n_jobs: int, optional
+        The number of bugfix commits to process concurrently. -1 means use
+        all CPUs.
+    since: str, optional
+        A date to stop blaming at, see map_fixes_to_bugs.
+    timeout: float, optional
+        The number of seconds to let each git blame run for, see
+        map_fixes_to_bugs.
+
+    Returns
+    -------
+    bug_commits: list(str)
+        A list of hashes for commits which introduced bugs.
+    """
 
-        # get the last commit to modify those lines
-        origin_commits = _get_blame_commit(commit, filenames, fname_lines)
+    bug_origins = map_fixes_to_bugs(fix_commits, n_jobs=n_jobs, since=since,
+                                    timeout=timeout)
 
-        bug_commits = bug_commits.union(origin_commits)
+    bug_commits = set().union(*bug_origins.values())
 
     return list(bug_commits)
@@ -0,0 +1,246 @@
+"""This module contains a git backend which reads the repository in-process.
+
+Rather than running a git subprocess for every operation, the object database
+(packfiles, commit graph etc.) is read directly through libgit2, which saves
+the process start up and output parsing costs. This needs pygit2 to be
+installed, e.g. with 'pip install gitrisky[pygit2]'.
+"""
+
+import threading
+
+from collections import defaultdict
+from itertools import islice
+
+import pygit2
+
+from .gitcmds import GitBackend, LogEntry, get_repo_dir, trim_hash
+
+
+def _rename_path(old_path, new_path):
+    """Name a renamed file like git does, e.g. 'src/{a.py => b.py}'."""
+
+    # the common leading and trailing directories are only shown once
+    prefix = 0
+    for i, (old_char, new_char) in enumerate(zip(old_path, new_path)):
+        if old_char != new_char:
+            break
+        if old_char == '/':
+            prefix = i + 1
+
+    suffix = 0
+    max_suffix = min(len(old_path), len(new_path)) - prefix
+    for i in range(1, max_suffix + 1):
+        if old_path[-i] != new_path[-i]:
+            break
+        if old_path[-i] == '/':
+            suffix = i
+
+    if not prefix and not suffix:
+        return '{} => {}'.format(old_path, new_path)
+
+    return '{}{{{} => {}}}{}'.format(
+        old_path[:prefix],
+        old_path[prefix:len(old_path) - suffix],
+        new_path[prefix:len(new_path) - suffix],
+        old_path[len(old_path) - suffix:])
+
+
+def _diff_numstat(diff):
+    """Get the (additions, deletions, filename) of each file in a diff, with
+    renames named like 'git log --numstat' does."""
+
+    numstat = []
+
+    for patch in diff:
+        _, additions, deletions = patch.line_stats
+        old_path = patch.delta.old_file.path
+        new_path = patch.delta.new_file.path
+
+        if old_path != new_path:
+            fname = _rename_path(old_path, new_path)
+        else:
+            fname = new_path
+
+        numstat.append((additions, deletions, fname))
+
+    return numstat
+
+
+class Pygit2Backend(GitBackend):
+    """Read the repository in-process with pygit2.
+
+    pygit2 repositories can't be shared between threads, so each thread opens
+    its own.
+    """
+
+    name = 'pygit2'
+
+    def __init__(self):
+        self._local = threading.local()
+
+    @property
+    def repo(self):
+        if not hasattr(self._local, 'repo'):
+            self._local.repo = pygit2.Repository(get_repo_dir())
+        return self._local.repo
+
+    def _get_commit(self, rev):
+        return self.repo.revparse_single(rev).peel(pygit2.Commit)
+
+    def _get_entry(self, commit):
+        """Build the log entry for a pygit2 commit."""
+
+        if commit.parents:
+            # like LOG_DIFF_OPTS, merge commits are diffed against their
+            # first parent
+            diff = commit.tree.diff_to_tree(commit.parents[0].tree,
+                                            swap=True)
+            diff.find_similar()
+            numstat = _diff_numstat(diff)
+        else:
+            # root commits are diffed against the empty tree
+            numstat = _diff_numstat(commit.tree.diff_to_tree(swap=True))
+
+        return LogEntry(str(commit.id),
+                        [str(parent) for parent in commit.parent_ids],
+                        commit.author.time,
+                        commit.author.offset * 60,
+                        commit.message,
+                        numstat)
+
+    def log(self, commit=None, rev_range=None, skip=0, max_count=None):
+
+        if isinstance(commit, (list, tuple)):
+            commits = sorted((self._get_commit(c) for c in commit),
+                             key=lambda c: c.commit_time, reverse=True)
+            return (self._get_entry(c) for c in commits)
+
+        if commit is not None:
+            return iter([self._get_entry(self._get_commit(commit))])
+
+        # like git log, list children before their parents and otherwise
+        # newest first
+        walker = self.repo.walk(None, pygit2.enums.SortMode.TOPOLOGICAL |
+                                pygit2.enums.SortMode.TIME)
+
+        rev_range = rev_range or 'HEAD'
+
+        if '..' in rev_range:
+            start, end = rev_range.split('..', 1)
+            walker.push(self._get_commit(end or 'HEAD').id)
+            walker.hide(self._get_commit(start or 'HEAD').id)
+        else:
+            walker.push(self._get_commit(rev_range).id)
+
+        stop = skip + max_count if max_count is not None else None
+
+        return (self._get_entry(c) for c in islice(walker, skip, stop))
+
+    def changed_files(self, commit):
+
+        commit = self._get_commit(commit)
+
+        # a root commit only adds files
+        if not commit.parents:
+            return []
+
+        diff = self.repo.diff(commit.parents[0], commit)
+        diff.find_similar()
+
+        # like _get_commit_filenames, added and deleted files are left out
+        # and renamed files go by their old name
+        return [delta.old_file.path for delta in diff.deltas
+                if delta.status in (pygit2.enums.DeltaStatus.MODIFIED,
+                                    pygit2.enums.DeltaStatus.RENAMED)]
+
+    def changed_lines(self, commit, filenames):
+
+        commit = self._get_commit(commit)
+        filenames = set(filenames)
+        fname_lines = defaultdict(lambda: [])
+
+        # a root commit has no lines from before it to modify
+        if not commit.parents:
+            return fname_lines
+
+        # a single diff covers all the files, rather than one per file
+        diff = self.repo.diff(commit.parents[0], commit, context_lines=0)
+        diff.find_similar()
+
+        for patch in diff:
+            fname = patch.delta.old_file.path
+
+            if fname not in filenames:
+                continue
+
+            for hunk in patch.hunks:
+                if hunk.old_lines > 0:
+                    fname_lines[fname].append((str(hunk.old_start),
+                                               str(hunk.old_lines)))
+
+        return fname_lines
+
+    def _get_oldest_commit(self, commit, since):
+        """Find the newest commit before a unix timestamp, which blame
+        stops at in place of git blame's --since.
+
+        This bounds how far back blame walks, but only along the history
+        through that commit, see blame.
+        """
+
+        walker = self.repo.walk(commit.id, pygit2.enums.SortMode.TIME)
+
+        for ancestor in walker:
+            if ancestor.commit_time < since:
+                return ancestor.id
+
+        return None
+
+    def blame(self, commit, filenames, fname_lines, since=None):
+
+        commit = self._get_commit(commit)
+        buggy_commits = set()
+
+        # a root commit has no history to blame
+        if not commit.parents:
+            return buggy_commits
+
+        parent = commit.parents[0]
+
+        oldest = {}
+        if since is not None:
+            oldest_commit = self._get_oldest_commit(parent, since)
+            if oldest_commit is not None:
+                oldest = {'oldest_commit': oldest_commit}
+
+        for fname in filenames:
+            for start, n_lines in fname_lines[fname]:
+
+                start = int(start)
+                blame = self.repo.blame(fname,
+                                        newest_commit=parent.id,
+                                        min_line=start,
+                                        max_line=start + int(n_lines) - 1,
+                                        **oldest)
+
+                for hunk in blame:
+                    commit_hash = str(hunk.final_commit_id)
+
+                    # lines older than the time bound aren't linked to a bug.
+                    # oldest_commit only bounds the blame along one line of
+                    # history, so on branchy history lines from older commits
+                    # on other branches get through and are dropped here
+                    if since is not None and (
+                            hunk.boundary or
+                            self.repo[hunk.final_commit_id].commit_time <
+                            since):
+                        continue
+
+                    # git marks lines from the root commit as boundary
+                    # lines, prefixed with a '^'
+                    if hunk.boundary:
+                        commit_hash = '^' + commit_hash[:7]
+
+                    buggy_commits.add(trim_hash(commit_hash))
+
+        return buggy_commits
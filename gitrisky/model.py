@@ -1,10 +1,18 @@
 """This module contains code to load and save gitrisky models"""
 
 import os
-import pickle
 
-from git import Repo
-from sklearn.ensemble import RandomForestClassifier
+import numpy as np
+
+from . import __version__
+from .config import DEFAULT_TIMEZONE
+from .forest import export_forest, load_forest, save_forest
+from .gitcmds import get_repo_dir
+
+
+# bump this whenever the layout of saved models changes, so that models saved
+# by older versions are detected rather than misread
+MODEL_FORMAT_VERSION = 1
 
 
 def _get_model_path():
@@ -18,61 +26,425 @@ def _get_model_path():
         The full path to the gitrisky model
     """
 
-    # use gitpython.Repo to find the repository's top level directory
-    repo_dir = Repo('.', search_parent_directories=True).working_tree_dir
-    model_path = os.path.join(repo_dir, 'gitrisky.model')
+    model_path = os.path.join(get_repo_dir(), 'gitrisky.model')
 
     return model_path
 
 
-def create_model():
+def _get_forest_path():
+    """Get the full path of the NumPy copy of the gitrisky model.
+
+    Returns
+    -------
+    path : str
+        The full path to '<repo toplevel>/gitrisky.forest.npz'
+    """
+
+    return os.path.join(get_repo_dir(), 'gitrisky.forest.npz')
+
+
+# the estimators create_model can build, with the arguments they're created
+# with
+ESTIMATORS = {
+    'random_forest': ('sklearn.ensemble', 'RandomForestClassifier', {}),
+    'extra_trees': ('sklearn.ensemble', 'ExtraTreesClassifier', {}),
+    'gradient_boosting': ('sklearn.ensemble', 'GradientBoostingClassifier',
+                          {}),
+    # the logistic loss is needed for predict_proba
+    'sgd': ('sklearn.linear_model', 'SGDClassifier', {'loss': 'log_loss'}),
+}
+
+# the estimators which are sensitive to the scale of the features, which
+# range from hours of the day to unix timestamps. These are trained in a
+# pipeline which standardizes the features first, see create_model
+SCALED_ESTIMATORS = ('sgd',)
+
+# the hyperparameters searched over for each estimator
+PARAM_DISTRIBUTIONS = {
+    'random_forest': {'n_estimators': [50, 100, 200, 400],
+                      'max_depth': [None, 4, 8, 16, 32],
+                      'min_samples_leaf': [1, 2, 5, 10],
+                      'max_features': ['sqrt', 'log2', None]},
+    'extra_trees': {'n_estimators': [50, 100, 200, 400],
+                    'max_depth': [None, 4, 8, 16, 32],
+                    'min_samples_leaf': [1, 2, 5, 10],
+                    'max_features': ['sqrt', 'log2', None]},
+    'gradient_boosting': {'n_estimators': [50, 100, 200, 400],
+                          'max_depth': [2, 3, 5, 8],
+                          'learning_rate': [0.03, 0.1, 0.3],
+                          'subsample': [0.5, 0.8, 1.0]},
+    'sgd': {'alpha': [1e-5, 1e-4, 1e-3, 1e-2],
+            'penalty': ['l2', 'l1', 'elasticnet']},
+}
+
+# the hyperparameter search methods, see create_model
+SEARCH_METHODS = ('randomized', 'halving')
+
+
+def create_model(estimator='random_forest', n_jobs=None, n_estimators=None,
+                 max_depth=None, search=None, n_iter=10, cv=3):
     """Create a new model.
 
+    Parameters
+    ----------
+    estimator : str, optional
+        The kind of model, one of the keys of ESTIMATORS.
+    n_jobs : int, optional
+        The number of CPUs to train with, for the estimators which support
+        it. -1 means use all CPUs.
+    n_estimators : int, optional
+        The number of trees in the ensemble. Defaults to scikit-learn's
+        default.
+    max_depth : int, optional
+        The maximum depth of each tree. Defaults to scikit-learn's default.
+    search : str, optional
+        If given, tune the hyperparameters which weren't set explicitly with
+        a cross-validated 'randomized' or successive 'halving' search. The
+        candidates are evaluated in parallel using n_jobs CPUs.
+    n_iter : int, optional
+        The number of candidates to evaluate in a randomized search.
+    cv : int, optional
+        The number of cross-validation folds to evaluate candidates with.
+
+    Returns
+    -------
+    model : scikit-learn model
+        A new, untrained scikit-learn model. If search is given this is a
+        search object, see fit_model.
+
+    Raises
+    ------
+    ValueError
+        If a setting doesn't apply to the estimator.
+    """
+
+    from importlib import import_module
+
+    if estimator not in ESTIMATORS:
+        raise ValueError('Unknown estimator: {}'.format(estimator))
+
+    # scikit-learn is slow to import so only do so when it's needed
+    module, name, kwargs = ESTIMATORS[estimator]
+    model = getattr(import_module(module), name)(**kwargs)
+
+    params = model.get_params()
+    settings = {'n_estimators': n_estimators, 'max_depth': max_depth}
+
+    for param, value in settings.items():
+        if value is None:
+            continue
+        if param not in params:
+            raise ValueError('{estimator} has no {param} setting'
+                             .format(estimator=estimator, param=param))
+        model.set_params(**{param: value})
+
+    # with a search the candidates are trained in parallel instead
+    if 'n_jobs' in params and search is None:
+        model.set_params(n_jobs=n_jobs)
+
+    # the pipeline's settings for the estimator are prefixed with its name
+    prefix = ''
+
+    if estimator in SCALED_ESTIMATORS:
+        from sklearn.pipeline import Pipeline
+        from sklearn.preprocessing import StandardScaler
+
+        model = Pipeline([('scale', StandardScaler()), (estimator, model)])
+        prefix = estimator + '__'
+
+    if search is None:
+        return model
+
+    # don't search over the settings which were set explicitly
+    distributions = {prefix + param: values for param, values
+                     in PARAM_DISTRIBUTIONS[estimator].items()
+                     if settings.get(param) is None}
+
+    if search == 'randomized':
+        from sklearn.model_selection import RandomizedSearchCV
+
+        return RandomizedSearchCV(model, distributions, n_iter=n_iter, cv=cv,
+                                  scoring='roc_auc', n_jobs=n_jobs)
+
+    if search == 'halving':
+        from sklearn.experimental import enable_halving_search_cv  # noqa
+        from sklearn.model_selection import HalvingRandomSearchCV
+
+        return HalvingRandomSearchCV(model, distributions, cv=cv,
+                                     scoring='roc_auc', n_jobs=n_jobs)
+
+    raise ValueError('Unknown search method: {}'.format(search))
+
+
+def _partial_fit_pipeline(pipeline, X, y, batch_size):
+    """Train a pipeline whose steps all support partial_fit in mini-batches.
+
+    Each step is trained in turn on every batch, transformed by the steps
+    already trained, e.g. a StandardScaler learns the mean and variance of
+    the features from all the batches before the classifier after it sees
+    any of them.
+    """
+
+    *transforms, (_, classifier) = pipeline.steps
+
+    def transformed_batches(n_steps):
+        for start in range(0, len(X), batch_size):
+            batch = X[start:start + batch_size]
+            for _, step in transforms[:n_steps]:
+                batch = step.transform(batch)
+            yield batch, y[start:start + batch_size]
+
+    for n_steps, (_, step) in enumerate(transforms):
+        for batch, _ in transformed_batches(n_steps):
+            step.partial_fit(batch)
+
+    for batch, batch_y in transformed_batches(len(transforms)):
+        classifier.partial_fit(batch, batch_y, classes=[0, 1])
+
+
+def fit_model(model, X, y, columns=None, batch_size=10000):
+    """Train a model, in mini-batches if it supports partial_fit.
+
+    Models with partial_fit, or pipelines whose steps all have it, never need
+    more than one batch of the training data in memory at once, so X can be
+    a memory-mapped array which is much larger than the available RAM.
+
+    Parameters
+    ----------
+    model : scikit-learn model
+        The model to train.
+    X : array-like of shape [n_commits, n_features]
+        The training features.
+    y : array-like of shape [n_commits]
+        The training labels.
+    columns : list(str), optional
+        The name of each feature, which is checked against the features the
+        model is later used to score.
+    batch_size : int, optional
+        The number of commits in each mini-batch.
+
     Returns
     -------
     model : scikit-learn model
-        A saved scikit-learn model
+        The trained model.
     """
 
-    # instantiate a new model
-    # TODO: replace this with a gridsearchCV object for hyperparameter tuning
-    model = RandomForestClassifier()
+    steps = [step for _, step in getattr(model, 'steps', [])]
+
+    if hasattr(model, 'partial_fit'):
+        for start in range(0, len(X), batch_size):
+            model.partial_fit(X[start:start + batch_size],
+                              y[start:start + batch_size],
+                              classes=[0, 1])
+    elif steps and all(hasattr(step, 'partial_fit') for step in steps):
+        _partial_fit_pipeline(model, X, y, batch_size)
+    else:
+        model.fit(X, y)
+
+    # arrays have no column names, so record them like fitting on a
+    # dataframe would. A search's best model is what's used for scoring, and
+    # a pipeline takes its column names from its first step.
+    if columns is not None:
+        fitted = getattr(model, 'best_estimator_', model)
+        fitted = getattr(fitted, 'steps', [(None, fitted)])[0][1]
+        fitted.feature_names_in_ = np.array(columns, dtype=object)
 
     return model
 
 
+class IncompatibleModelError(Exception):
+    """Raised when a saved model can't be used by this version of gitrisky."""
+
+
 def load_model():
-    """Load a model from a pickle file.
+    """Load a saved model.
+
+    The model's arrays are memory-mapped from the file rather than read into
+    memory, so even large forests load quickly.
 
     Returns
     -------
     model : scikit-learn model
-        A saved scikit-learn model
+        A saved scikit-learn model, with the timezone it was trained with as
+        its timezone_ attribute.
 
     Raises
     ------
     FileNotFoundError
-        If the trained model pickle file can't be found
+        If the trained model file can't be found
+    IncompatibleModelError
+        If the model was saved by an older version of gitrisky, or with a
+        different version of scikit-learn.
     """
 
+    import joblib
+    import sklearn
+
     model_path = _get_model_path()
 
-    with open(model_path, 'rb') as infile:
-        model = pickle.load(infile)
+    try:
+        saved = joblib.load(model_path, mmap_mode='r')
+    except FileNotFoundError:
+        raise
+    except Exception as err:
+        raise IncompatibleModelError(
+            'could not read {path} ({err}), retrain it with "gitrisky train"'
+            .format(path=model_path, err=err))
+
+    # models saved before the format was versioned are bare pickles
+    if not isinstance(saved, dict) or 'format_version' not in saved:
+        raise IncompatibleModelError(
+            '{path} was saved by an older version of gitrisky, retrain it '
+            'with "gitrisky train"'.format(path=model_path))
+
+    if saved['format_version'] != MODEL_FORMAT_VERSION:
+        raise IncompatibleModelError(
+            '{path} was saved in format version {saved}, but this version of '
+            'gitrisky reads version {current}, retrain it with '
+            '"gitrisky train"'.format(path=model_path,
+                                      saved=saved['format_version'],
+                                      current=MODEL_FORMAT_VERSION))
+
+    # scikit-learn models aren't guaranteed to work across versions
+    if saved['sklearn_version'] != sklearn.__version__:
+        raise IncompatibleModelError(
+            '{path} was trained with scikit-learn {saved}, but {current} is '
+            'installed, retrain it with "gitrisky train"'
+            .format(path=model_path, saved=saved['sklearn_version'],
+                    current=sklearn.__version__))
+
+    model = saved['model']
+    model.timezone_ = saved['timezone']
 
     return model
 
 
-def save_model(model):
-    """Save a model to a pickle file.
+def save_model(model, head=None, timezone=None):
+    """Save a model, along with metadata about how it was trained.
+
+    The model is saved uncompressed with joblib, so that load_model can
+    memory-map its arrays. Random forests are also exported as NumPy arrays,
+    see load_scoring_model.
 
     Parameters
     ----------
     model : scikit-learn model
         The scikit-learn model to save.
+    head : str, optional
+        The hash of the HEAD commit the model was trained at.
+    timezone : str, optional
+        The timezone the time of day features were computed in.
     """
 
+    import joblib
+    import sklearn
+
     model_path = _get_model_path()
 
-    with open(model_path, 'wb') as outfile:
-        pickle.dump(model, outfile)
+    columns = getattr(model, 'feature_names_in_', None)
+
+    saved = {
+        'format_version': MODEL_FORMAT_VERSION,
+        'gitrisky_version': __version__,
+        'sklearn_version': sklearn.__version__,
+        'columns': list(columns) if columns is not None else None,
+        'head': head,
+        'timezone': timezone,
+        'model': model,
+    }
+
+    # the forest is written first, so it's up to date by the time a running
+    # 'gitrisky serve' sees the model file change
+    forest = export_forest(model, timezone)
+    forest_path = _get_forest_path()
+
+    if forest is not None:
+        tmp_path = forest_path + '.tmp'
+        save_forest(forest, tmp_path)
+        os.replace(tmp_path, forest_path)
+    elif os.path.exists(forest_path):
+        os.remove(forest_path)
+
+    # write to a temporary file first so a running 'gitrisky serve' never
+    # sees a partially written model
+    tmp_path = model_path + '.tmp'
+    joblib.dump(saved, tmp_path)
+    os.replace(tmp_path, model_path)
+
+
+def load_scoring_model():
+    """Load the quickest model to score commits with.
+
+    If the model is a random forest this is the NumPy copy saved alongside
+    it, which loads and scores without importing scikit-learn. Otherwise it's
+    the model itself.
+
+    Returns
+    -------
+    model : Forest or scikit-learn model
+        A model with a predict_proba method.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the trained model file can't be found
+    IncompatibleModelError
+        If the model can't be used by this version of gitrisky.
+    """
+
+    try:
+        forest = load_forest(_get_forest_path())
+    except FileNotFoundError:
+        forest = None
+
+    # forests exported by other versions of gitrisky are ignored
+    if forest is not None:
+        return forest
+
+    return load_model()
+
+
+def get_model_timezone(model):
+    """Get the timezone a model's time of day features were computed in.
+
+    Parameters
+    ----------
+    model : Forest or scikit-learn model
+        A model loaded by load_model or load_scoring_model.
+
+    Returns
+    -------
+    timezone : str
+        The timezone the model was trained with, or the default timezone if
+        it wasn't saved.
+    """
+
+    return getattr(model, 'timezone_', None) or DEFAULT_TIMEZONE
+
+
+def check_features(model, columns):
+    """Check that a model was trained on the features it's asked to score.
+
+    Parameters
+    ----------
+    model : scikit-learn model
+        A trained model.
+    columns : list(str)
+        The names of the features to score, in order.
+
+    Raises
+    ------
+    IncompatibleModelError
+        If the model was trained on different features, e.g. by a version of
+        gitrisky which extracted other features.
+    """
+
+    trained_columns = getattr(model, 'feature_names_in_', None)
+
+    if trained_columns is not None and \
+            list(trained_columns) != list(columns):
+        raise IncompatibleModelError(
+            'the model was trained on the features {trained} but gitrisky now '
+            'extracts {columns}, retrain it with "gitrisky train"'
+            .format(trained=', '.join(map(str, trained_columns)),
+                    columns=', '.join(map(str, columns))))
@@ -2,156 +2,702 @@
 This module contains functions which extract features from git log entries.
 """
 
-import re
+import math
+
 import numpy as np
 import pandas as pd
 
+from array import array
 from collections import defaultdict
-from .gitcmds import get_git_log, get_bugfix_commits, link_fixes_to_bugs, \
-    trim_hash
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import islice, repeat
+from subprocess import CalledProcessError
+from .config import AUTHOR_TIMEZONE, DEFAULT_TIMEZONE
+from .cache import load_feature_cache, save_feature_cache, \
+    load_bug_origins, save_bug_origins
+from .gitcmds import BUG_TAGS, get_git_log, get_bugfix_commits, \
+    link_fixes_to_bugs, map_fixes_to_bugs, trim_hash, get_head_commit, \
+    get_rev_list, is_ancestor, count_commits, get_backend, set_backend, \
+    _get_n_workers
+from .timings import add_counts, get_counts, stage
+
+
+# the features extracted from each commit, in column order, with the array
+# typecode they're stored as: 64 bit ints for timestamps, 32 bit ints for
+# offsets and counts and 32 bit floats for fractions
+FEATURE_COLUMNS = [('timestamp', 'q'),
+                   ('tz_offset', 'i'),
+                   ('len_message', 'i'),
+                   ('changed_files', 'i'),
+                   ('additions', 'i'),
+                   ('deletions', 'i'),
+                   ('changed_dirs', 'i'),
+                   ('file_types', 'i'),
+                   ('frac_test_files', 'f'),
+                   ('frac_doc_files', 'f'),
+                   ('frac_config_files', 'f'),
+                   ('max_file_churn', 'i'),
+                   ('churn_entropy', 'f')]
+
+# the file extensions counted as documentation and as configuration by the
+# frac_doc_files and frac_config_files features
+DOC_EXTENSIONS = frozenset(['.md', '.rst', '.txt', '.adoc', '.html'])
+CONFIG_EXTENSIONS = frozenset(['.cfg', '.conf', '.ini', '.json', '.toml',
+                               '.xml', '.yaml', '.yml'])
+
+# the number of commits parsed at a time when writing the training matrix
+MATRIX_CHUNK_SIZE = 10000
+
+# histories shorter than this are parsed in a single process, since starting
+# worker processes would take longer than parsing them
+MIN_PARALLEL_COMMITS = 5000
+
+# the history is split into this many chunks per worker process, so that
+# workers which finish early can pick up more work
+CHUNKS_PER_WORKER = 4
+
+
+def parse_commit(entry):
+    """Extract features from a parsed commit log entry.
+
+    Parameters
+    ----------
+    entry: gitcmds.LogEntry
+        The parsed log entry of a commit.
+
+    Returns
+    -------
+    feats: defaultdict
+        A dictionary of feature values.
+    """
+
+    feats = defaultdict(lambda: None)
+
+    feats['hash'] = trim_hash(entry.hash)
+
+    # the time features are derived from these for all commits at once, see
+    # add_time_features
+    feats['timestamp'] = entry.timestamp
+    feats['tz_offset'] = entry.tz_offset
+
+    # measure the message the way 'git log' displays it, i.e. with the
+    # leading whitespace stripped from each line
+    body_lines = [line.lstrip() for line in entry.message.splitlines()]
+    feats['len_message'] = len('\n'.join(body_lines))
+
+    # merge commits are diffed against their first parent, so they're
+    # described by the changes they brought in
+    feats['changed_files'] = len(entry.numstat)
+    feats['additions'] = sum(added for added, _, _ in entry.numstat)
+    feats['deletions'] = sum(deleted for _, deleted, _ in entry.numstat)
+
+    feats.update(_parse_numstat(entry.numstat))
+
+    return feats
+
+
+def _get_new_path(fname):
+    """Get the path after a commit from a 'git log --numstat' filename.
+
+    Renamed files are named like 'old => new' or 'src/{old => new}/a.py'.
+    """
+
+    if ' => ' not in fname:
+        return fname
+
+    if '{' in fname:
+        prefix, rest = fname.split('{', 1)
+        renamed, suffix = rest.split('}', 1)
+        new = renamed.split(' => ', 1)[1]
+
+        # e.g. 'src/{ => lib}/a.py' for a file moved into a new directory
+        return (prefix + new + suffix).replace('//', '/')
+
+    return fname.split(' => ', 1)[1]
+
+
+@lru_cache(maxsize=1 << 16)
+def _get_file_info(path):
+    """Get the directory and lowercased extension of a file, and whether it's
+    a 'test', 'doc', 'config' or other (None) file.
+
+    The same files are changed over and over, so this is memoized.
+    """
+
+    dirname, _, basename = path.rpartition('/')
+    dot = basename.rfind('.')
+    ext = basename[dot:].lower() if dot > 0 else ''
+
+    dirs = dirname.split('/')
+
+    if basename.startswith('test') or \
+            basename[:len(basename) - len(ext)].endswith('_test') or \
+            'test' in dirs or 'tests' in dirs:
+        file_type = 'test'
+    elif ext in DOC_EXTENSIONS or dirs[0] in ('doc', 'docs'):
+        file_type = 'doc'
+    elif ext in CONFIG_EXTENSIONS:
+        file_type = 'config'
+    else:
+        file_type = None
 
+    return dirname, ext, file_type
 
-def split_commits(whole_log):
-    """Split the output of git log into separate entries per commit.
+
+def _parse_numstat(numstat):
+    """Extract the per-file features of a commit from its numstat.
 
     Parameters
     ----------
-    whole_log: str
-        A string containing the entire git log.
+    numstat : list(tuple)
+        The (additions, deletions, filename) of each file the commit changed.
 
     Returns
     -------
-    list(str)
-        A list of log entries, with each commit as its own string.
+    feats : dict
+        The number of directories and of file extensions the commit changed,
+        the fraction of the changed files which were tests, docs or config,
+        the most lines changed in any one file, and the entropy (in bits) of
+        how the changed lines were spread across the files.
     """
 
-    lines = whole_log.splitlines()
+    infos = [_get_file_info(_get_new_path(fname)) for _, _, fname in numstat]
+    churns = [added + deleted for added, deleted, _ in numstat]
+    n_files = len(infos)
+
+    types = [file_type for _, _, file_type in infos]
+
+    feats = {
+        'changed_dirs': len(set(dirname for dirname, _, _ in infos)),
+        'file_types': len(set(ext for _, ext, _ in infos)),
+        'max_file_churn': max(churns, default=0),
+    }
 
-    # find the indices which separate each commit's entry
-    commit_line_idxs = [i for i, line in enumerate(lines)
-                        if re.match(r'^commit \w{40}$', line)]
+    for file_type in ['test', 'doc', 'config']:
+        feats['frac_{}_files'.format(file_type)] = \
+            types.count(file_type) / n_files if n_files else 0.0
 
-    # split the lines from the whole log into subsets for each log entry
-    commit_lines = np.array_split(lines, commit_line_idxs)
+    # 0 when the changes are all in one file, log2(n) when they're spread
+    # evenly over n files
+    total = sum(churns)
+    feats['churn_entropy'] = sum(churn / total * math.log2(total / churn)
+                                 for churn in churns if churn)
+
+    return feats
 
-    return ["\n".join(arr) for arr in commit_lines[1:]]
 
+def add_time_features(feats, tz=DEFAULT_TIMEZONE):
+    """Replace raw commit timestamps with day of week and hour features.
 
-def parse_commit(commit_str):
-    """Extract features from the text of a commit log entry.
+    The conversion is vectorized over all commits at once.
 
     Parameters
     ----------
-    commit_str: str
-        The text of a commit log entry.
+    feats : pd.DataFrame
+        Features with 'timestamp' (seconds since the epoch) and 'tz_offset'
+        (the author's UTC offset in seconds) columns.
+    tz : str, optional
+        The timezone to compute the day of week and hour in, e.g. 'UTC' or
+        'Europe/Berlin'. 'author' uses each commit author's local time.
 
     Returns
     -------
-    feats: defaultdict
-        A dictionary of feature values.
+    feats : pd.DataFrame
+        The features with 'dayofweek' and 'hour' columns in place of
+        'timestamp' and 'tz_offset'.
     """
 
-    feats = defaultdict(lambda: None)
-    lines = commit_str.splitlines()
-
-    # parse the commit line
-    commit_line = [line for line in lines if line.startswith('commit')][0]
-    feats['hash'] = \
-        trim_hash(re.match(r'commit (\w{40})', commit_line).group(1))
-
-    # NOTE: skip string features for now because the one-hot encoding is a pain
-    # parse the author line
-    # author_line = [line for line in lines if line.startswith('Author:')][0]
-    # author_matches = re.match(r'Author: (.+) <(.+)>', author_line)
-    # feats['user'] = author_matches.group(1)
-    # feats['email'] = author_matches.group(2)
-
-    # parse the date line
-    time_line = [line for line in lines if line.startswith('Date:')][0]
-    timestamp = re.match(r'Date: (.*)', time_line).group(1)
-    # TODO: fix the hardcoded timezone
-    created_at = pd.to_datetime(timestamp, utc=True).tz_convert('US/Central')
-    feats['dayofweek'] = created_at.dayofweek
-    feats['hour'] = created_at.hour
-
-    # parse the body lines
-    body_lines = [line.lstrip() for line in lines if line.startswith('    ')]
-    feats['len_message'] = len('\n'.join(body_lines))
+    timestamps = feats['timestamp'].values.astype(np.int64)
+
+    if tz == AUTHOR_TIMEZONE:
+        local = timestamps + feats['tz_offset'].values.astype(np.int64)
+
+        # the epoch fell on a Thursday, i.e. day 3 of the week
+        dayofweek = (local // 86400 + 3) % 7
+        hour = (local % 86400) // 3600
+    else:
+        created_at = pd.to_datetime(timestamps, unit='s', utc=True) \
+            .tz_convert(tz)
+        dayofweek = created_at.dayofweek
+        hour = created_at.hour
+
+    feats = feats.drop(columns=['timestamp', 'tz_offset'])
+
+    # keep the columns in the order the features have always had
+    feats.insert(0, 'dayofweek', np.asarray(dayofweek, np.int8))
+    feats.insert(1, 'hour', np.asarray(hour, np.int8))
+
+    return feats
+
+
+def _build_features(entries):
+    """Build a feature dataframe from parsed commit log entries.
+
+    Each feature is appended to its own typed array as the log is parsed, and
+    the dataframe is built on top of those arrays without copying them, so
+    nothing larger than a single commit's features is held as Python objects.
+
+    Parameters
+    ----------
+    entries : iterable(gitcmds.LogEntry)
+        The parsed log entries of the commits to get features for.
+
+    Returns
+    -------
+    features : pd.DataFrame of shape [n_commits, n_features]
+        The features, indexed by commit hash.
+    """
+
+    hashes = []
+    columns = [(name, array(typecode)) for name, typecode in FEATURE_COLUMNS]
+
+    for entry in entries:
+        feats = parse_commit(entry)
+
+        hashes.append(feats['hash'])
+
+        for name, column in columns:
+            value = feats[name]
+
+            # fill any missing values with zeros
+            column.append(value if value == value else 0)
+
+    # e.g. no new commits since the cache was written
+    if not hashes:
+        return None
+
+    return pd.DataFrame({name: np.frombuffer(column, dtype=column.typecode)
+                         for name, column in columns},
+                        index=pd.Index(hashes, name='hash'),
+                        columns=[name for name, _ in columns],
+                        copy=False)
+
+
+def _init_worker(backend):
+    """Set up a feature extraction worker process."""
+
+    # spawned workers don't inherit the backend chosen in the parent process
+    set_backend(backend)
+
+
+def _build_chunk_features(rev_range, skip, max_count):
+    """Build the features of one chunk of a revision range's log.
+
+    The git processes the worker started and the bytes it read are returned
+    too, so the parent process can account for them.
+    """
+
+    before = get_counts()
+
+    features = _build_features(get_git_log(rev_range=rev_range, skip=skip,
+                                           max_count=max_count))
+
+    counts = {key: value - before[key]
+              for key, value in get_counts().items()}
+
+    return features, counts
+
+
+def _build_log_features(rev_range=None, n_jobs=1):
+    """Build a feature dataframe for all the commits in a revision range.
+
+    Parsing the log is CPU bound, so for large histories the log is split
+    into chunks of consecutive commits which are parsed in a process pool.
+
+    Parameters
+    ----------
+    rev_range : str, optional
+        A revision range (e.g. 'A..B') to get features for. If not given this
+        gets features for every commit reachable from HEAD.
+    n_jobs : int, optional
+        The number of processes to parse the log with. -1 means use all CPUs.
+
+    Returns
+    -------
+    features : pd.DataFrame of shape [n_commits, n_features] or None
+        The features, indexed by commit hash and in git log order, or None if
+        the range has no commits.
+    """
+
+    n_workers = _get_n_workers(n_jobs)
+
+    if n_workers == 1:
+        return _build_features(get_git_log(rev_range=rev_range))
+
+    n_commits = count_commits(rev_range)
 
-    # NOTE: skip string features for now because the one-hot encoding is a pain
-    # feats['tag'] = body_lines[0].split()[0].rstrip(':')
+    if n_commits < MIN_PARALLEL_COMMITS:
+        return _build_features(get_git_log(rev_range=rev_range))
 
-    # if this is a merge commit fill some fields with NaNs
-    if any([line.startswith('Merge:') for line in lines]):
-        # feats['tag'] = 'MERGE'
-        feats['changed_files'] = np.NaN
-        feats['additions'] = np.NaN
-        feats['deletions'] = np.NaN
+    chunk_size = -(-n_commits // (n_workers * CHUNKS_PER_WORKER))
+    skips = range(0, n_commits, chunk_size)
 
-        return feats
+    with ProcessPoolExecutor(max_workers=n_workers,
+                             initializer=_init_worker,
+                             initargs=(get_backend().name,)) as executor:
+        results = list(executor.map(_build_chunk_features,
+                                    repeat(rev_range), skips,
+                                    repeat(chunk_size)))
 
-    # parse the changes line
-    changes_line = lines[-1]
+    for _, counts in results:
+        add_counts(counts)
 
-    changed_regex = r' ([0-9]+) file[s]{0,1} changed'
-    insert_regex = r'.* ([0-9]+) insertion[s]{0,1}'
-    delete_regex = r'.* ([0-9]+) deletion[s]{0,1}'
+    chunks = [chunk for chunk, _ in results if chunk is not None]
 
-    if re.match(changed_regex, changes_line):
-        feats['changed_files'] = \
-                int(re.match(changed_regex, changes_line).group(1))
+    if not chunks:
+        return None
 
-    if re.match(insert_regex, changes_line):
-        feats['additions'] = int(re.match(insert_regex, changes_line).group(1))
+    return pd.concat(chunks)
 
-    if re.match(delete_regex, changes_line):
-        feats['deletions'] = int(re.match(delete_regex, changes_line).group(1))
+
+def _update_features(cached, cached_head, head, n_jobs=1):
+    """Bring cached features up to date with the current HEAD.
+
+    Only the commits which are reachable from the current HEAD but not from
+    the cached HEAD are parsed.
+
+    Parameters
+    ----------
+    cached : pd.DataFrame
+        The cached features.
+    cached_head : str
+        The hash of the HEAD commit the cached features were extracted from.
+    head : str
+        The hash of the current HEAD commit.
+    n_jobs : int, optional
+        The number of processes to parse new commits with.
+
+    Returns
+    -------
+    features : pd.DataFrame of shape [n_commits, n_features]
+        The features for every commit reachable from the current HEAD.
+    """
+
+    try:
+        fast_forward = is_ancestor(cached_head, head)
+    except CalledProcessError:
+        # the cached HEAD no longer exists, e.g. it was rebased away and
+        # garbage collected, so start from scratch
+        return _build_log_features(head, n_jobs)
+
+    # after a rebase or branch switch some cached commits may no longer be
+    # part of the history
+    if not fast_forward:
+        cached = cached[cached.index.isin(get_rev_list(head))]
+
+    rev_range = '{old}..{new}'.format(old=cached_head, new=head)
+
+    new = _build_log_features(rev_range, n_jobs)
+
+    if new is None:
+        return cached
+
+    return pd.concat([new, cached])
+
+
+def _extract_features(commit, rev_range, use_cache, n_jobs):
+    """Extract commit-level features from the git log, see get_features."""
+
+    if commit is not None:
+        return _build_features(get_git_log(commit))
+
+    if rev_range is not None or not use_cache:
+        return _build_log_features(rev_range, n_jobs)
+
+    head = get_head_commit()
+    cached, cached_head = load_feature_cache()
+
+    if cached is None:
+        feats = _build_log_features(head, n_jobs)
+    elif cached_head == head:
+        return cached
+    else:
+        feats = _update_features(cached, cached_head, head, n_jobs)
+
+    save_feature_cache(feats, head)
 
     return feats
 
 
-def get_features(commit=None):
+# the features returned by get_features, keyed on the commit(s) and revision
+# range, while memoization is enabled
+_feature_memo = None
+
+
+def enable_feature_memo():
+    """Memoize get_features until clear_feature_memo is called.
+
+    This is meant to be scoped to a single cli command, so that the git
+    history is read at most once no matter how many steps need the features.
+    """
+
+    global _feature_memo
+    _feature_memo = {}
+
+
+def clear_feature_memo():
+    """Stop memoizing get_features and drop any memoized features."""
+
+    global _feature_memo
+    _feature_memo = None
+
+
+def get_features(commit=None, use_cache=True, tz=DEFAULT_TIMEZONE,
+                 rev_range=None, n_jobs=1):
     """Get commit-level features.
 
+    When getting features for all commits these are cached in the repository's
+    top level directory, and subsequent calls only parse commits which have
+    been added since. While memoization is enabled (see enable_feature_memo)
+    repeated calls for the same commit(s) don't touch git at all.
+
     Parameters
     ----------
-    commit : str, optional
-        The hash of the commit to get features for. If not given this will
-        return features for all commits.
+    commit : str or list(str), optional
+        The hash of the commit to get features for, or a list of hashes. If
+        neither this nor rev_range is given this will return features for all
+        commits.
+    use_cache : bool, optional
+        Whether to read and update the feature cache. Ignored if commit or
+        rev_range is given.
+    tz : str, optional
+        The timezone to compute time of day features in, see
+        add_time_features.
+    rev_range : str, optional
+        A revision range (e.g. 'A..B') to get features for the commits of.
+    n_jobs : int, optional
+        The number of processes to parse large histories with. -1 means use
+        all CPUs.
 
     Returns
     -------
-    features : pd.DataFrame of shape [n_commits, n_features]
+    features : pd.DataFrame of shape [n_commits, n_features] or None
         The features to use for modeling. The dataframe is indexed by commit
-        hash.
+        hash. None if there are no commits to get features for.
     """
 
-    logstr = get_git_log(commit)
+    key = (tuple(commit) if isinstance(commit, list) else commit, rev_range)
 
-    feats = pd.DataFrame([parse_commit(c) for c in split_commits(logstr)])
+    if _feature_memo is not None and key in _feature_memo:
+        feats = _feature_memo[key]
+    else:
+        with stage('read features'):
+            feats = _extract_features(commit, rev_range, use_cache, n_jobs)
 
-    feats = feats.set_index('hash').fillna(0)
+        if _feature_memo is not None:
+            _feature_memo[key] = feats
 
-    return feats
+    # e.g. an empty revision range
+    if feats is None:
+        return None
+
+    return add_time_features(feats, tz)
+
+
+def write_feature_matrix(path, tz=DEFAULT_TIMEZONE):
+    """Write the features of every commit to a memory-mapped .npy file.
+
+    The log is parsed in chunks of MATRIX_CHUNK_SIZE commits and each chunk
+    is written straight to the file, so the features of the whole history
+    are never held in memory. The matrix is float32, which scikit-learn's
+    tree models can train on without copying it.
+
+    Parameters
+    ----------
+    path : str
+        The path of the .npy file to write.
+    tz : str, optional
+        The timezone to compute time of day features in, see
+        add_time_features.
+
+    Returns
+    -------
+    matrix : np.memmap of shape [n_commits, n_features]
+        The features of every commit reachable from HEAD, in git log order.
+    hashes : np.ndarray of shape [n_commits]
+        The 8 character hash of each commit, as bytes.
+    columns : list(str)
+        The name of each feature.
+    """
+
+    head = get_head_commit()
+    n_commits = count_commits(head)
+
+    with stage('read features'):
+        return _write_feature_matrix(path, tz, head, n_commits)
+
+
+def _write_feature_matrix(path, tz, head, n_commits):
+    """Parse the log into a memory-mapped file, see write_feature_matrix."""
+
+    entries = get_git_log(rev_range=head)
+    hashes = np.empty(n_commits, dtype='S8')
+    matrix = None
+    row = 0
+
+    while True:
+        chunk = _build_features(islice(entries, MATRIX_CHUNK_SIZE))
+
+        if chunk is None:
+            break
+
+        chunk = add_time_features(chunk, tz)
+
+        # the number of features is only known once a chunk has been parsed
+        if matrix is None:
+            columns = list(chunk.columns)
+            matrix = np.lib.format.open_memmap(
+                path, mode='w+', dtype=np.float32,
+                shape=(n_commits, len(columns)))
+
+        matrix[row:row + len(chunk)] = chunk.values
+        hashes[row:row + len(chunk)] = chunk.index
+        row += len(chunk)
+
+    matrix.flush()
+
+    return matrix[:row], hashes[:row], columns
+
+
+def _get_bug_commits(bug_tags, n_jobs, use_cache, blame_since=None,
+                     fix_commits=None):
+    """Get the commits which introduced bugs fixed by later commits.
+
+    Parameters
+    ----------
+    bug_tags : iterable(str)
+        The patterns which mark a commit message as fixing a bug.
+    n_jobs : int
+        The number of bugfix commits to link to their bug commits
+        concurrently.
+    use_cache : bool
+        Whether to only link bugfix commits which weren't linked by a
+        previous run.
+    blame_since : str, optional
+        A date to stop blaming at, see map_fixes_to_bugs.
+    fix_commits : list(str), optional
+        The bugfix commits, if they've already been found with bug_tags.
+
+    Returns
+    -------
+    bug_commits : set(str)
+        The hashes of the commits which introduced bugs.
+    """
 
+    if fix_commits is None:
+        fix_commits = get_bugfix_commits(bug_tags)
 
-def get_labels():
+    if not use_cache:
+        return set(link_fixes_to_bugs(fix_commits, n_jobs=n_jobs,
+                                      since=blame_since))
+
+    bug_origins = load_bug_origins(fix_commits, bug_tags, blame_since)
+
+    # the commits a bugfix commit is linked to never change, so only the
+    # new bugfix commits need to be blamed
+    new_fixes = [fix for fix in fix_commits if fix not in bug_origins]
+    new_origins = map_fixes_to_bugs(new_fixes, n_jobs=n_jobs,
+                                    since=blame_since)
+    save_bug_origins(new_origins, bug_tags, blame_since)
+
+    bug_origins.update(new_origins)
+
+    return set().union(*bug_origins.values())
+
+
+def get_labels(index=None, n_jobs=1, bug_tags=BUG_TAGS, use_cache=True,
+               blame_since=None, fix_commits=None):
     """Get a label for each commit indicating whether it introduced a bug.
 
+    Parameters
+    ----------
+    index : pd.Index or list(str), optional
+        The hashes of the commits to label, typically the index of the
+        features returned by get_features. If not given all commits are
+        labelled, which requires getting their features.
+    n_jobs : int, optional
+        The number of bugfix commits to link to their bug commits
+        concurrently. -1 means use all CPUs.
+    bug_tags : iterable(str), optional
+        The (case insensitive) patterns which mark a commit message as fixing
+        a bug. Defaults to BUG and FIX.
+    use_cache : bool, optional
+        Whether to read and update the cache of links between bugfix commits
+        and the commits which introduced the bug. The cache is emptied
+        whenever the bug tags or blame_since change.
+    blame_since : str, optional
+        A date, e.g. '2 years ago', to stop blaming at when linking bugfix
+        commits to bugs. Lines last changed before then aren't linked to a
+        bug. By default the whole history is blamed. A relative date is
+        resolved when each bugfix commit is first linked, and the cached
+        links aren't updated as it moves on.
+    fix_commits : list(str), optional
+        The bugfix commits, if they've already been found with bug_tags, e.g.
+        by start_bugfix_commits while the features were parsed.
+
     Returns
     -------
     labels : pd.Series of shape (n_commits,)
         The labels to use for modeling. The dataframe is indexed by commit
         hash.
-    """
 
-    feats = get_features()
+    Raises
+    ------
+    ValueError
+        If there are no bugfix commits.
+    """
 
-    fix_commits = get_bugfix_commits()
+    if index is None:
+        index = get_features(use_cache=use_cache).index
+    else:
+        index = pd.Index(index, name='hash')
 
-    bug_commits = link_fixes_to_bugs(fix_commits)
+    bug_commits = _get_bug_commits(bug_tags, n_jobs, use_cache, blame_since,
+                                   fix_commits)
 
-    labels = feats.index.isin(bug_commits).astype(int)
+    labels = index.isin(bug_commits).astype(int)
 
     # convert to DataFrame so everything is the same type
-    return pd.Series(data=labels, index=feats.index, name='label')
+    return pd.Series(data=labels, index=index, name='label')
+
+
+def get_label_array(hashes, n_jobs=1, bug_tags=BUG_TAGS, use_cache=True,
+                    blame_since=None, fix_commits=None):
+    """Get a label for each commit as a compact array, see get_labels.
+
+    Parameters
+    ----------
+    hashes : np.ndarray
+        The 8 character hashes of the commits to label, as bytes, e.g. from
+        write_feature_matrix.
+    n_jobs : int, optional
+        The number of bugfix commits to link to their bug commits
+        concurrently. -1 means use all CPUs.
+    bug_tags : iterable(str), optional
+        The (case insensitive) patterns which mark a commit message as fixing
+        a bug.
+    use_cache : bool, optional
+        Whether to read and update the cache of links between bugfix commits
+        and the commits which introduced the bug.
+    blame_since : str, optional
+        A date to stop blaming at, see get_labels.
+    fix_commits : list(str), optional
+        The bugfix commits, if they've already been found, see get_labels.
+
+    Returns
+    -------
+    labels : np.ndarray of shape (n_commits,)
+        1 for each commit which introduced a bug and 0 otherwise.
+
+    Raises
+    ------
+    ValueError
+        If there are no bugfix commits.
+    """
+
+    bug_commits = _get_bug_commits(bug_tags, n_jobs, use_cache, blame_since,
+                                   fix_commits)
+    bug_commits = np.array(list(bug_commits), dtype='S8')
+
+    return np.isin(hashes, bug_commits).astype(np.int8)
@@ -0,0 +1,200 @@
+"""This module contains a long-lived server which scores commits on request"""
+
+import json
+import os
+import socketserver
+import threading
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from .model import IncompatibleModelError, _get_model_path, \
+    check_features, get_model_timezone, load_model
+from .parsing import get_features
+
+
+class ModelHolder(object):
+    """Keep a trained model in memory, reloading it when it changes on disk.
+
+    Parameters
+    ----------
+    tz : str, optional
+        The timezone to compute the time of day features in. By default this
+        is the timezone the current model was trained with.
+    """
+
+    def __init__(self, tz=None):
+        self.tz = tz
+        self._model = None
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def get_model(self):
+        """Get the model, first reloading it if the model file has changed.
+
+        Returns
+        -------
+        model : scikit-learn model
+            The most recently saved model.
+
+        Raises
+        ------
+        FileNotFoundError
+            If the trained model file can't be found.
+        IncompatibleModelError
+            If the trained model can't be used by this version of gitrisky.
+        """
+
+        mtime = os.stat(_get_model_path()).st_mtime
+
+        with self._lock:
+            if mtime != self._mtime:
+                self._model = load_model()
+                self._mtime = mtime
+
+            return self._model
+
+    def score(self, commits=None, rev_range=None):
+        """Score some commits.
+
+        Parameters
+        ----------
+        commits : list(str), optional
+            The hashes of the commits to score.
+        rev_range : str, optional
+            A revision range to score the commits of.
+
+        Returns
+        -------
+        scores : list(dict)
+            A {'commit': hash, 'score': score} dictionary for each commit.
+        """
+
+        model = self.get_model()
+
+        # a retrained model may have been trained in another timezone
+        tz = self.tz or get_model_timezone(model)
+
+        if rev_range is not None:
+            features = get_features(rev_range=rev_range, tz=tz)
+        else:
+            features = get_features(list(commits), tz=tz)
+
+        if features is None or not len(features):
+            return []
+
+        check_features(model, features.columns)
+
+        # pull out just the postive class probability
+        scores = [score for _, score in model.predict_proba(features)]
+
+        return [{'commit': commit, 'score': float(score)}
+                for commit, score in zip(features.index, scores)]
+
+
+class ScoringHandler(BaseHTTPRequestHandler):
+    """Handle scoring requests.
+
+    Commits are scored with 'GET /score?commit=<hash>&commit=<hash>' or
+    'GET /score?range=<A..B>' and the scores are returned as JSON.
+    """
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body).encode('utf-8')
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+
+        if url.path == '/health':
+            self._send_json(200, {'status': 'ok'})
+            return
+
+        if url.path != '/score':
+            self._send_json(404, {'error': 'not found'})
+            return
+
+        commits = query.get('commit', [])
+        rev_range = query.get('range', [None])[0]
+
+        if bool(commits) == (rev_range is not None):
+            self._send_json(400, {'error': 'give either commits or a range'})
+            return
+
+        try:
+            scores = self.server.holder.score(commits, rev_range)
+        except FileNotFoundError:
+            self._send_json(503, {'error': 'could not find trained model'})
+            return
+        except IncompatibleModelError as err:
+            self._send_json(503, {'error': str(err)})
+            return
+        except ValueError as err:
+            # e.g. a range which looks like a git option
+            self._send_json(400, {'error': str(err)})
+            return
+        except Exception as err:
+            self._send_json(500, {'error': str(err)})
+            return
+
+        self._send_json(200, {'scores': scores})
+
+    def address_string(self):
+        # unix socket clients don't have an address
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return 'unix'
+
+    def log_message(self, format, *args):
+        # keep quiet, this is meant to run in the background
+        pass
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    """An HTTP server which handles each request in its own thread."""
+
+    daemon_threads = True
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn,
+                              socketserver.UnixStreamServer):
+    """An HTTP server listening on a unix socket."""
+
+    daemon_threads = True
+
+
+def make_server(holder, port=None, socket_path=None):
+    """Create a server which scores commits with a model.
+
+    Parameters
+    ----------
+    holder : ModelHolder
+        The model to score commits with.
+    port : int, optional
+        The local port to listen on for HTTP requests.
+    socket_path : str, optional
+        The path of a unix socket to listen on instead of a port.
+
+    Returns
+    -------
+    server : socketserver.BaseServer
+        The server, ready for serve_forever() to be called.
+    """
+
+    if socket_path is not None:
+        # remove the socket left behind by a previous server
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = ThreadingUnixHTTPServer(socket_path, ScoringHandler)
+    else:
+        server = ThreadingHTTPServer(('127.0.0.1', port), ScoringHandler)
+
+    server.holder = holder
+
+    return server
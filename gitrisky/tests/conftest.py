@@ -0,0 +1,62 @@
+import os
+import pytest
+
+from subprocess import check_call, check_output
+from tempfile import TemporaryDirectory
+
+from gitrisky.gitcmds import get_repo_dir, set_backend
+
+
+GIT_ENV = {'GIT_AUTHOR_NAME': 'A. Author',
+           'GIT_AUTHOR_EMAIL': 'author@example.com',
+           'GIT_COMMITTER_NAME': 'A. Author',
+           'GIT_COMMITTER_EMAIL': 'author@example.com'}
+
+
+def make_commit(repo_dir, message, files, timestamp=None):
+    """Write some files and commit all the changes in a test repository."""
+
+    for fname, content in files.items():
+        path = os.path.join(repo_dir, fname)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as outfile:
+            outfile.write(content)
+
+    env = dict(os.environ, **GIT_ENV)
+
+    if timestamp is not None:
+        env['GIT_AUTHOR_DATE'] = '{} -0600'.format(timestamp)
+        env['GIT_COMMITTER_DATE'] = '{} -0600'.format(timestamp)
+
+    check_call(['git', '-C', repo_dir, 'add', '-A'], env=env)
+    check_call(['git', '-C', repo_dir, 'commit', '-q', '-m', message],
+               env=env)
+
+
+def rev_parse(rev='HEAD'):
+    """Get the full hash of a revision in the current repository."""
+
+    return check_output(['git', 'rev-parse', rev]).decode().strip()
+
+
+@pytest.fixture
+def repo_dir():
+    """An empty git repository, which is the working directory while the
+    test runs. Test modules add their own history on top of it."""
+
+    get_repo_dir.cache_clear()
+
+    with TemporaryDirectory() as tmpdir:
+
+        repo_dir = os.path.realpath(tmpdir)
+        check_call(['git', 'init', '-q', repo_dir])
+
+        cwd = os.getcwd()
+        os.chdir(repo_dir)
+
+        try:
+            yield repo_dir
+        finally:
+            os.chdir(cwd)
+            get_repo_dir.cache_clear()
+            set_backend('subprocess')
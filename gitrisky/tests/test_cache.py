@@ -0,0 +1,94 @@
+import mock
+import os
+
+import numpy as np
+import pandas as pd
+
+from tempfile import TemporaryDirectory
+from gitrisky.cache import _get_feature_cache_path, load_feature_cache, \
+    save_feature_cache, load_bug_origins, save_bug_origins
+
+
+@mock.patch('gitrisky.cache.get_repo_dir')
+def test_get_feature_cache_path(mock_grd):
+
+    mock_grd.return_value = 'path/to/repo'
+
+    path = _get_feature_cache_path()
+
+    assert path == 'path/to/repo/gitrisky.features'
+
+
+@mock.patch('gitrisky.cache._get_feature_cache_path')
+def test_save_load_feature_cache(mock_gfcp):
+
+    features = pd.DataFrame({'dayofweek': [6, 0], 'additions': [89., 0.]},
+                            index=pd.Index(['bbb59ea0', '4db4fc24'],
+                                           name='hash'),
+                            columns=['dayofweek', 'additions'])
+
+    with TemporaryDirectory() as tmpdir:
+
+        mock_gfcp.return_value = os.path.join(tmpdir, 'gitrisky.features')
+
+        # there's nothing to load before the cache is written
+        assert load_feature_cache() == (None, None)
+
+        save_feature_cache(features, 'abcdef')
+
+        cached, head = load_feature_cache()
+
+    assert head == 'abcdef'
+    assert cached.equals(features)
+    assert np.array_equal(cached.index, features.index)
+
+
+@mock.patch('gitrisky.cache.FEATURE_CACHE_VERSION', 0)
+@mock.patch('gitrisky.cache._get_feature_cache_path')
+def test_load_feature_cache_stale_version(mock_gfcp):
+
+    features = pd.DataFrame({'dayofweek': [6]},
+                            index=pd.Index(['bbb59ea0'], name='hash'))
+
+    with TemporaryDirectory() as tmpdir:
+
+        mock_gfcp.return_value = os.path.join(tmpdir, 'gitrisky.features')
+
+        save_feature_cache(features, 'abcdef')
+
+        with mock.patch('gitrisky.cache.FEATURE_CACHE_VERSION', 1):
+            assert load_feature_cache() == (None, None)
+
+
+@mock.patch('gitrisky.cache._get_label_cache_path')
+def test_save_load_bug_origins(mock_glcp):
+
+    bug_origins = {'3e10227a': set(['d90875b0', 'e359f619']),
+                   '2c3dca4b': set()}
+
+    with TemporaryDirectory() as tmpdir:
+
+        mock_glcp.return_value = os.path.join(tmpdir, 'gitrisky.sqlite')
+
+        save_bug_origins(bug_origins, ('BUG', 'FIX'))
+
+        # only the requested bugfix commits which have been cached are loaded
+        cached = load_bug_origins(['3e10227a', '2c3dca4b', '91d54e3c'],
+                                  ('BUG', 'FIX'))
+
+        assert cached == bug_origins
+
+        # changing the bug tags invalidates the cache
+        assert load_bug_origins(['3e10227a'], ('BUG',)) == {}
+        assert load_bug_origins(['3e10227a'], ('BUG', 'FIX')) == {}
+
+        # as does changing how far back blame goes
+        save_bug_origins(bug_origins, ('BUG', 'FIX'))
+        assert load_bug_origins(['3e10227a'], ('BUG', 'FIX'),
+                                '2 years ago') == {}
+
+        # but not running again later with the same relative date
+        save_bug_origins(bug_origins, ('BUG', 'FIX'), '2 years ago')
+        cached = load_bug_origins(['3e10227a'], ('BUG', 'FIX'),
+                                  '2 years ago')
+        assert cached == {'3e10227a': bug_origins['3e10227a']}
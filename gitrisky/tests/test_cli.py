@@ -1,17 +1,61 @@
+import json
 import mock
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
 
 from click.testing import CliRunner
+from tempfile import TemporaryDirectory
+from gitrisky import __version__
 from gitrisky.cli import cli
 
 
-@mock.patch('gitrisky.cli.get_features')
-@mock.patch('gitrisky.cli.get_labels')
-@mock.patch('gitrisky.cli.create_model')
-@mock.patch('gitrisky.cli.save_model')
+FEATURES = pd.DataFrame([[1, 1], [2, 2]],
+                        index=pd.Index(['abcd', 'efgh'], name='hash'))
+
+FIX_COMMITS = ['efgh']
+
+
+@pytest.fixture(autouse=True)
+def m_get_repo_dir():
+
+    # train reads its settings from the top of the repository, which is kept
+    # empty so the tests don't depend on where they're run
+    with TemporaryDirectory() as tmpdir, \
+            mock.patch('gitrisky.gitcmds.get_repo_dir') as m_grd:
+        m_grd.return_value = tmpdir
+        yield m_grd
+
+
+@pytest.fixture(autouse=True)
+def m_get_head_commit():
+
+    # train saves the commit the model was trained at
+    with mock.patch('gitrisky.gitcmds.get_head_commit') as m_ghc:
+        m_ghc.return_value = 'abcd1234'
+        yield m_ghc
+
+
+@pytest.fixture(autouse=True)
+def m_start_bugfix_commits():
+
+    # train searches for the bugfix commits in the background
+    with mock.patch('gitrisky.gitcmds.start_bugfix_commits') as m_start:
+        m_start.return_value = lambda: FIX_COMMITS
+        yield m_start
+
+
+@mock.patch('gitrisky.parsing.get_features')
+@mock.patch('gitrisky.parsing.get_labels')
+@mock.patch('gitrisky.model.create_model')
+@mock.patch('gitrisky.model.save_model')
 def test_cli_train(m_save_model, m_create_model, m_get_labels, m_get_features):
 
     # make some fake features and labels
-    m_get_features.return_value = [[1, 1], [2, 2]]
+    m_get_features.return_value = FEATURES
     m_get_labels.return_value = [0, 1]
 
     # test the 'gitrisky train' cli command
@@ -25,16 +69,39 @@ def test_cli_train(m_save_model, m_create_model, m_get_labels, m_get_features):
     for mck in [m_save_model, m_create_model, m_get_labels, m_get_features]:
         assert mck.call_count == 1
 
+    # the labels are computed for the same commits as the features
+    assert m_get_labels.call_args[0][0] is FEATURES.index
+
+    # the model is saved with the commit it was trained at
+    assert m_save_model.call_args[1]['head'] == 'abcd1234'
+
+
+@mock.patch('gitrisky.parsing.get_features')
+@mock.patch('gitrisky.parsing.get_labels')
+@mock.patch('gitrisky.model.create_model')
+@mock.patch('gitrisky.model.save_model')
+def test_cli_train_blame_since(m_save_model, m_create_model, m_get_labels,
+                               m_get_features):
 
-@mock.patch('gitrisky.cli.get_features')
-@mock.patch('gitrisky.cli.get_labels')
-@mock.patch('gitrisky.cli.create_model')
-@mock.patch('gitrisky.cli.save_model')
+    m_get_features.return_value = FEATURES
+    m_get_labels.return_value = [0, 1]
+
+    runner = CliRunner()
+    result = runner.invoke(cli, ['train', '--blame-since', '2 years ago'])
+
+    assert result.exit_code == 0
+    assert m_get_labels.call_args[1]['blame_since'] == '2 years ago'
+
+
+@mock.patch('gitrisky.parsing.get_features')
+@mock.patch('gitrisky.parsing.get_labels')
+@mock.patch('gitrisky.model.create_model')
+@mock.patch('gitrisky.model.save_model')
 def test_cli_train_no_bugs(m_save_model, m_create_model, m_get_labels,
                            m_get_features):
 
     # make some fake features and labels
-    m_get_features.return_value = [[1, 1], [2, 2]]
+    m_get_features.return_value = FEATURES
     m_get_labels.side_effect = ValueError('No bug commits found')
 
     # test the 'gitrisky train' cli command
@@ -48,31 +115,50 @@ def test_cli_train_no_bugs(m_save_model, m_create_model, m_get_labels,
         'and this repo appears not to have any.\n')
 
 
-@mock.patch('gitrisky.cli.get_features')
+@mock.patch('gitrisky.parsing.get_features')
 @mock.patch('gitrisky.cli.get_latest_commit')
-@mock.patch('gitrisky.cli.load_model')
+@mock.patch('gitrisky.model.load_scoring_model')
 def test_cli_predict(m_load_model, m_get_latest_commit, m_get_features):
 
     runner = CliRunner()
 
     model = mock.MagicMock()
+    model.feature_names_in_ = FEATURES.columns
+    model.timezone_ = None
     model.predict_proba.return_value = [(0.1, 0.9)]
 
     m_load_model.return_value = model
     m_get_latest_commit.return_value = 'abcd'
+    m_get_features.return_value = FEATURES.loc[['abcd']]
 
     # test what happens when we don't specify a commit
     result = runner.invoke(cli, ['predict'])
 
-    assert m_get_features.called_with('abcd')
+    m_get_features.assert_called_with('abcd', tz='US/Central')
     assert result.output == 'Commit abcd has a bug score of 0.9 / 1.0\n'
     assert result.exit_code == 0
 
     # test what happens when we specify a commit
-    result = runner.invoke(cli, ['predict', '-c', '12345'])
+    m_get_features.return_value = FEATURES.loc[['efgh']]
+
+    result = runner.invoke(cli, ['predict', '-c', 'efgh'])
+
+    m_get_features.assert_called_with(['efgh'], tz='US/Central')
+    assert result.output == 'Commit efgh has a bug score of 0.9 / 1.0\n'
+    assert result.exit_code == 0
+
+    # the features are computed in the timezone the model was trained with
+    model.timezone_ = 'author'
+
+    result = runner.invoke(cli, ['predict', '-c', 'efgh'])
+
+    m_get_features.assert_called_with(['efgh'], tz='author')
+    assert result.exit_code == 0
+
+    # unless another is asked for
+    result = runner.invoke(cli, ['predict', '-c', 'efgh', '--timezone', 'UTC'])
 
-    assert m_get_features.called_with('12345')
-    assert result.output == 'Commit 12345 has a bug score of 0.9 / 1.0\n'
+    m_get_features.assert_called_with(['efgh'], tz='UTC')
     assert result.exit_code == 0
 
     # test what happens when we can't load the model
@@ -83,3 +169,252 @@ def test_cli_predict(m_load_model, m_get_latest_commit, m_get_features):
     assert result.output == \
         'could not find trained model. have you run "gitrisky train" yet?\n'
     assert result.exit_code == 1
+
+    # test what happens when the model was trained on other features
+    m_load_model.side_effect = None
+    model.feature_names_in_ = np.array(['other'])
+
+    result = runner.invoke(cli, ['predict'])
+
+    assert result.output.startswith('could not use trained model: ')
+    assert result.exit_code == 1
+
+
+@mock.patch('gitrisky.parsing.get_features')
+@mock.patch('gitrisky.model.load_scoring_model')
+def test_cli_predict_batch(m_load_model, m_get_features):
+
+    runner = CliRunner()
+
+    model = mock.MagicMock()
+    model.feature_names_in_ = FEATURES.columns
+    model.timezone_ = None
+    model.predict_proba.return_value = [(0.1, 0.9), (0.75, 0.25)]
+
+    m_load_model.return_value = model
+    m_get_features.return_value = FEATURES
+
+    # commits from the command line and stdin are scored together
+    result = runner.invoke(cli, ['predict', '-c', 'abcd', '--stdin',
+                                 '-f', 'csv'],
+                           input='efgh\n')
+
+    m_get_features.assert_called_once_with(['abcd', 'efgh'], tz='US/Central')
+    assert model.predict_proba.call_count == 1
+    assert result.output == 'commit,score\nabcd,0.9\nefgh,0.25\n'
+    assert result.exit_code == 0
+
+    # every commit in a revision range
+    result = runner.invoke(cli, ['predict', '-r', 'abcd..efgh', '-f', 'json'])
+
+    m_get_features.assert_called_with(rev_range='abcd..efgh', tz='US/Central')
+    assert result.output == ('{"commit": "abcd", "score": 0.9}\n'
+                             '{"commit": "efgh", "score": 0.25}\n')
+    assert result.exit_code == 0
+
+    # a revision range can't be combined with individual commits
+    result = runner.invoke(cli, ['predict', '-r', 'abcd..efgh', '-c', 'abcd'])
+
+    assert result.exit_code == 2
+
+
+@mock.patch('gitrisky.parsing.get_features')
+@mock.patch('gitrisky.parsing.get_labels')
+@mock.patch('gitrisky.model.create_model')
+@mock.patch('gitrisky.model.save_model')
+def test_cli_train_bug_tags(m_save_model, m_create_model, m_get_labels,
+                            m_get_features, m_start_bugfix_commits):
+
+    m_get_features.return_value = FEATURES
+    m_get_labels.side_effect = ValueError('No bug commits found')
+
+    runner = CliRunner()
+    result = runner.invoke(cli, ['train', '-t', 'BUG', '-t', 'ISSUE',
+                                 '--no-cache'])
+
+    m_start_bugfix_commits.assert_called_once_with(('BUG', 'ISSUE'))
+    m_get_labels.assert_called_once_with(FEATURES.index, n_jobs=1,
+                                         bug_tags=('BUG', 'ISSUE'),
+                                         use_cache=False, blame_since=None,
+                                         fix_commits=FIX_COMMITS)
+
+    assert result.exit_code == 1
+    assert 'containing "bug" or "issue"' in result.output
+
+
+@mock.patch('gitrisky.parsing.get_features')
+@mock.patch('gitrisky.parsing.get_labels')
+@mock.patch('gitrisky.model.create_model')
+@mock.patch('gitrisky.model.save_model')
+def test_cli_train_no_fix_commits(m_save_model, m_create_model, m_get_labels,
+                                  m_get_features, m_start_bugfix_commits):
+
+    def no_fixes():
+        raise ValueError('No bug fix commits found')
+
+    m_get_features.return_value = FEATURES
+    m_start_bugfix_commits.return_value = no_fixes
+
+    runner = CliRunner()
+    result = runner.invoke(cli, ['train'])
+
+    # the background search fails like get_labels would
+    assert result.exit_code == 1
+    assert 'Failed to find any bug commits' in result.output
+    m_get_labels.assert_not_called()
+
+
+@mock.patch('gitrisky.parsing.get_features')
+@mock.patch('gitrisky.parsing.get_labels')
+@mock.patch('gitrisky.model.create_model')
+@mock.patch('gitrisky.model.save_model')
+@mock.patch('gitrisky.gitcmds.write_commit_graph')
+def test_cli_train_commit_graph(m_write_commit_graph, m_save_model,
+                                m_create_model, m_get_labels,
+                                m_get_features):
+
+    m_get_features.return_value = FEATURES
+    m_get_labels.return_value = pd.Series([0, 1], index=FEATURES.index)
+
+    runner = CliRunner()
+
+    runner.invoke(cli, ['train'])
+    assert not m_write_commit_graph.called
+
+    result = runner.invoke(cli, ['train', '--commit-graph'])
+
+    assert result.exit_code == 0
+    m_write_commit_graph.assert_called_once_with()
+
+
+@mock.patch('gitrisky.parsing.get_features')
+@mock.patch('gitrisky.parsing.get_labels')
+@mock.patch('gitrisky.model.create_model')
+@mock.patch('gitrisky.model.save_model')
+def test_cli_timings(m_save_model, m_create_model, m_get_labels,
+                     m_get_features, tmpdir):
+
+    m_get_features.return_value = FEATURES
+    m_get_labels.return_value = pd.Series([0, 1], index=FEATURES.index)
+
+    json_path = str(tmpdir.join('timings.json'))
+
+    runner = CliRunner()
+    result = runner.invoke(cli, ['--timings', '--timings-json', json_path,
+                                 'train'])
+
+    assert result.exit_code == 0
+    assert 'Model trained on 2 training examples with 1 positive cases\n' \
+        in result.output
+    assert 'fit model' in result.output
+    assert 'git processes started' in result.output
+
+    with open(json_path) as infile:
+        report = json.load(infile)
+
+    assert report['command'] == 'train'
+    assert list(report['stages']) == ['create model', 'fit model',
+                                      'save model']
+    assert set(report) >= {'total_seconds', 'git_processes',
+                           'git_bytes_read', 'peak_rss_bytes'}
+
+
+@mock.patch('gitrisky.parsing.write_feature_matrix')
+@mock.patch('gitrisky.parsing.get_label_array')
+@mock.patch('gitrisky.model.create_model')
+@mock.patch('gitrisky.model.fit_model')
+@mock.patch('gitrisky.model.save_model')
+@mock.patch('gitrisky.gitcmds.get_git_dir')
+def test_cli_train_out_of_core(m_get_git_dir, m_save_model, m_fit_model,
+                               m_create_model, m_get_label_array,
+                               m_write_feature_matrix, tmpdir):
+
+    matrix = FEATURES.values
+
+    m_get_git_dir.return_value = str(tmpdir)
+    m_write_feature_matrix.return_value = (matrix,
+                                           FEATURES.index.values,
+                                           ['dayofweek', 'hour'])
+    m_get_label_array.return_value = np.array([0, 1])
+
+    runner = CliRunner()
+    result = runner.invoke(cli, ['train', '--out-of-core'])
+
+    assert result.exit_code == 0
+    assert result.output == \
+        'Model trained on 2 training examples with 1 positive cases\n'
+
+    # the matrix is written next to the label cache, and trained from
+    matrix_path = m_write_feature_matrix.call_args[0][0]
+    assert matrix_path == str(tmpdir.join('gitrisky.matrix.npy'))
+    assert m_fit_model.call_args[0][1] is matrix
+
+    assert m_save_model.call_args[0] == (m_fit_model.return_value,)
+
+
+@mock.patch('gitrisky.parsing.get_features')
+@mock.patch('gitrisky.parsing.get_labels')
+@mock.patch('gitrisky.model.create_model')
+@mock.patch('gitrisky.model.save_model')
+@mock.patch('gitrisky.cli.load_model_config')
+def test_cli_train_model_settings(m_load_model_config, m_save_model,
+                                  m_create_model, m_get_labels,
+                                  m_get_features):
+
+    m_get_features.return_value = FEATURES
+    m_get_labels.return_value = [0, 1]
+    m_load_model_config.return_value = {'estimator': 'extra_trees',
+                                        'n_jobs': None,
+                                        'n_estimators': 10,
+                                        'max_depth': None,
+                                        'search': None}
+
+    runner = CliRunner()
+    result = runner.invoke(cli, ['train', '-j', '4', '--n-estimators', '50'])
+
+    assert result.exit_code == 0
+
+    # the cli options override gitrisky.toml, and the model uses as many
+    # CPUs as the rest of the command by default
+    m_create_model.assert_called_once_with(estimator='extra_trees',
+                                           n_jobs=4,
+                                           n_estimators=50,
+                                           max_depth=None,
+                                           search=None)
+
+    # bad settings are reported before any work is done
+    m_create_model.side_effect = ValueError('sgd has no max_depth setting')
+    result = runner.invoke(cli, ['train', '--estimator', 'sgd'])
+
+    assert result.exit_code == 2
+    assert 'sgd has no max_depth setting' in result.output
+    assert m_get_features.call_count == 1
+
+
+def test_cli_version():
+
+    runner = CliRunner()
+    result = runner.invoke(cli, ['--version'])
+
+    assert result.exit_code == 0
+    assert __version__ in result.output
+
+
+def test_cli_startup_imports():
+
+    # guard against slow cli startup: neither importing the cli nor running
+    # e.g. 'gitrisky --help' should import the heavy modeling dependencies,
+    # or asyncio, which is only needed to link bugfix commits
+    script = ("import sys\n"
+              "from gitrisky.cli import cli\n"
+              "try:\n"
+              "    cli(['--help'])\n"
+              "except SystemExit:\n"
+              "    pass\n"
+              "heavy = ['asyncio', 'git', 'numpy', 'pandas', 'scipy',\n"
+              "         'sklearn']\n"
+              "print(' '.join(mod for mod in heavy if mod in sys.modules))\n")
+
+    output = subprocess.check_output([sys.executable, '-c', script])
+
+    assert output.decode('utf-8').splitlines()[-1] == ''
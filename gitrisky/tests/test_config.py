@@ -0,0 +1,33 @@
+import os
+import pytest
+
+from tempfile import TemporaryDirectory
+
+from gitrisky.config import MODEL_DEFAULTS, load_model_config
+
+
+def test_load_model_config():
+
+    with TemporaryDirectory() as tmpdir:
+
+        path = os.path.join(tmpdir, 'gitrisky.toml')
+
+        # without a config file the defaults are used
+        assert load_model_config(path) == MODEL_DEFAULTS
+
+        with open(path, 'w') as outfile:
+            outfile.write('[model]\n'
+                          'estimator = "extra_trees"\n'
+                          'n_jobs = -1\n')
+
+        settings = load_model_config(path)
+
+        assert settings['estimator'] == 'extra_trees'
+        assert settings['n_jobs'] == -1
+        assert settings['n_iter'] == MODEL_DEFAULTS['n_iter']
+
+        with open(path, 'w') as outfile:
+            outfile.write('[model]\nn_trees = 10\n')
+
+        with pytest.raises(ValueError):
+            load_model_config(path)
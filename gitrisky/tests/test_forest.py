@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from sklearn.ensemble import ExtraTreesClassifier, \
+    GradientBoostingClassifier, RandomForestClassifier
+from gitrisky.forest import Forest, export_forest, load_forest, save_forest
+
+
+@pytest.fixture
+def data():
+
+    rng = np.random.RandomState(0)
+
+    X = rng.normal(size=(500, 4))
+    y = (X[:, 0] + rng.normal(size=500) > 0.5).astype(int)
+
+    X_test = rng.normal(size=(50, 4))
+    X_test[::5, 1] = np.nan
+
+    return X, y, X_test
+
+
+@pytest.mark.parametrize('estimator', [RandomForestClassifier,
+                                       ExtraTreesClassifier])
+def test_export_forest(data, estimator):
+
+    X, y, X_test = data
+
+    model = estimator(n_estimators=20, random_state=0).fit(X, y)
+    forest = export_forest(model)
+
+    assert isinstance(forest, Forest)
+    assert list(forest.classes_) == [0, 1]
+    assert list(forest.feature_names_in_) == ['0', '1', '2', '3']
+
+    # the probabilities are identical, including for missing values
+    assert np.array_equal(forest.predict_proba(X_test),
+                          model.predict_proba(X_test))
+    assert np.array_equal(forest.predict_proba(X_test[:1]),
+                          model.predict_proba(X_test[:1]))
+
+
+def test_export_forest_not_a_forest(data):
+
+    X, y, _ = data
+
+    model = GradientBoostingClassifier(n_estimators=5).fit(X, y)
+
+    assert export_forest(model) is None
+
+
+def test_save_load_forest(data, tmpdir):
+
+    X, y, X_test = data
+
+    model = RandomForestClassifier(n_estimators=5, random_state=0).fit(X, y)
+    path = str(tmpdir.join('gitrisky.forest.npz'))
+
+    save_forest(export_forest(model, timezone='author'), path)
+    forest = load_forest(path)
+
+    assert np.array_equal(forest.predict_proba(X_test),
+                          model.predict_proba(X_test))
+    assert forest.timezone_ == 'author'
+
+    # forests saved without a timezone load without one
+    save_forest(export_forest(model), path)
+
+    assert load_forest(path).timezone_ is None
+
+    with pytest.raises(FileNotFoundError):
+        load_forest(str(tmpdir.join('missing.npz')))
@@ -0,0 +1,124 @@
+import asyncio
+import os
+import pytest
+import sys
+import time
+
+from subprocess import CalledProcessError, TimeoutExpired
+from tempfile import TemporaryDirectory
+
+from gitrisky.gitasync import gather_or_cancel, run_command, stream_command
+
+
+def _python(code):
+    return [sys.executable, '-c', code]
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def test_run_command():
+
+    async def run():
+        limit = asyncio.Semaphore(2)
+        return await gather_or_cancel(
+            run_command(_python('print({})'.format(i)), limit)
+            for i in range(4))
+
+    assert _run(run()) == [b'0\n', b'1\n', b'2\n', b'3\n']
+
+    async def fail():
+        return await run_command(_python('raise SystemExit(3)'),
+                                 asyncio.Semaphore(1))
+
+    with pytest.raises(CalledProcessError) as err:
+        _run(fail())
+
+    assert err.value.returncode == 3
+
+
+def test_run_command_timeout():
+
+    async def run():
+        return await run_command(_python('import time; time.sleep(30)'),
+                                 asyncio.Semaphore(1), timeout=0.2)
+
+    start = time.perf_counter()
+
+    with pytest.raises(TimeoutExpired):
+        _run(run())
+
+    # the command is killed rather than waited for
+    assert time.perf_counter() - start < 10
+
+
+def test_run_command_cancelled():
+
+    with TemporaryDirectory() as tmpdir:
+
+        async def run(n_steps):
+            # the command would create a file if it was left running
+            code = ('import time; time.sleep(0.5); '
+                    'open({!r}, "w")'.format(os.path.join(tmpdir,
+                                                          str(n_steps))))
+            task = asyncio.ensure_future(
+                run_command(_python(code), asyncio.Semaphore(1)))
+
+            # cancel the command at each stage of starting and running it
+            for _ in range(n_steps):
+                await asyncio.sleep(0)
+            task.cancel()
+
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+        for n_steps in range(6):
+            _run(run(n_steps))
+
+        time.sleep(1)
+
+        assert os.listdir(tmpdir) == []
+
+
+def test_gather_or_cancel():
+
+    async def run():
+        limit = asyncio.Semaphore(2)
+        await gather_or_cancel([
+            run_command(_python('import time; time.sleep(30)'), limit),
+            run_command(_python('import time; time.sleep(0.2); '
+                                'raise SystemExit(1)'), limit)])
+
+    start = time.perf_counter()
+
+    # the failure cancels the slow command
+    with pytest.raises(CalledProcessError):
+        _run(run())
+
+    assert time.perf_counter() - start < 10
+
+
+def test_stream_command():
+
+    # lines longer than asyncio's default line length limit
+    lines = ['a' * 100000, 'b', 'c' * 200000]
+
+    async def run():
+        output = []
+        stream = stream_command(
+            _python('import sys; sys.stdout.write(sys.stdin.read())'),
+            stdin_lines=lines)
+        async for line in stream:
+            output.append(line)
+        return output
+
+    assert _run(run()) == [line + '\n' for line in lines]
+
+    async def fail():
+        stream = stream_command(_python('print(1); raise SystemExit(2)'))
+        async for _ in stream:
+            pass
+
+    with pytest.raises(CalledProcessError):
+        _run(fail())
@@ -1,13 +1,22 @@
 import mock
+import os
 import pytest
 
 import numpy as np
 
 from collections import defaultdict
+from os import cpu_count
+from subprocess import CalledProcessError, TimeoutExpired, check_call
+from tempfile import TemporaryDirectory
 
-from gitrisky.gitcmds import _run_bash_command, trim_hash, get_latest_commit, \
+from gitrisky.gitcmds import _split_bash_command, _run_bash_command, \
+    _stream_bash_command, get_repo_dir, trim_hash, get_latest_commit, \
+    is_ancestor, get_rev_list, parse_log_lines, \
     get_git_log, get_bugfix_commits, _get_commit_filenames, \
-    _get_commit_lines, _get_blame_commit, link_fixes_to_bugs
+    _get_commit_lines, _get_blame_commit, _get_n_workers, \
+    _iter_commit_hunks, link_fixes_to_bugs, map_fixes_to_bugs, \
+    start_bugfix_commits, GitBackend
+from gitrisky.tests.conftest import make_commit, rev_parse
 
 
 @mock.patch('gitrisky.gitcmds.check_output')
@@ -24,6 +33,49 @@ def test_run_bash_command(mock_co):
     assert stdout == 'output from some command'
 
 
+@mock.patch('gitrisky.gitcmds.get_repo_dir')
+def test_split_bash_command(mock_grd):
+
+    mock_grd.return_value = '/path/to/my repo'
+
+    # git commands are run against the top level directory
+    assert _split_bash_command('git log -1') == \
+        ['git', '-C', '/path/to/my repo', 'log', '-1']
+
+    assert _split_bash_command('some bash command') == \
+        ['some', 'bash', 'command']
+
+    # lists of arguments aren't split again
+    assert _split_bash_command(['git', 'log', '--grep=BUG FIX']) == \
+        ['git', '-C', '/path/to/my repo', 'log', '--grep=BUG FIX']
+
+
+def test_get_repo_dir():
+
+    get_repo_dir.cache_clear()
+
+    with TemporaryDirectory() as tmpdir:
+
+        repo_dir = os.path.realpath(tmpdir)
+        subdir = os.path.join(repo_dir, 'src', 'pkg')
+
+        os.makedirs(os.path.join(repo_dir, '.git'))
+        os.makedirs(subdir)
+
+        cwd = os.getcwd()
+        os.chdir(subdir)
+
+        try:
+            assert get_repo_dir() == repo_dir
+
+            # the result is cached for the rest of the process
+            os.chdir(cwd)
+            assert get_repo_dir() == repo_dir
+        finally:
+            os.chdir(cwd)
+            get_repo_dir.cache_clear()
+
+
 def test_trim_hash():
 
     long_hash = '123456789abcdefg'
@@ -47,29 +99,159 @@ def test_get_latest_commit(mock_runbc):
 
 
 @mock.patch('gitrisky.gitcmds._run_bash_command')
-def test_get_git_log(mock_runbc):
+def test_is_ancestor(mock_runbc):
 
-    stdout = ("Merge: 910cdb3 bbb59ea\n"
-              "Author: Henry Hinnefeld <henry.hinnefeld@gmail.com>\n"
-              "Date:   Sun Feb 4 15:55:45 2018 -0600\n"
-              "\n"
-              "    Merge pull request #10 from hinnefe2/write_readme\n"
-              "\n"
-              "    Write readme")
+    mock_runbc.return_value = ''
 
-    mock_runbc.return_value = stdout
+    assert is_ancestor('abcd', 'efgh')
+    mock_runbc.assert_called_once_with(
+        'git merge-base --is-ancestor abcd efgh')
+
+    mock_runbc.side_effect = CalledProcessError(1, 'git')
+    assert not is_ancestor('abcd', 'efgh')
+
+    # unknown commits are an error rather than a 'no'
+    mock_runbc.side_effect = CalledProcessError(128, 'git')
+    with pytest.raises(CalledProcessError):
+        is_ancestor('abcd', 'efgh')
+
+
+@mock.patch('gitrisky.gitcmds._run_bash_command')
+def test_get_rev_list(mock_runbc):
+
+    mock_runbc.return_value = ('4db4fc24afe7565ac65fdb272c7c157c43aace77\n'
+                               'bbb59ea0f0b4a0e5f8b3f2c3e1a4b5c6d7e8f9a0')
+
+    assert get_rev_list('HEAD') == ['4db4fc24', 'bbb59ea0']
+    mock_runbc.assert_called_once_with('git rev-list HEAD')
+
+
+LOG_LINES = [
+    "\x004db4fc24afe7565ac65fdb272c7c157c43aace77\x00"
+    "910cdb3c3b3e0ac4fb2c3f1e5f7cd5b9e4b3a7c1 "
+    "bbb59ea0f0b4a0e5f8b3f2c3e1a4b5c6d7e8f9a0\x001517781345\x00"
+    "2018-02-04 15:55:45 -0600\x00"
+    "Merge pull request #10 from hinnefe2/write_readme\n",
+    "\n",
+    "Write readme\n",
+    "\x00\n",
+    "\n",
+    "\x00bbb59ea0f0b4a0e5f8b3f2c3e1a4b5c6d7e8f9a0\x00"
+    "910cdb3c3b3e0ac4fb2c3f1e5f7cd5b9e4b3a7c1\x001517781000\x00"
+    "2018-02-05 07:05:00 +0530\x00"
+    "Write readme\n",
+    "\x00\n",
+    "86\t0\tREADME.md\n",
+    "-\t-\tdocs/logo.png\n",
+    "3\t1\tgitrisky/cli.py\n"]
+
+
+def test_parse_log_lines():
+
+    entries = list(parse_log_lines(LOG_LINES))
+
+    assert len(entries) == 2
+
+    merge, commit = entries
+
+    assert merge.hash == '4db4fc24afe7565ac65fdb272c7c157c43aace77'
+    assert len(merge.parents) == 2
+    assert merge.timestamp == 1517781345
+    assert merge.tz_offset == -6 * 3600
+    assert merge.message == \
+        'Merge pull request #10 from hinnefe2/write_readme\n\nWrite readme\n'
+    assert merge.numstat == []
+
+    assert commit.parents == ['910cdb3c3b3e0ac4fb2c3f1e5f7cd5b9e4b3a7c1']
+    assert commit.tz_offset == 5 * 3600 + 30 * 60
+    assert commit.numstat == [(86, 0, 'README.md'),
+                              (0, 0, 'docs/logo.png'),
+                              (3, 1, 'gitrisky/cli.py')]
+
+
+@mock.patch('gitrisky.gitcmds._stream_bash_command')
+def test_get_git_log(mock_streambc):
+
+    mock_streambc.return_value = iter(LOG_LINES)
 
     # test calling with a commit specified
-    log = get_git_log('1234abcd')
+    entries = list(get_git_log('1234abcd'))
 
-    assert mock_runbc.called_with('git --no-pager log --stat -1 1234abcd')
-    assert log == stdout
+    bash_cmd = mock_streambc.call_args[0][0]
+    assert bash_cmd.startswith('git --no-pager log --numstat '
+                               '--diff-merges=first-parent -1 ')
+    assert bash_cmd.endswith(' 1234abcd')
+    assert [entry.hash[:8] for entry in entries] == ['4db4fc24', 'bbb59ea0']
 
     # test calling with no commit specified
-    log = get_git_log()
+    mock_streambc.return_value = iter(LOG_LINES)
+
+    entries = list(get_git_log())
+
+    bash_cmd = mock_streambc.call_args[0][0]
+    assert bash_cmd.startswith('git --no-pager log --numstat '
+                               '--diff-merges=first-parent ')
+    assert '-1' not in bash_cmd.split()
+    assert len(entries) == 2
 
-    assert mock_runbc.called_with('git --no-pager log --stat')
-    assert log == stdout
+    # test calling with several commits, which are passed on stdin
+    mock_streambc.return_value = iter(LOG_LINES)
+
+    entries = list(get_git_log(['4db4fc24', 'bbb59ea0']))
+
+    bash_cmd, stdin_lines = mock_streambc.call_args[0]
+    assert '--diff-merges=first-parent' in bash_cmd.split()
+    assert '--no-walk' in bash_cmd.split()
+    assert '--stdin' in bash_cmd.split()
+    assert stdin_lines == ['4db4fc24', 'bbb59ea0']
+    assert len(entries) == 2
+
+    # test calling with a slice of a revision range
+    mock_streambc.return_value = iter(LOG_LINES)
+
+    entries = list(get_git_log(rev_range='a..b', skip=10, max_count=5))
+
+    bash_cmd = mock_streambc.call_args[0][0]
+    assert bash_cmd.split()[-3:] == ['--skip=10', '--max-count=5', 'a..b']
+
+
+@mock.patch('gitrisky.gitcmds._stream_bash_command')
+@mock.patch('gitrisky.gitcmds._run_bash_command')
+def test_revisions_checked(mock_runbc, mock_streambc):
+
+    # anything which git would take as an option never reaches git
+    for rev in ['--output=/tmp/out', '-p', 'a..b --all', '']:
+        with pytest.raises(ValueError):
+            get_git_log(rev_range=rev)
+        with pytest.raises(ValueError):
+            get_git_log(rev)
+        with pytest.raises(ValueError):
+            get_git_log(['abcd', rev])
+        with pytest.raises(ValueError):
+            get_rev_list(rev)
+
+    assert not mock_runbc.called
+    assert not mock_streambc.called
+
+
+@mock.patch('gitrisky.gitcmds.Popen')
+def test_stream_bash_command(mock_popen):
+
+    proc = mock_popen.return_value.__enter__.return_value
+    proc.stdout = iter([b'first line\n', b'second line\n'])
+    proc.returncode = 0
+
+    lines = list(_stream_bash_command('some bash command'))
+
+    assert mock_popen.call_args[0][0] == ['some', 'bash', 'command']
+    assert lines == ['first line\n', 'second line\n']
+
+    # a failed command should raise once its output is exhausted
+    proc.stdout = iter([])
+    proc.returncode = 128
+
+    with pytest.raises(CalledProcessError):
+        list(_stream_bash_command('some bash command'))
 
 
 @mock.patch('gitrisky.gitcmds._run_bash_command')
@@ -81,11 +263,18 @@ def test_get_bugfix_commits(mock_runbc):
 
     commits = get_bugfix_commits()
 
-    assert mock_runbc.called_with(
-        'git log -i --all --grep BUG --grep FIX --pretty=format:%h')
+    mock_runbc.assert_called_once_with(
+        ['git', 'log', '-i', '--all', '--grep=BUG', '--grep=FIX',
+         '--pretty=format:%H'])
     assert np.array_equal(commits, ['671e13d', '4fe1c42', '3e10227',
                                     '91d54e3', '2c3dca4'])
 
+    # tags can contain spaces
+    get_bugfix_commits(['BUG FIX'])
+
+    assert mock_runbc.call_args[0][0] == \
+        ['git', 'log', '-i', '--all', '--grep=BUG FIX', '--pretty=format:%H']
+
 
 @mock.patch('gitrisky.gitcmds._run_bash_command')
 def test_get_bugfix_commits_no_bugs(mock_runbc):
@@ -101,65 +290,97 @@ def test_get_bugfix_commits_no_bugs(mock_runbc):
 @mock.patch('gitrisky.gitcmds._run_bash_command')
 def test_get_commit_filenames(mock_runbc):
 
-    stdout = "gitrisky/cli.py\ngitrisky/model.py"
+    stdout = ("M\tgitrisky/cli.py\n"
+              "R087\tgitrisky/old.py\tgitrisky/model.py\n"
+              "A\tgitrisky/new.py\n"
+              "D\tgitrisky/gone.py")
 
     mock_runbc.return_value = stdout
 
     fnames = _get_commit_filenames('dc95b21')
 
-    # try when _get_commit_filenames returns multiple filenames
-    assert isinstance(fnames, list)
-    assert mock_runbc.called_with(
-        'git --no-pager diff dc95b21 dc95b21^ --name-only')
-    assert np.array_equal(fnames, ['gitrisky/cli.py', 'gitrisky/model.py'])
+    mock_runbc.assert_called_once_with(
+        'git --no-pager diff -M --name-status dc95b21^ dc95b21')
 
-    # try when _get_commit_filenames returns single filename
-    stdout = "gitrisky/cli.py"
-    mock_runbc.return_value = stdout
+    # added and deleted files are skipped, renamed files use their old name
+    assert fnames == ['gitrisky/cli.py', 'gitrisky/old.py']
 
-    fnames = _get_commit_filenames('dc95b21')
+    # try when the commit only added a file
+    mock_runbc.return_value = "A\tgitrisky/new.py"
 
-    assert isinstance(fnames, list)
+    assert _get_commit_filenames('dc95b21') == []
 
 
 @mock.patch('gitrisky.gitcmds._run_bash_command')
 def test_get_commit_lines(mock_runbc):
 
-    # specify different return values for repeated calls to mock_runbc
-    # note that this isn't the complete output of the relevant git command,
-    # just the important bits
-    stdout1 = ("@@ -5,3 +5 @@ import click\n"
-               "@@ -30 +28 @@ def train():")
-    stdout2 = ("@@ -6,0 +7 @@ from git import Repo\n"
-               "@@ -26,0 +28,16 @@ def _get_model_path():")
+    stdout = ("diff --git a/gitrisky/cli.py b/gitrisky/cli.py\n"
+              "index 2f0b9d3..c668b98 100644\n"
+              "--- a/gitrisky/cli.py\n"
+              "+++ b/gitrisky/cli.py\n"
+              "@@ -5,3 +5 @@ import click\n"
+              "-import os\n"
+              "-import sys\n"
+              "--- a/fake/header.py\n"
+              "+import click\n"
+              "@@ -30 +28 @@ def train():\n"
+              "-    model = None\n"
+              "+    model = create_model()\n"
+              "diff --git a/gitrisky/old.py b/gitrisky/model.py\n"
+              "similarity index 87%\n"
+              "rename from gitrisky/old.py\n"
+              "rename to gitrisky/model.py\n"
+              "index 209879e..bb47087 100644\n"
+              "--- a/gitrisky/old.py\n"
+              "+++ b/gitrisky/model.py\n"
+              "@@ -6,0 +7 @@ from git import Repo\n"
+              "+import os\n"
+              "@@ -12,2 +13,2 @@ def _get_model_path():\n"
+              "-    a\n"
+              "-    b\n"
+              "\\ No newline at end of file\n"
+              "+    A\n"
+              "+    B\n"
+              "diff --git a/README.md b/README.md\n"
+              "--- a/README.md\n"
+              "+++ b/README.md\n"
+              "@@ -1 +1 @@\n"
+              "-gitrisky\n"
+              "+gitrisky!")
 
-    mock_runbc.side_effect = [stdout1, stdout2]
+    mock_runbc.return_value = stdout
 
-    lines = \
-        _get_commit_lines('dc95b21', ['gitrisky/cli.py', 'gitrisky/model.py'])
+    lines = _get_commit_lines('dc95b21',
+                              ['gitrisky/cli.py', 'gitrisky/old.py'])
 
-    assert mock_runbc.called_with(
-            'git --no-pager diff dc95b21^ dc95b21 -U0 -- gitrisky/cli.py')
-    assert mock_runbc.called_with(
-            'git --no-pager diff dc95b21^ dc95b21 -U0 -- gitrisky/model.py')
+    # the whole commit is diffed at once
+    mock_runbc.assert_called_once_with(
+        'git --no-pager diff -M -U0 --src-prefix=a/ --dst-prefix=b/ '
+        'dc95b21^ dc95b21')
 
     assert isinstance(lines, defaultdict)
 
-    # we deleted 3 lines after line 5 and 1 line after line 30 in cli.py
-    assert np.array_equal(lines['gitrisky/cli.py'], [('5', '3'), ('30', '1')])
+    # we deleted 3 lines after line 5 and 1 line after line 30 in cli.py,
+    # and the removed line which looks like a header is skipped
+    assert lines['gitrisky/cli.py'] == [('5', '3'), ('30', '1')]
+
+    # the renamed file is diffed against its old name, and the hunk which
+    # only adds lines is skipped
+    assert lines['gitrisky/old.py'] == [('12', '2')]
 
-    # we didn't delete any lines in model.py
-    assert np.array_equal(lines['gitrisky/model.py'], [])
+    # files which weren't asked for are skipped
+    assert 'README.md' not in lines
+    assert 'fake/header.py' not in lines
 
 
 @mock.patch('gitrisky.gitcmds._run_bash_command')
 def test_get_blame_commit(mock_runbc):
 
-    stdout1 = ("c668b98e (Henry Hinnefeld 2018-01-22 07:33:22 -0600 30)     model = RandomForestClassifier()")  # noqa
-    stdout2 = ("c668b98e gitrisky/cli.py (Henry Hinnefeld 2018-01-22 07:33:22 -0600 5) from sklearn.ensemble import RandomForestClassifier\n"  # noqa
-               "2f0b9d3b cli.py          (Henry Hinnefeld 2018-01-21 20:03:36 -0600 6) \n"  # noqa
-               "209879e0 gitrisky/cli.py (Henry Hinnefeld 2018-01-22 07:34:16 -0600 7) from .model import save_model, load_model")  # noqa
-    mock_runbc.side_effect = [stdout1, stdout2]
+    stdout = ("c668b98e gitrisky/cli.py (Henry Hinnefeld 2018-01-22 07:33:22 -0600 5) from sklearn.ensemble import RandomForestClassifier\n"  # noqa
+              "2f0b9d3b cli.py          (Henry Hinnefeld 2018-01-21 20:03:36 -0600 6) \n"  # noqa
+              "209879e0 gitrisky/cli.py (Henry Hinnefeld 2018-01-22 07:34:16 -0600 7) from .model import save_model, load_model\n"  # noqa
+              "c668b98e (Henry Hinnefeld 2018-01-22 07:33:22 -0600 30)     model = RandomForestClassifier()")  # noqa
+    mock_runbc.return_value = stdout
 
     filenames = ['gitrisky/cli.py', 'gitrisky/model.py']
     fname_lines = {'gitrisky/cli.py': [('5', '3'), ('30', '1')],
@@ -167,16 +388,120 @@ def test_get_blame_commit(mock_runbc):
 
     bug_commits = _get_blame_commit('dc95b21', filenames, fname_lines)
 
-    # check we called the right git commands
-    assert mock_runbc.called_with(
-        'git --no-pager blame -L5,+3 dc95b21^ -- gitrisky/cli.py')
-    assert mock_runbc.called_with(
-        'git --no-pager blame -L30,+1 dc95b21^ -- gitrisky/cli.py')
+    # check we blamed all the hunks in cli.py at once and skipped model.py
+    mock_runbc.assert_called_once_with(
+        'git --no-pager blame -L5,+3 -L30,+1 dc95b21^ -- gitrisky/cli.py')
 
     assert isinstance(bug_commits, set)
     assert bug_commits == set(['c668b98e', '2f0b9d3b', '209879e0'])
 
 
+@mock.patch('gitrisky.gitcmds._run_bash_command')
+def test_get_blame_commit_since(mock_runbc):
+
+    stdout = ("^2f0b9d3 cli.py          (Henry Hinnefeld 2018-01-21 20:03:36 -0600 5) \n"  # noqa
+              "209879e0 gitrisky/cli.py (Henry Hinnefeld 2018-01-22 07:34:16 -0600 6) from .model import save_model, load_model")  # noqa
+    mock_runbc.return_value = stdout
+
+    bug_commits = _get_blame_commit('dc95b21', ['gitrisky/cli.py'],
+                                    {'gitrisky/cli.py': [('5', '2')]},
+                                    since=1516600000)
+
+    mock_runbc.assert_called_once_with(
+        'git --no-pager blame --since=1516600000 -L5,+2 dc95b21^ '
+        '-- gitrisky/cli.py')
+
+    # lines older than the time bound are blamed on a boundary commit, which
+    # didn't introduce them
+    assert bug_commits == set(['209879e0'])
+
+
+def test_get_n_workers():
+
+    assert _get_n_workers(None) == 1
+    assert _get_n_workers(1) == 1
+    assert _get_n_workers(4) == 4
+    assert _get_n_workers(-1) == cpu_count()
+
+
+@mock.patch('gitrisky.gitcmds._stream_bash_command')
+def test_iter_commit_hunks(mock_streambc):
+
+    stdout = ("\x003e1022700\n",
+              "\n",
+              "diff --git a/gitrisky/cli.py b/gitrisky/cli.py\n",
+              "index 2f0b9d3..c668b98 100644\n",
+              "--- a/gitrisky/cli.py\n",
+              "+++ b/gitrisky/cli.py\n",
+              "@@ -5,3 +5 @@ import click\n",
+              "-import os\n",
+              "-import sys\n",
+              "-\x00not a commit\n",
+              "+import click\n",
+              "diff --git a/gitrisky/gone.py b/gitrisky/gone.py\n",
+              "deleted file mode 100644\n",
+              "index 209879e..0000000\n",
+              "--- a/gitrisky/gone.py\n",
+              "+++ /dev/null\n",
+              "@@ -1 +0,0 @@\n",
+              "-import os\n",
+              "\x002c3dca4a0\n",
+              "\n",
+              "diff --git a/gitrisky/new.py b/gitrisky/new.py\n",
+              "new file mode 100644\n",
+              "index 0000000..bb47087\n",
+              "--- /dev/null\n",
+              "+++ b/gitrisky/new.py\n",
+              "@@ -0,0 +1 @@\n",
+              "+import os\n")
+
+    mock_streambc.return_value = iter(stdout)
+
+    hunks = list(_iter_commit_hunks(['3e1022700', '2c3dca4a0']))
+
+    # every commit is diffed by the same git process
+    mock_streambc.assert_called_once_with(
+        'git log -p -U0 -M --no-walk=unsorted --diff-merges=first-parent '
+        '--src-prefix=a/ --dst-prefix=b/ --format=%x00%H --stdin',
+        stdin_lines=['3e1022700', '2c3dca4a0'])
+
+    # deleted and added files have no lines to blame
+    assert hunks == [{'gitrisky/cli.py': [('5', '3')]}, {}]
+
+    # no commits, no git process
+    assert list(_iter_commit_hunks([])) == []
+    assert mock_streambc.call_count == 1
+
+
+@mock.patch('gitrisky.gitcmds.get_backend')
+def test_link_fixes_to_bugs_parallel(mock_gb):
+
+    origins = {'3e102270': set(['d90875b0', 'e359f619']),
+               '2c3dca4a': set(['e359f619', 'bb47087b'])}
+
+    # the default implementation, which blames the fixes in threads
+    backend = GitBackend()
+    backend.changed_files = mock.Mock(
+        side_effect=lambda commit: [] if commit == 'f2a4b6c80' else ['a.py'])
+    backend.changed_lines = mock.Mock(return_value={'a.py': [('5', '3')]})
+    backend.blame = mock.Mock(
+        side_effect=lambda commit, *args: origins[commit])
+    mock_gb.return_value = backend
+
+    # the last fix only added files, so has no lines to blame
+    fix_commits = ['3e1022700', '2c3dca4a0', '3e1022700', 'f2a4b6c80']
+
+    serial = link_fixes_to_bugs(fix_commits)
+    parallel = link_fixes_to_bugs(fix_commits, n_jobs=2)
+
+    # the duplicate fix is only looked up once
+    assert backend.changed_files.call_count == 6
+    assert backend.blame.call_count == 4
+
+    assert set(serial) == set(['d90875b0', 'e359f619', 'bb47087b'])
+    assert set(parallel) == set(serial)
+
+
 def test_link_fixes_to_bugs():
 
     # NOTE: this is effectively an integration test because the
@@ -190,3 +515,93 @@ def test_link_fixes_to_bugs():
 
     assert isinstance(bug_commits, list)
     assert set(bug_commits) == set(['d90875b0', 'e359f619', 'bb47087b'])
+
+
+def test_link_renamed_fix(repo_dir):
+
+    make_commit(repo_dir, 'Initial commit', {'b.py': 'b\n'})
+    make_commit(repo_dir, 'Add c', {'c.py': 'c\nd\ne\nf\ng\nh\n'})
+    make_commit(repo_dir, 'Change e', {'c.py': 'c\nd\nE\nf\ng\nh\n'})
+    change_e = rev_parse()
+
+    # the fix renames c.py, changes a line in it, adds a file and deletes
+    # another
+    check_call(['git', 'mv', 'c.py', 'renamed.py'])
+    os.remove('b.py')
+    make_commit(repo_dir, 'Fix e', {'renamed.py': 'c\nd\nEE\nf\ng\nh\n',
+                                    'new.py': 'new\n'})
+
+    # only the changed line is blamed, under the file's old name
+    assert _get_commit_filenames('HEAD') == ['c.py']
+    assert _get_commit_lines('HEAD', ['c.py']) == {'c.py': [('3', '1')]}
+    assert link_fixes_to_bugs(['HEAD']) == [change_e[:8]]
+
+
+@pytest.fixture
+def fixed_repo_dir(repo_dir):
+
+    make_commit(repo_dir, 'Initial commit', {'a.py': 'a\n', 'b.py': 'b\n'})
+    make_commit(repo_dir, 'Fix a', {'a.py': 'A\n'})
+
+    return repo_dir
+
+
+def test_link_fixes_concurrently(fixed_repo_dir):
+
+    make_commit(fixed_repo_dir, 'Add c', {'c.py': 'c\nd\ne\n', 'd.py': 'd\n'})
+    add_c = rev_parse()
+    make_commit(fixed_repo_dir, 'Fix c and d',
+                {'c.py': 'C\nd\nE\n', 'd.py': 'D\n'})
+    fix_c = rev_parse()
+    make_commit(fixed_repo_dir, 'Fix c again', {'c.py': 'C\nD\nE\n'})
+    fix_c_again = rev_parse()
+
+    fixes = get_bugfix_commits()
+
+    serial = map_fixes_to_bugs(fixes)
+    concurrent = map_fixes_to_bugs(fixes, n_jobs=3)
+
+    assert serial == concurrent
+
+    # each fix is linked to the same commits as blaming it directly
+    for fix in fixes:
+        fname_lines = _get_commit_lines(fix, _get_commit_filenames(fix))
+        assert serial[fix] == _get_blame_commit(fix, list(fname_lines),
+                                                fname_lines)
+
+    assert serial[fix_c] == set([add_c[:8]])
+    assert serial[fix_c_again] == set([add_c[:8]])
+
+    # a bad revision fails, like the synchronous git commands
+    with pytest.raises(CalledProcessError):
+        map_fixes_to_bugs(['not-a-commit'], n_jobs=2)
+
+
+def test_link_fixes_timeout(fixed_repo_dir):
+
+    make_commit(fixed_repo_dir, 'Add c', {'c.py': 'c\n', 'd.py': 'd\n'})
+    make_commit(fixed_repo_dir, 'Fix c and d', {'c.py': 'C\n', 'd.py': 'D\n'})
+    fix_c = rev_parse()
+
+    async def time_out(args, limit, timeout=None):
+        if args[-1] == 'd.py':
+            raise TimeoutExpired(args, timeout)
+        return b''
+
+    with mock.patch('gitrisky.gitasync.run_command', side_effect=time_out):
+        with pytest.warns(UserWarning, match=fix_c[:8]):
+            bug_origins = map_fixes_to_bugs(get_bugfix_commits(), n_jobs=2)
+
+    # the fix whose blame timed out is left out, so it isn't cached
+    assert fix_c not in bug_origins
+    assert len(bug_origins) == 1
+
+
+def test_start_bugfix_commits(fixed_repo_dir):
+
+    get_commits = start_bugfix_commits(['FIX'])
+
+    assert get_commits() == get_bugfix_commits(['FIX'])
+
+    with pytest.raises(ValueError):
+        start_bugfix_commits(['NOT-A-TAG'])()
@@ -0,0 +1,189 @@
+import os
+import pytest
+
+from subprocess import check_call
+
+from gitrisky.gitcmds import get_bugfix_commits, set_backend, get_git_log, \
+    link_fixes_to_bugs, map_fixes_to_bugs
+from gitrisky.tests.conftest import GIT_ENV, make_commit, rev_parse
+
+pytest.importorskip('pygit2')
+
+from gitrisky.libgit2 import _rename_path  # noqa: E402
+
+
+@pytest.fixture
+def repo_dir(repo_dir):
+
+    make_commit(repo_dir, 'Initial commit',
+                {'src/a.py': 'a\nb\nc\nd\n', 'README.md': 'readme\n'},
+                1517781345)
+    make_commit(repo_dir, 'Add e',
+                {'src/a.py': 'a\nb\nc\nd\ne\n'}, 1517781400)
+    check_call(['git', '-C', repo_dir, 'mv', 'src/a.py', 'src/b.py'])
+    make_commit(repo_dir, 'Rename a', {}, 1517781500)
+    make_commit(repo_dir, 'Fix bug in b',
+                {'src/b.py': 'a\nB\nc\nd\nE\n', 'README.md': 'readme!\n'},
+                1517781600)
+
+    return repo_dir
+
+
+def test_rename_path():
+
+    assert _rename_path('src/a.py', 'src/b.py') == 'src/{a.py => b.py}'
+    assert _rename_path('a/x/c.py', 'b/x/c.py') == '{a => b}/x/c.py'
+    assert _rename_path('a.py', 'b.py') == 'a.py => b.py'
+
+
+def test_backends_agree(repo_dir):
+
+    results = {}
+
+    for backend in ['subprocess', 'pygit2']:
+
+        set_backend(backend)
+
+        log = list(get_git_log())
+        fixes = get_bugfix_commits()
+
+        results[backend] = (log,
+                            list(get_git_log(log[1].hash)),
+                            list(get_git_log([log[0].hash, log[2].hash])),
+                            list(get_git_log(rev_range=log[2].hash + '..')),
+                            sorted(link_fixes_to_bugs(fixes)))
+
+    assert results['pygit2'] == results['subprocess']
+
+    log = results['pygit2'][0]
+
+    assert [entry.message for entry in log] == \
+        ['Fix bug in b\n', 'Rename a\n', 'Add e\n', 'Initial commit\n']
+    assert log[1].numstat == [(0, 0, 'src/{a.py => b.py}')]
+
+    # the fix changes lines from the initial commit, which git blame marks as
+    # a boundary commit, and from the second commit
+    assert results['pygit2'][-1] == sorted(['^' + log[3].hash[:7],
+                                            log[2].hash[:8]])
+
+
+def test_backends_agree_since(repo_dir):
+
+    results = {}
+
+    for backend in ['subprocess', 'pygit2']:
+
+        set_backend(backend)
+
+        fixes = get_bugfix_commits()
+
+        # the fix changes a line from the initial commit, which is older than
+        # the bound, and one from the second commit
+        results[backend] = link_fixes_to_bugs(fixes, since='1517781390')
+
+    log = list(get_git_log())
+
+    assert results['pygit2'] == results['subprocess'] == [log[2].hash[:8]]
+
+
+def test_backends_agree_merge(repo_dir):
+
+    # merge in a branch which adds a file
+    check_call(['git', 'checkout', '-q', '-b', 'side', 'HEAD~1'])
+    make_commit(repo_dir, 'Add c', {'src/c.py': 'c\n'}, 1517781700)
+    check_call(['git', 'checkout', '-q', '-'])
+
+    env = dict(os.environ, **GIT_ENV)
+    check_call(['git', 'merge', '-q', '--no-ff', '-m', 'Merge side', 'side'],
+               env=env)
+
+    results = {}
+
+    for backend in ['subprocess', 'pygit2']:
+
+        set_backend(backend)
+        results[backend] = list(get_git_log())
+
+    assert results['pygit2'] == results['subprocess']
+
+    merge = results['subprocess'][0]
+
+    # the merge is diffed against its first parent, also when it's looked up
+    # on its own
+    assert len(merge.parents) == 2
+    assert merge.numstat == [(1, 0, 'src/c.py')]
+
+    set_backend('subprocess')
+
+    assert list(get_git_log(merge.hash)) == [merge]
+
+
+def test_backends_agree_since_merge(repo_dir):
+
+    start = 1517790000
+    lines = ['c1\n', 'c2\n', 'c3\n', 'c4\n', 'c5\n', 'c6\n']
+
+    def change(line, timestamp, message=None):
+        lines[line] = lines[line].upper()
+        make_commit(repo_dir, message or 'Change c{}'.format(line + 1),
+                    {'src/c.py': ''.join(lines)}, timestamp)
+        return rev_parse()
+
+    make_commit(repo_dir, 'Add c', {'src/c.py': ''.join(lines)}, start)
+
+    # lines changed on either side of a merge, before and after the bound
+    check_call(['git', 'checkout', '-q', '-b', 'side'])
+    change(3, start + 50)
+    change_c5 = change(4, start + 1000)
+    check_call(['git', 'checkout', '-q', '-'])
+    lines = ['c1\n', 'c2\n', 'c3\n', 'c4\n', 'c5\n', 'c6\n']
+    change(1, start + 100)
+    change_c1 = change(0, start + 900)
+
+    env = dict(os.environ, GIT_AUTHOR_DATE='{} -0600'.format(start + 1100),
+               GIT_COMMITTER_DATE='{} -0600'.format(start + 1100), **GIT_ENV)
+    check_call(['git', 'merge', '-q', '--no-ff', '-m', 'Merge side', 'side'],
+               env=env)
+
+    # the fix changes every line but the third
+    lines = ['C1x\n', 'C2x\n', 'c3\n', 'C4x\n', 'C5x\n', 'c6x\n']
+    make_commit(repo_dir, 'Fix c', {'src/c.py': ''.join(lines)}, start + 1200)
+    fix_c = rev_parse()
+
+    results = {}
+
+    for backend in ['subprocess', 'pygit2']:
+
+        set_backend(backend)
+        results[backend] = map_fixes_to_bugs([fix_c], since=str(start + 500))
+
+    # only the lines changed since the bound, on either side of the merge,
+    # are linked
+    assert results['pygit2'] == results['subprocess'] == \
+        {fix_c: set([change_c1[:8], change_c5[:8]])}
+
+
+def test_backends_agree_root_fix(repo_dir):
+
+    # a root commit which matches the bug tags, on a branch of its own
+    check_call(['git', 'checkout', '-q', '--orphan', 'other'])
+    check_call(['git', 'rm', '-q', '-r', '-f', '.'])
+    make_commit(repo_dir, 'Fix everything', {'other.py': 'other\n'},
+                1517781700)
+    root_fix = rev_parse()
+
+    results = {}
+
+    for backend in ['subprocess', 'pygit2']:
+
+        set_backend(backend)
+
+        fixes = get_bugfix_commits()
+        assert root_fix in fixes
+
+        results[backend] = map_fixes_to_bugs(fixes)
+
+    assert results['pygit2'] == results['subprocess']
+
+    # it has nothing to link to
+    assert results['pygit2'][root_fix] == set()
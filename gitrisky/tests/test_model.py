@@ -1,21 +1,24 @@
 import mock
+import os
 import pickle
+import pytest
 
-from collections import namedtuple
-from tempfile import NamedTemporaryFile
-from gitrisky.model import _get_model_path, create_model, load_model, \
-    save_model
+import joblib
+import numpy as np
+import pandas as pd
 
+from tempfile import TemporaryDirectory
+from gitrisky.config import DEFAULT_TIMEZONE
+from gitrisky.model import MODEL_FORMAT_VERSION, IncompatibleModelError, \
+    _get_model_path, check_features, create_model, fit_model, \
+    get_model_timezone, load_model, load_scoring_model, save_model
+from gitrisky.forest import Forest
 
-@mock.patch('gitrisky.model.Repo')
-def test_get_model_path(mock_Repo):
 
-    # fake version of the Repo class
-    Repo = namedtuple('Repo', 'working_tree_dir')
-    fake_instance = Repo('path/to/repo')
+@mock.patch('gitrisky.model.get_repo_dir')
+def test_get_model_path(mock_grd):
 
-    # make the mocked constructor return the fake instance
-    mock_Repo.return_value = fake_instance
+    mock_grd.return_value = 'path/to/repo'
 
     path = _get_model_path()
 
@@ -34,29 +37,218 @@ def test_create_model():
     assert callable(getattr(model, 'predict_proba'))
 
 
-@mock.patch('gitrisky.model._get_model_path')
-def test_load_model(mock_gmp):
+def test_create_model_settings():
 
-    with NamedTemporaryFile() as tmpfile:
+    model = create_model('extra_trees', n_jobs=-1, n_estimators=50,
+                         max_depth=4)
 
-        pickle.dump('fake model', tmpfile)
-        tmpfile.seek(0)
+    assert type(model).__name__ == 'ExtraTreesClassifier'
+    assert model.n_jobs == -1
+    assert model.n_estimators == 50
+    assert model.max_depth == 4
 
-        mock_gmp.return_value = tmpfile.name
-        model = load_model()
+    # settings which don't apply to the estimator are rejected
+    with pytest.raises(ValueError):
+        create_model('sgd', max_depth=4)
 
-    assert model == 'fake model'
+    with pytest.raises(ValueError):
+        create_model('naive_bayes')
 
 
-@mock.patch('gitrisky.model._get_model_path')
-def test_save_model(mock_gmp):
+def test_create_model_search():
 
-    with NamedTemporaryFile() as tmpfile:
+    search = create_model(n_jobs=2, n_estimators=50, search='randomized',
+                          n_iter=5)
 
-        mock_gmp.return_value = tmpfile.name
+    # the candidates are trained in parallel rather than each model
+    assert search.n_jobs == 2
+    assert search.n_iter == 5
+    assert search.estimator.n_jobs is None
+
+    # settings which were given aren't searched over
+    assert search.estimator.n_estimators == 50
+    assert 'n_estimators' not in search.param_distributions
+    assert 'max_depth' in search.param_distributions
+
+    search = create_model(search='halving')
+
+    assert type(search).__name__ == 'HalvingRandomSearchCV'
+
+    # the settings of a scaled estimator are prefixed with its pipeline step
+    search = create_model('sgd', search='randomized')
+
+    assert 'sgd__alpha' in search.param_distributions
+
+
+def test_create_model_scaled():
+
+    model = create_model('sgd')
+
+    # sgd is sensitive to the scale of the features, so they're standardized
+    assert [name for name, _ in model.steps] == ['scale', 'sgd']
+    assert type(model.steps[0][1]).__name__ == 'StandardScaler'
+    assert model.steps[1][1].loss == 'log_loss'
+
+
+def test_fit_model():
+
+    X = np.arange(10, dtype=np.float32).reshape(5, 2)
+    y = np.array([0, 1, 0, 1, 1])
+
+    # models without partial_fit are fit on all the data at once
+    model = mock.Mock(spec=['fit'])
+    fit_model(model, X, y, columns=['a', 'b'])
+
+    model.fit.assert_called_once_with(X, y)
+    assert list(model.feature_names_in_) == ['a', 'b']
+
+    # otherwise the data is fed to the model in mini-batches
+    model = mock.Mock(spec=['fit', 'partial_fit'])
+    fit_model(model, X, y, batch_size=2)
+
+    assert not model.fit.called
+    assert [len(args[0]) for args, _ in model.partial_fit.call_args_list] == \
+        [2, 2, 1]
+    assert model.partial_fit.call_args[1] == {'classes': [0, 1]}
+
+    # each step of a pipeline is trained on all the batches before the next
+    scale = mock.Mock(spec=['partial_fit', 'transform'])
+    scale.transform.side_effect = lambda batch: batch * 2
+    classifier = mock.Mock(spec=['partial_fit'])
+
+    pipeline = mock.Mock(spec=['fit', 'steps'])
+    pipeline.steps = [('scale', scale), ('classifier', classifier)]
+    fit_model(pipeline, X, y, columns=['a', 'b'], batch_size=2)
+
+    assert not pipeline.fit.called
+    assert [len(args[0]) for args, _ in scale.partial_fit.call_args_list] == \
+        [2, 2, 1]
+    assert scale.transform.call_count == 3
+    np.testing.assert_array_equal(classifier.partial_fit.call_args[0][0],
+                                  X[4:] * 2)
+    assert classifier.partial_fit.call_args[1] == {'classes': [0, 1]}
+
+    # the pipeline takes its column names from its first step
+    assert list(scale.feature_names_in_) == ['a', 'b']
+
+
+def test_fit_model_scaled():
+
+    rng = np.random.RandomState(0)
+
+    # features on very different scales, one of which predicts the label
+    X = rng.rand(2000, 2) * [1, 1e9]
+    y = (X[:, 0] > rng.rand(2000)).astype(int)
+
+    model = create_model('sgd')
+    fit_model(model, X, y, columns=['a', 'b'], batch_size=500)
+
+    scores = model.predict_proba(pd.DataFrame(X, columns=['a', 'b']))[:, 1]
+
+    assert list(model.feature_names_in_) == ['a', 'b']
+    assert not np.isin(scores, [0, 1]).any()
+    assert scores[y == 1].mean() > scores[y == 0].mean()
+
+
+@mock.patch('gitrisky.model.get_repo_dir')
+def test_save_load_model(mock_grd):
+
+    X = np.array([[0, 1], [1, 0], [1, 1], [0, 0]])
+    y = np.array([0, 1, 1, 0])
+
+    model = create_model(n_estimators=5)
+    fit_model(model, X, y, columns=['dayofweek', 'hour'])
+
+    with TemporaryDirectory() as tmpdir:
+
+        mock_grd.return_value = tmpdir
+        save_model(model, head='abcd', timezone='UTC')
+
+        saved = joblib.load(os.path.join(tmpdir, 'gitrisky.model'))
+        loaded = load_model()
+
+    assert saved['format_version'] == MODEL_FORMAT_VERSION
+    assert saved['columns'] == ['dayofweek', 'hour']
+    assert saved['head'] == 'abcd'
+    assert saved['timezone'] == 'UTC'
+
+    assert list(loaded.feature_names_in_) == ['dayofweek', 'hour']
+    assert loaded.timezone_ == 'UTC'
+    X = pd.DataFrame(X, columns=['dayofweek', 'hour'])
+    assert (loaded.predict_proba(X) == model.predict_proba(X)).all()
+
+
+@mock.patch('gitrisky.model.get_repo_dir')
+def test_load_scoring_model(mock_grd):
+
+    X = pd.DataFrame([[0, 1], [1, 0], [1, 1], [0, 0]],
+                     columns=['dayofweek', 'hour'])
+    y = np.array([0, 1, 1, 0])
+
+    with TemporaryDirectory() as tmpdir:
+
+        mock_grd.return_value = tmpdir
+
+        # forests are scored from their NumPy copy
+        model = create_model(n_estimators=5)
+        fit_model(model, X.values, y, columns=list(X.columns))
+        save_model(model, timezone='author')
+
+        scoring_model = load_scoring_model()
+
+        assert isinstance(scoring_model, Forest)
+        assert get_model_timezone(scoring_model) == 'author'
+        assert (scoring_model.predict_proba(X) ==
+                model.predict_proba(X)).all()
+
+        # other models are scored with scikit-learn, and the NumPy copy of
+        # the previous forest is removed
+        model = create_model('sgd')
+        fit_model(model, X.values, y, columns=list(X.columns))
+        save_model(model)
+
+        assert os.listdir(tmpdir) == ['gitrisky.model']
+        assert not isinstance(load_scoring_model(), Forest)
+        assert get_model_timezone(load_scoring_model()) == DEFAULT_TIMEZONE
+
+
+@mock.patch('gitrisky.model.get_repo_dir')
+def test_load_incompatible_model(mock_grd):
+
+    with TemporaryDirectory() as tmpdir:
+
+        mock_grd.return_value = tmpdir
+        model_path = os.path.join(tmpdir, 'gitrisky.model')
+
+        # a model pickled by an older version of gitrisky
+        with open(model_path, 'wb') as outfile:
+            pickle.dump('fake model', outfile)
+
+        with pytest.raises(IncompatibleModelError):
+            load_model()
+
+        # a model trained with another version of scikit-learn
         save_model('fake model')
+        saved = joblib.load(model_path)
+        saved['sklearn_version'] = '0.19.1'
+        joblib.dump(saved, model_path)
+
+        with pytest.raises(IncompatibleModelError):
+            load_model()
+
+        # a model saved in a newer format
+        saved['format_version'] = MODEL_FORMAT_VERSION + 1
+        joblib.dump(saved, model_path)
+
+        with pytest.raises(IncompatibleModelError):
+            load_model()
+
+
+def test_check_features():
+
+    model = mock.Mock(feature_names_in_=np.array(['dayofweek', 'hour']))
 
-        tmpfile.seek(0)
-        model = pickle.load(tmpfile)
+    check_features(model, ['dayofweek', 'hour'])
 
-    assert model == 'fake model'
+    with pytest.raises(IncompatibleModelError):
+        check_features(model, ['hour', 'dayofweek'])
@@ -0,0 +1,322 @@
+import mock
+import os
+
+import numpy as np
+import pandas as pd
+
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import TemporaryDirectory
+
+from gitrisky.gitcmds import LogEntry
+from gitrisky.parsing import parse_commit, add_time_features, get_features, \
+    get_labels, get_label_array, enable_feature_memo, clear_feature_memo, \
+    write_feature_matrix
+
+
+COMMIT = LogEntry(hash='bbb59ea0f0b4a0e5f8b3f2c3e1a4b5c6d7e8f9a0',
+                  parents=['910cdb3c3b3e0ac4fb2c3f1e5f7cd5b9e4b3a7c1'],
+                  timestamp=1517781345,
+                  tz_offset=-6 * 3600,
+                  message='Write readme\n\n    Add usage section\n',
+                  numstat=[(86, 0, 'README.md'), (3, 1, 'gitrisky/cli.py')])
+
+MERGE = LogEntry(hash='4db4fc24afe7565ac65fdb272c7c157c43aace77',
+                 parents=['910cdb3c3b3e0ac4fb2c3f1e5f7cd5b9e4b3a7c1',
+                          'bbb59ea0f0b4a0e5f8b3f2c3e1a4b5c6d7e8f9a0'],
+                 timestamp=1517781345,
+                 tz_offset=-6 * 3600,
+                 message='Merge pull request #10\n',
+                 numstat=[])
+
+
+def test_parse_commit():
+
+    feats = parse_commit(COMMIT)
+
+    assert feats['hash'] == 'bbb59ea0'
+
+    assert feats['timestamp'] == 1517781345
+    assert feats['tz_offset'] == -6 * 3600
+
+    assert feats['len_message'] == len('Write readme\n\nAdd usage section')
+    assert feats['changed_files'] == 2
+    assert feats['additions'] == 89
+    assert feats['deletions'] == 1
+
+
+def test_parse_commit_merge():
+
+    # merge commits are described by their diff against their first parent
+    feats = parse_commit(MERGE._replace(numstat=COMMIT.numstat))
+
+    assert feats['changed_files'] == 2
+    assert feats['additions'] == 89
+    assert feats['deletions'] == 1
+
+    # e.g. a merge which didn't change anything relative to its first parent
+    feats = parse_commit(MERGE)
+
+    assert feats['changed_files'] == 0
+    assert feats['changed_dirs'] == 0
+    assert feats['max_file_churn'] == 0
+    assert feats['churn_entropy'] == 0
+    assert feats['frac_test_files'] == 0
+
+
+def test_parse_commit_numstat():
+
+    numstat = [(10, 2, 'gitrisky/cli.py'),
+               (4, 4, 'gitrisky/{tests => test}/test_cli.py'),
+               (0, 0, 'docs/logo.png'),
+               (1, 0, 'README.md'),
+               (3, 0, '{ => conf}/setup.cfg'),
+               (0, 0, 'old.py => gitrisky/new.py')]
+
+    feats = parse_commit(COMMIT._replace(numstat=numstat))
+
+    assert feats['changed_files'] == 6
+
+    # gitrisky, gitrisky/test, docs, the top level and conf
+    assert feats['changed_dirs'] == 5
+
+    # .py, .png, .md and .cfg
+    assert feats['file_types'] == 4
+
+    assert feats['frac_test_files'] == 1 / 6
+    assert feats['frac_doc_files'] == 2 / 6
+    assert feats['frac_config_files'] == 1 / 6
+
+    assert feats['max_file_churn'] == 12
+
+    churns = np.array([12, 8, 1, 3]) / 24
+    assert np.isclose(feats['churn_entropy'],
+                      -(churns * np.log2(churns)).sum())
+
+    # all the changes in one file
+    feats = parse_commit(COMMIT._replace(numstat=[(3, 1, 'a.py'),
+                                                  (0, 0, 'b.png')]))
+    assert feats['churn_entropy'] == 0
+
+
+@mock.patch('gitrisky.parsing.get_git_log')
+def test_get_features(mock_ggl):
+
+    mock_ggl.return_value = iter([MERGE, COMMIT])
+
+    feats = get_features(use_cache=False)
+
+    assert list(feats.index) == ['4db4fc24', 'bbb59ea0']
+    assert list(feats.columns) == ['dayofweek', 'hour', 'len_message',
+                                   'changed_files', 'additions', 'deletions',
+                                   'changed_dirs', 'file_types',
+                                   'frac_test_files', 'frac_doc_files',
+                                   'frac_config_files', 'max_file_churn',
+                                   'churn_entropy']
+
+    # the features are stored as compact integers and floats
+    assert list(feats.dtypes) == [np.int8, np.int8, np.int32, np.int32,
+                                  np.int32, np.int32, np.int32, np.int32,
+                                  np.float32, np.float32, np.float32,
+                                  np.int32, np.float32]
+
+    assert feats.loc['4db4fc24', 'changed_files'] == 0
+    assert feats.loc['bbb59ea0', 'additions'] == 89
+    assert feats.loc['bbb59ea0', 'frac_doc_files'] == 0.5
+
+    # Sun Feb 4 15:55:45 2018 -0600
+    assert feats.loc['bbb59ea0', 'dayofweek'] == 6
+    assert feats.loc['bbb59ea0', 'hour'] == 15
+
+
+@mock.patch('gitrisky.parsing.MIN_PARALLEL_COMMITS', 0)
+@mock.patch('gitrisky.parsing.ProcessPoolExecutor', ThreadPoolExecutor)
+@mock.patch('gitrisky.parsing.count_commits')
+@mock.patch('gitrisky.parsing.get_git_log')
+def test_get_features_parallel(mock_ggl, mock_cc):
+
+    log = [MERGE, COMMIT]
+
+    mock_cc.return_value = len(log)
+    mock_ggl.side_effect = lambda commit=None, rev_range=None, skip=0, \
+        max_count=None: iter(log[skip:][:max_count])
+
+    serial = get_features(use_cache=False)
+    parallel = get_features(use_cache=False, n_jobs=2)
+
+    # each chunk of the log is parsed separately
+    assert mock_ggl.call_count == 1 + len(log)
+    assert parallel.equals(serial)
+
+
+def test_add_time_features():
+
+    # Sun Feb 4 21:55:45 2018 UTC, authored at 15:55:45 -0600 and
+    # Mon Jan 1 03:00:00 2018 UTC, authored at 08:30:00 +0530
+    feats = pd.DataFrame({'timestamp': [1517781345, 1514775600],
+                          'tz_offset': [-6 * 3600, 5 * 3600 + 30 * 60],
+                          'len_message': [10, 20]},
+                         index=['bbb59ea0', '4db4fc24'],
+                         columns=['timestamp', 'tz_offset', 'len_message'])
+
+    utc = add_time_features(feats, 'UTC')
+
+    assert list(utc.columns) == ['dayofweek', 'hour', 'len_message']
+    assert list(utc['dayofweek']) == [6, 0]
+    assert list(utc['hour']) == [21, 3]
+
+    central = add_time_features(feats)
+
+    assert list(central['dayofweek']) == [6, 6]
+    assert list(central['hour']) == [15, 21]
+
+    author = add_time_features(feats, 'author')
+
+    assert list(author['dayofweek']) == [6, 0]
+    assert list(author['hour']) == [15, 8]
+    assert list(author['len_message']) == [10, 20]
+
+
+@mock.patch('gitrisky.parsing.save_feature_cache')
+@mock.patch('gitrisky.parsing.load_feature_cache')
+@mock.patch('gitrisky.parsing.get_head_commit')
+@mock.patch('gitrisky.parsing.is_ancestor')
+@mock.patch('gitrisky.parsing.get_git_log')
+def test_get_features_cached(mock_ggl, mock_isa, mock_ghc, mock_lfc,
+                             mock_sfc):
+
+    # build the cache from scratch
+    mock_ghc.return_value = 'head1'
+    mock_lfc.return_value = (None, None)
+    mock_ggl.return_value = iter([COMMIT])
+
+    feats = get_features()
+
+    mock_ggl.assert_called_once_with(rev_range='head1')
+    assert list(feats.index) == ['bbb59ea0']
+
+    # the raw timestamps are cached rather than the time features
+    cached, head = mock_sfc.call_args[0]
+    assert head == 'head1'
+    assert 'timestamp' in cached.columns
+
+    # the cache is up to date so git log isn't needed
+    mock_ggl.reset_mock()
+    mock_sfc.reset_mock()
+    mock_lfc.return_value = (cached, 'head1')
+
+    assert get_features().equals(feats)
+    assert not mock_ggl.called
+    assert not mock_sfc.called
+
+    # a new commit has been added since the cache was written
+    mock_ghc.return_value = 'head2'
+    mock_isa.return_value = True
+    mock_ggl.return_value = iter([MERGE])
+
+    feats = get_features()
+
+    mock_ggl.assert_called_once_with(rev_range='head1..head2')
+    assert list(feats.index) == ['4db4fc24', 'bbb59ea0']
+    assert mock_sfc.call_args[0][1] == 'head2'
+
+
+@mock.patch('gitrisky.parsing.save_bug_origins')
+@mock.patch('gitrisky.parsing.load_bug_origins')
+@mock.patch('gitrisky.parsing.map_fixes_to_bugs')
+@mock.patch('gitrisky.parsing.get_bugfix_commits')
+@mock.patch('gitrisky.parsing.get_features')
+def test_get_labels_cached(mock_gf, mock_gbc, mock_mftb, mock_lbo, mock_sbo):
+
+    mock_gf.return_value = pd.DataFrame(
+        index=pd.Index(['4db4fc24', 'bbb59ea0', '910cdb3c'], name='hash'))
+    mock_gbc.return_value = ['fix1', 'fix2']
+
+    # fix1 was linked by a previous run
+    mock_lbo.return_value = {'fix1': set(['4db4fc24'])}
+    mock_mftb.return_value = {'fix2': set(['910cdb3c'])}
+
+    labels = get_labels(bug_tags=('BUG',), blame_since='2 years ago')
+
+    # only the new bugfix commit is linked, and then cached
+    mock_lbo.assert_called_once_with(['fix1', 'fix2'], ('BUG',),
+                                     '2 years ago')
+    mock_mftb.assert_called_once_with(['fix2'], n_jobs=1,
+                                      since='2 years ago')
+    mock_sbo.assert_called_once_with({'fix2': set(['910cdb3c'])}, ('BUG',),
+                                     '2 years ago')
+
+    assert list(labels) == [1, 0, 1]
+
+
+@mock.patch('gitrisky.parsing.get_git_log')
+def test_get_features_memo(mock_ggl):
+
+    mock_ggl.side_effect = lambda *args, **kwargs: iter([COMMIT])
+
+    enable_feature_memo()
+
+    try:
+        feats = get_features(use_cache=False)
+        assert get_features(use_cache=False).equals(feats)
+        assert mock_ggl.call_count == 1
+    finally:
+        clear_feature_memo()
+
+    # once the memo is cleared git is read again
+    get_features(use_cache=False)
+    assert mock_ggl.call_count == 2
+
+
+@mock.patch('gitrisky.parsing.link_fixes_to_bugs')
+@mock.patch('gitrisky.parsing.get_bugfix_commits')
+@mock.patch('gitrisky.parsing.get_features')
+def test_get_labels_index(mock_gf, mock_gbc, mock_lftb):
+
+    mock_gbc.return_value = ['fix1']
+    mock_lftb.return_value = ['bbb59ea0']
+
+    labels = get_labels(['4db4fc24', 'bbb59ea0'], use_cache=False)
+
+    # the features aren't needed when the commits are given
+    assert not mock_gf.called
+    assert list(labels.index) == ['4db4fc24', 'bbb59ea0']
+    assert list(labels) == [0, 1]
+
+
+@mock.patch('gitrisky.parsing.MATRIX_CHUNK_SIZE', 1)
+@mock.patch('gitrisky.parsing.count_commits')
+@mock.patch('gitrisky.parsing.get_head_commit')
+@mock.patch('gitrisky.parsing.get_git_log')
+def test_write_feature_matrix(mock_ggl, mock_ghc, mock_cc):
+
+    mock_ggl.side_effect = lambda *args, **kwargs: iter([MERGE, COMMIT])
+    mock_ghc.return_value = 'head1'
+    mock_cc.return_value = 2
+
+    with TemporaryDirectory() as tmpdir:
+
+        path = os.path.join(tmpdir, 'matrix.npy')
+        matrix, hashes, columns = write_feature_matrix(path)
+
+        feats = get_features(use_cache=False)
+
+        assert matrix.dtype == np.float32
+        assert (matrix == feats.values).all()
+        assert list(hashes) == [b'4db4fc24', b'bbb59ea0']
+        assert columns == list(feats.columns)
+
+        # the matrix can be loaded back from the file
+        assert (np.load(path, mmap_mode='r') == matrix).all()
+
+        del matrix
+
+
+@mock.patch('gitrisky.parsing._get_bug_commits')
+def test_get_label_array(mock_gbc):
+
+    mock_gbc.return_value = set(['bbb59ea0'])
+
+    labels = get_label_array(np.array([b'4db4fc24', b'bbb59ea0'], dtype='S8'))
+
+    assert labels.dtype == np.int8
+    assert list(labels) == [0, 1]
@@ -0,0 +1,119 @@
+import json
+import mock
+import os
+import threading
+
+import pandas as pd
+import pytest
+
+from tempfile import TemporaryDirectory
+from urllib.error import HTTPError
+from urllib.request import urlopen
+from gitrisky.server import ModelHolder, make_server
+
+
+FEATURES = pd.DataFrame([[1, 1], [2, 2]],
+                        index=pd.Index(['abcd', 'efgh'], name='hash'))
+
+
+@mock.patch('gitrisky.server.load_model')
+@mock.patch('gitrisky.server._get_model_path')
+def test_model_holder_reload(mock_gmp, mock_load_model):
+
+    with TemporaryDirectory() as tmpdir:
+
+        model_path = os.path.join(tmpdir, 'gitrisky.model')
+        open(model_path, 'w').close()
+
+        mock_gmp.return_value = model_path
+        mock_load_model.side_effect = ['model 1', 'model 2']
+
+        holder = ModelHolder()
+
+        # the model is only loaded again once the file changes
+        assert holder.get_model() == 'model 1'
+        assert holder.get_model() == 'model 1'
+        assert mock_load_model.call_count == 1
+
+        stat = os.stat(model_path)
+        os.utime(model_path, (stat.st_atime, stat.st_mtime + 10))
+
+        assert holder.get_model() == 'model 2'
+        assert mock_load_model.call_count == 2
+
+
+@mock.patch('gitrisky.server.get_features')
+def test_scoring_server(mock_get_features):
+
+    model = mock.MagicMock()
+    model.feature_names_in_ = FEATURES.columns
+    model.timezone_ = 'author'
+    model.predict_proba.return_value = [(0.1, 0.9), (0.75, 0.25)]
+
+    holder = ModelHolder()
+    holder.get_model = mock.MagicMock(return_value=model)
+
+    mock_get_features.return_value = FEATURES
+
+    server = make_server(holder, port=0)
+    url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+
+    try:
+        with urlopen(url + '/score?commit=abcd&commit=efgh') as response:
+            body = json.loads(response.read().decode('utf-8'))
+
+        # the features are computed in the timezone the model was trained in
+        mock_get_features.assert_called_with(['abcd', 'efgh'],
+                                             tz='author')
+        assert body == {'scores': [{'commit': 'abcd', 'score': 0.9},
+                                   {'commit': 'efgh', 'score': 0.25}]}
+
+        with urlopen(url + '/score?range=abcd..efgh') as response:
+            assert response.status == 200
+
+        mock_get_features.assert_called_with(rev_range='abcd..efgh',
+                                             tz='author')
+
+        # asking for nothing to score is an error
+        with pytest.raises(HTTPError) as err:
+            urlopen(url + '/score')
+
+        assert err.value.code == 400
+
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+@mock.patch('gitrisky.gitcmds._stream_bash_command')
+@mock.patch('gitrisky.gitcmds._run_bash_command')
+def test_scoring_server_bad_range(mock_run, mock_stream):
+
+    holder = ModelHolder()
+    holder.get_model = mock.MagicMock()
+
+    server = make_server(holder, port=0)
+    url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+
+    try:
+        # a range which git would take as an option is rejected
+        with pytest.raises(HTTPError) as err:
+            urlopen(url + '/score?range=--output=/tmp/gitrisky-out')
+
+        assert err.value.code == 400
+        assert 'Invalid revision' in err.value.read().decode('utf-8')
+
+        assert not mock_run.called
+        assert not mock_stream.called
+
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
@@ -0,0 +1,58 @@
+import mock
+
+from gitrisky import timings
+
+
+@mock.patch('gitrisky.timings.time.perf_counter')
+def test_stage(mock_perf_counter):
+
+    mock_perf_counter.side_effect = [0.0, 1.0, 2.0, 3.0, 4.0, 4.5, 5.0, 10.0]
+
+    timings.reset()
+
+    # stages which run more than once add up
+    with timings.stage('read features'):
+        pass
+    with timings.stage('fit model'):
+        pass
+    with timings.stage('read features'):
+        pass
+
+    report = timings.get_report()
+
+    assert report['stages'] == {'read features': 1.5, 'fit model': 1.0}
+    assert list(report['stages']) == ['read features', 'fit model']
+    assert report['total_seconds'] == 10.0
+
+
+def test_counts():
+
+    timings.reset()
+
+    timings.record_git_process()
+    timings.record_git_bytes(100)
+    timings.add_counts({'git_processes': 2, 'git_bytes_read': 50})
+
+    assert timings.get_counts() == {'git_processes': 3,
+                                    'git_bytes_read': 150}
+
+    timings.reset()
+
+    assert timings.get_counts() == {'git_processes': 0, 'git_bytes_read': 0}
+
+
+def test_format_report():
+
+    report = {'total_seconds': 2.5,
+              'stages': {'read features': 1.25, 'fit model': 0.5},
+              'git_processes': 3,
+              'git_bytes_read': 2500000,
+              'peak_rss_bytes': None}
+
+    assert timings.format_report(report) == (
+        'read features     1.250s\n'
+        'fit model         0.500s\n'
+        'total             2.500s\n'
+        'git processes started: 3\n'
+        'read from git: 2.5 MB\n'
+        'peak RSS: unknown')
@@ -0,0 +1,181 @@
+"""This module keeps track of where gitrisky spends its time.
+
+Each stage of a command (reading the history, linking fixes to bugs, fitting
+the model, ...) records its wall clock time, and the git commands record how
+many processes they start and how many bytes they read from git. Recording is
+cheap enough to always be on, and 'gitrisky --timings' reports the totals.
+"""
+
+import sys
+import threading
+import time
+
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+_lock = threading.Lock()
+
+# the total wall clock time of each stage, in the order they first ran
+_stages = {}
+
+_counts = {'git_processes': 0, 'git_bytes_read': 0}
+
+_start = time.perf_counter()
+
+
+def reset():
+    """Forget everything recorded so far."""
+
+    global _start
+
+    with _lock:
+        _stages.clear()
+        for key in _counts:
+            _counts[key] = 0
+        _start = time.perf_counter()
+
+
+@contextmanager
+def stage(name):
+    """Time a stage of a command.
+
+    Stages which run more than once, or in several threads, add up.
+
+    Parameters
+    ----------
+    name : str
+        The name of the stage.
+    """
+
+    start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with _lock:
+            _stages[name] = _stages.get(name, 0.0) + elapsed
+
+
+def record_git_process():
+    """Count a git process being started."""
+
+    with _lock:
+        _counts['git_processes'] += 1
+
+
+def record_git_bytes(n_bytes):
+    """Count some bytes of git output being read."""
+
+    with _lock:
+        _counts['git_bytes_read'] += n_bytes
+
+
+def get_counts():
+    """Get the git process and byte counts recorded so far.
+
+    Returns
+    -------
+    counts : dict{str: int}
+        The number of 'git_processes' started and 'git_bytes_read'.
+    """
+
+    with _lock:
+        return dict(_counts)
+
+
+def add_counts(counts):
+    """Add the counts recorded by another process, e.g. a worker.
+
+    Parameters
+    ----------
+    counts : dict{str: int}
+        The counts, as returned by get_counts.
+    """
+
+    with _lock:
+        for key, value in counts.items():
+            _counts[key] += value
+
+
+def _peak_rss():
+    """Get gitrisky's peak resident set size in bytes, or None if unknown.
+
+    The git processes aren't included: on linux a child's peak includes the
+    memory it shared with gitrisky before it exec'd git, so it's misleading.
+    """
+
+    if resource is None:
+        return None
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # linux reports kilobytes, macOS bytes
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def get_report():
+    """Get everything recorded so far.
+
+    Returns
+    -------
+    report : dict
+        The wall clock 'total_seconds' since the last reset, the 'stages'
+        with their seconds, the 'git_processes' and 'git_bytes_read' counts
+        and the 'peak_rss_bytes' of gitrisky.
+    """
+
+    with _lock:
+        report = {'total_seconds': time.perf_counter() - _start,
+                  'stages': dict(_stages)}
+        report.update(_counts)
+
+    report['peak_rss_bytes'] = _peak_rss()
+
+    return report
+
+
+def _format_bytes(n_bytes):
+    if n_bytes is None:
+        return 'unknown'
+    if n_bytes < 1e6:
+        return '{:.1f} kB'.format(n_bytes / 1e3)
+    return '{:.1f} MB'.format(n_bytes / 1e6)
+
+
+def format_report(report):
+    """Format a report as a human readable table.
+
+    Parameters
+    ----------
+    report : dict
+        The report, as returned by get_report.
+
+    Returns
+    -------
+    text : str
+        The formatted report.
+    """
+
+    width = max([len(name) for name in report['stages']] + [len('total')])
+
+    lines = ['{name:<{width}} {seconds:>9.3f}s'
+             .format(name=name, width=width, seconds=seconds)
+             for name, seconds in report['stages'].items()]
+    lines.append('{name:<{width}} {seconds:>9.3f}s'
+                 .format(name='total', width=width,
+                         seconds=report['total_seconds']))
+
+    lines.append('git processes started: {n}'
+                 .format(n=report['git_processes']))
+    lines.append('read from git: {size}'
+                 .format(size=_format_bytes(report['git_bytes_read'])))
+    lines.append('peak RSS: {size}'
+                 .format(size=_format_bytes(report['peak_rss_bytes'])))
+
+    return '\n'.join(lines)
@@ -1,6 +1,10 @@
+import re
+
 from setuptools import setup, find_packages
 
-VERSION = '0.1.3'
+# read the version without importing gitrisky, which may not be installable yet
+with open('gitrisky/__init__.py') as infile:
+    VERSION = re.search(r"__version__ = '(.+)'", infile.read()).group(1)
 
 
 setup(
@@ -22,19 +26,28 @@ setup(
 
     packages=find_packages(),
 
+    python_requires='>=3.8',
+
     install_requires=[
         'click>=6.7',
-        'GitPython>=2.1',
+        'joblib>=0.11',
         'numpy>=1.13',
         'pandas>=0.20',
-        'scikit-learn>=0.19',
+        'scikit-learn>=1.1',
         'scipy>=0.19',
+        'tomli>=1.1; python_version < "3.11"',
         ],
 
+    extras_require={
+        'pygit2': ['pygit2>=1.14'],
+    },
+
     classifiers=[
         'Programming Language :: Python',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
         'Topic :: Software Development :: Version Control :: Git',
         'License :: OSI Approved :: MIT License',
         'Natural Language :: English',